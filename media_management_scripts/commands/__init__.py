@@ -149,22 +149,28 @@ class SubCommand(metaclass=ABCMeta):
 __all__ = [
     "SubCommand",
     "create_test_video",
+    "dupes",
     "combine_subtitles",
+    "commercials",
     #'compare_directories',
     "concat_mp4",
     "convert",
     "executables",
     "find_episodes",
+    "intros",
     "itunes",
     "map_rename",
     "metadata",
     "metadata_compare",
     "movie_rename",
     "rename",
+    "scenes",
     "search",
     "select_streams",
     #'split',
     "subtitles",
     "thumbnail",
+    "trickplay",
     "tv_rename",
+    "verify",
 ]
@@ -52,6 +52,25 @@ class CombineSubtitlesCommand(SubCommand):
         preset = ns.get("preset", DEFAULT_PRESET)
         convert = ns.get("convert", False)
         lang = ns.get("language") if "language" in ns else get_lang(srt_input)
+        filter_chain = None
+        if convert:
+            from media_management_scripts.convert import convert_config_from_ns
+            from media_management_scripts.support.filters import create_filter_chain
+            from media_management_scripts.utils import create_metadata_extractor
+
+            config = convert_config_from_ns(ns)
+            metadata = (
+                create_metadata_extractor().extract(
+                    input_to_cmd,
+                    detect_interlace=config.deinterlace,
+                    detect_interlace_map=config.deinterlace
+                    and config.deinterlace_segments,
+                    detect_crop=config.auto_crop,
+                )
+                if config.deinterlace or config.auto_crop
+                else None
+            )
+            filter_chain = create_filter_chain(config, metadata)
         combine(
             input_to_cmd,
             srt_input,
@@ -60,6 +79,7 @@ class CombineSubtitlesCommand(SubCommand):
             crf=crf,
             preset=preset,
             lang=lang,
+            filter_chain=filter_chain,
         )
 
 
@@ -0,0 +1,105 @@
+from . import SubCommand
+from .common import *
+
+
+class CommercialsCommand(SubCommand):
+    @property
+    def name(self):
+        return "commercials"
+
+    def build_argparse(self, subparser):
+        from media_management_scripts.support.commercials import (
+            ANALYSIS_WIDTH,
+            MAX_COMMERCIAL,
+            MAX_BREAK,
+            MIN_BREAK,
+        )
+
+        parser = subparser.add_parser(
+            "commercials",
+            help="Detect commercial breaks in recordings and optionally remove them",
+            parents=[parent_parser],
+        )
+        parser.add_argument("input", nargs="+", help="Input directories or files")
+        parser.add_argument(
+            "--output",
+            "-o",
+            help="Directory to write copies of the recordings without the commercials to",
+            default=None,
+        )
+        parser.add_argument(
+            "--width",
+            type=int,
+            default=ANALYSIS_WIDTH,
+            help="Width the video is scaled to for the analysis. Default is {}".format(
+                ANALYSIS_WIDTH
+            ),
+        )
+        parser.add_argument(
+            "--max-commercial",
+            type=float,
+            default=MAX_COMMERCIAL,
+            help="Maximum seconds between black & silent boundaries in the same break. Default is {}".format(
+                MAX_COMMERCIAL
+            ),
+        )
+        parser.add_argument(
+            "--min-break",
+            type=float,
+            default=MIN_BREAK,
+            help="Minimum seconds of a break. Default is {}".format(MIN_BREAK),
+        )
+        parser.add_argument(
+            "--max-break",
+            type=float,
+            default=MAX_BREAK,
+            help="Maximum seconds of a break, longer runs of boundaries are kept as part of the recording. Default is {}".format(
+                MAX_BREAK
+            ),
+        )
+        parser.add_argument(
+            "--jobs",
+            help="The number of recordings to analyze at once",
+            type=int,
+            default=None,
+        )
+
+    def subexecute(self, ns):
+        import os
+        from media_management_scripts.convert import remove_ranges
+        from media_management_scripts.support.cache import AnalysisCache
+        from media_management_scripts.support.commercials import (
+            detect_all_commercials,
+        )
+        from media_management_scripts.support.files import get_files_in_directories
+        from media_management_scripts.support.formatting import duration_to_str
+
+        files = sorted(get_files_in_directories(ns["input"]))
+        with AnalysisCache() as cache:
+            results = detect_all_commercials(
+                files,
+                max_workers=ns["jobs"],
+                width=ns["width"],
+                max_commercial=ns["max_commercial"],
+                min_break=ns["min_break"],
+                max_break=ns["max_break"],
+                cache=cache,
+            )
+        output_dir = ns["output"]
+        for file in files:
+            breaks = results[file]
+            print(file)
+            for b in breaks:
+                print(
+                    "   {} - {}".format(
+                        duration_to_str(b.start), duration_to_str(b.end)
+                    )
+                )
+            if not breaks:
+                print("   No commercials found")
+            elif output_dir and not self.dry_run:
+                output = os.path.join(output_dir, os.path.basename(file))
+                remove_ranges(file, output, breaks)
+
+
+SubCommand.register(CommercialsCommand)
@@ -4,13 +4,17 @@ from media_management_scripts.support.encoding import (
     DEFAULT_CRF,
     DEFAULT_PRESET,
     Resolution,
+    SizeFallback,
     SubtitleCodec,
     VideoCodec,
     AudioCodec,
 )
+from media_management_scripts.support.intro import SegmentAction
 from media_management_scripts.support.formatting import (
     duration_from_str,
+    size_from_str,
     DURATION_PATTERN,
+    SIZE_PATTERN,
 )
 
 
@@ -23,6 +27,13 @@ class DurationType:
         return duration_from_str(value)
 
 
+class SizeType:
+    def __call__(self, value):
+        if not SIZE_PATTERN.match(value):
+            raise argparse.ArgumentTypeError("'{}' is not a valid size".format(value))
+        return size_from_str(value)
+
+
 parent_parser = argparse.ArgumentParser(add_help=False)
 parent_parser.add_argument(
     "--print-args", action="store_const", const=True, default=False
@@ -82,6 +93,42 @@ convert_parent_parser.add_argument(
     help="Attempt to detect interlacing and remove it",
 )
 convert_parent_parser.add_argument("--deinterlace-threshold", type=float, default=0.5)
+convert_parent_parser.add_argument(
+    "--deinterlace-segments",
+    action="store_const",
+    const=True,
+    default=False,
+    help="Detect interlacing per segment and only deinterlace the interlaced time ranges of mixed content",
+)
+convert_parent_parser.add_argument(
+    "--no-inverse-telecine",
+    action="store_const",
+    const=False,
+    default=True,
+    dest="inverse_telecine",
+    help="Deinterlace telecined content instead of recovering the progressive frames with fieldmatch/decimate",
+)
+convert_parent_parser.add_argument(
+    "--auto-crop",
+    action="store_const",
+    const=True,
+    default=False,
+    help="Detect black bars (letterboxing) and crop them",
+)
+convert_parent_parser.add_argument(
+    "--segments",
+    default=None,
+    choices=[a.value for a in SegmentAction],
+    help="Mark the intro & credits found by the intros command as chapters or drop them. "
+    "Only segments at the start or end of a file can be dropped",
+)
+convert_parent_parser.add_argument(
+    "--scene-chapters",
+    type=float,
+    default=None,
+    metavar="SECONDS",
+    help="Add chapters about every SECONDS, starting on scene cuts, to inputs without chapters",
+)
 convert_parent_parser.add_argument(
     "--add-ripped-metadata",
     action="store_const",
@@ -109,6 +156,35 @@ convert_parent_parser.add_argument(
     type=DurationType(),
     help="End time of the input in 00h00m00.00s format",
 )
+convert_parent_parser.add_argument(
+    "--filter-threads",
+    type=int,
+    default=None,
+    dest="filter_threads",
+    help="The number of threads used to process the video filters. Default is ffmpeg's choice",
+)
+convert_parent_parser.add_argument(
+    "--keep-duplicate-commentary",
+    dest="drop_duplicate_commentary",
+    action="store_const",
+    const=False,
+    default=True,
+    help="Keep commentary audio tracks that duplicate another commentary track",
+)
+convert_parent_parser.add_argument(
+    "--max-size-ratio",
+    type=float,
+    default=None,
+    dest="max_size_ratio",
+    help="Abort the conversion when the output is projected to be larger than this ratio of the input (eg 1.0)",
+)
+convert_parent_parser.add_argument(
+    "--size-fallback",
+    default=SizeFallback.REMUX.value,
+    dest="size_fallback",
+    choices=[f.value for f in SizeFallback],
+    help="What to do when --max-size-ratio is exceeded: remux the input, retry with a higher CRF or nothing. Default: remux",
+)
 
 start_end_parser = argparse.ArgumentParser(add_help=False)
 start_end_parser.add_argument(
@@ -193,5 +269,6 @@ __all__ = [
     "start_end_parser",
     # Argparse types/actions
     "DurationType",
+    "SizeType",
     "VideoCodecAction",
 ]
@@ -4,14 +4,118 @@ import argparse
 import os
 from media_management_scripts.support.files import get_input_output, movie_files_filter
 from media_management_scripts.convert import convert_with_config
+from media_management_scripts.utils import parse_renditions
+from media_management_scripts.support.cache import DEFAULT_CACHE_FILE
+from media_management_scripts.support.encode_stats import (
+    DEFAULT_STATS_FILE,
+    EncodeStatsDatabase,
+)
 
 
-def _bulk_convert(i, o, config, overwrite, dry_run):
+def _convert(
+    i,
+    o,
+    config,
+    overwrite=False,
+    dry_run=False,
+    target_ssim=None,
+    target_size=None,
+    cache_file=DEFAULT_CACHE_FILE,
+    stats_db=None,
+    on_size_limit=None,
+):
+    from contextlib import nullcontext
+    from media_management_scripts.support.cache import AnalysisCache
+
+    target = target_ssim is not None or target_size is not None
+    if target or config.auto_crop or config.segments or config.scene_chapters:
+        cache_context = AnalysisCache(cache_file)
+    else:
+        cache_context = nullcontext()
+    with cache_context as cache:
+        if target:
+            from media_management_scripts.support.crf_search import (
+                convert_with_target,
+            )
+
+            return convert_with_target(
+                i,
+                o,
+                config,
+                target_ssim=target_ssim,
+                target_size=target_size,
+                cache=cache,
+                print_output=True,
+                overwrite=overwrite,
+                dry_run=dry_run,
+                stats_db=stats_db,
+                on_size_limit=on_size_limit,
+            )
+        return convert_with_config(
+            i,
+            o,
+            config,
+            print_output=True,
+            overwrite=overwrite,
+            dry_run=dry_run,
+            stats_db=stats_db,
+            on_size_limit=on_size_limit,
+            cache=cache,
+        )
+
+
+def _bulk_convert(i, o, config, **kwargs):
     print("Starting {}".format(i))
     os.makedirs(os.path.dirname(o), exist_ok=True)
-    convert_with_config(
-        i, o, config, print_output=True, overwrite=overwrite, dry_run=dry_run
+    _convert(i, o, config, **kwargs)
+
+
+def _print_queue_estimate(files, config, stats_db):
+    from texttable import Texttable
+    from media_management_scripts.support.encode_stats import EncodePredictor
+    from media_management_scripts.support.formatting import duration_to_str, sizeof_fmt
+    from media_management_scripts.utils import create_metadata_extractor
+
+    extractor = create_metadata_extractor()
+    metadata = [extractor.extract(i) for i, o in files]
+    estimates, total = EncodePredictor(stats_db).estimate_queue(
+        (m, config) for m in metadata
     )
+    table = [["Input", "Time", "Size"]]
+    for (i, o), e in zip(files, estimates):
+        table.append(
+            [
+                i,
+                duration_to_str(e.seconds) if e.seconds is not None else "Unknown",
+                sizeof_fmt(e.size) if e.size is not None else "Unknown",
+            ]
+        )
+    table.append(["Total", duration_to_str(total.seconds), sizeof_fmt(total.size)])
+    t = Texttable(max_width=0)
+    t.set_deco(Texttable.VLINES | Texttable.HEADER | Texttable.BORDER)
+    t.add_rows(table)
+    print(t.draw())
+    if total.records < len(files):
+        print("{} files could not be estimated".format(len(files) - total.records))
+
+
+def _print_size_limit_decisions(decisions):
+    from texttable import Texttable
+    from media_management_scripts.support.formatting import sizeof_fmt
+
+    table = [["Input", "Projected", "Limit", "Fallback"]]
+    for d in decisions:
+        fallback = d.fallback.value
+        if d.crf is not None:
+            fallback = "{} {}".format(fallback, d.crf)
+        table.append(
+            [d.input, sizeof_fmt(d.projected_size), sizeof_fmt(d.limit), fallback]
+        )
+    print("{} conversions were projected to be too large".format(len(decisions)))
+    t = Texttable(max_width=0)
+    t.set_deco(Texttable.VLINES | Texttable.HEADER | Texttable.BORDER)
+    t.add_rows(table)
+    print(t.draw())
 
 
 class ConvertCommand(SubCommand):
@@ -33,6 +137,12 @@ class ConvertCommand(SubCommand):
         convert --scale 480
     Use NVIDIA Hardware acceleration w/ HEVC/H.265
         convert --hardware-nvidia --vc h265 <input> <output>
+    Find the highest CRF with an SSIM of at least 0.98 by encoding samples
+        convert --target-ssim 0.98 <input> <output>
+    Find the lowest CRF with an output of at most 2GB
+        convert --target-size 2G <input> <output>
+    Decode once and encode 1080p, 720p & 480p copies (<output> - 720p.mkv, etc)
+        convert --renditions 1080,720,480 <input> <output>
         """
 
         convert_parser = subparser.add_parser(
@@ -54,6 +164,40 @@ class ConvertCommand(SubCommand):
             help="Use a difference extension for the output files",
             default=None,
         )
+        convert_parser.add_argument(
+            "--renditions",
+            type=parse_renditions,
+            default=None,
+            help="Comma separated heights to encode from a single decode. The first is written to the output, the others are suffixed with their height",
+        )
+        convert_parser.add_argument(
+            "--target-ssim",
+            type=float,
+            default=None,
+            help="Search for the highest CRF with at least this SSIM (0-1) using encoded samples",
+        )
+        convert_parser.add_argument(
+            "--target-size",
+            type=SizeType(),
+            default=None,
+            help="Search for the lowest CRF with an output no larger than this size (eg 700M, 2G) using encoded samples",
+        )
+        convert_parser.add_argument(
+            "--cache",
+            default=DEFAULT_CACHE_FILE,
+            dest="cache_file",
+            help="The file to cache sample results and detected crops in. Default={}".format(
+                DEFAULT_CACHE_FILE
+            ),
+        )
+        convert_parser.add_argument(
+            "--stats-db",
+            default=None,
+            dest="stats_db",
+            help="Records conversions to this file to estimate the time & size of future ones in dry run mode, for example {}".format(
+                DEFAULT_STATS_FILE
+            ),
+        )
 
     def subexecute(self, ns):
         import os
@@ -66,6 +210,15 @@ class ConvertCommand(SubCommand):
         bulk_ext = ns["bulk_ext"]
         config = convert_config_from_ns(ns)
         dry_run = ns["dry_run"]
+        stats_db = EncodeStatsDatabase(ns["stats_db"]) if ns["stats_db"] else None
+        options = {
+            "overwrite": overwrite,
+            "dry_run": dry_run,
+            "target_ssim": ns["target_ssim"],
+            "target_size": ns["target_size"],
+            "cache_file": ns["cache_file"],
+            "stats_db": stats_db,
+        }
 
         if os.path.isdir(input_to_cmd):
             if bulk:
@@ -83,24 +236,24 @@ class ConvertCommand(SubCommand):
                             files,
                         )
                     )
+                if dry_run and stats_db is not None:
+                    _print_queue_estimate(files, config, stats_db)
+                decisions = []
                 self._bulk(
                     files,
-                    lambda i, o: _bulk_convert(i, o, config, overwrite, dry_run),
+                    lambda i, o: _bulk_convert(
+                        i, o, config, on_size_limit=decisions.append, **options
+                    ),
                     ["Input", "Output"],
                 )
+                if decisions:
+                    _print_size_limit_decisions(decisions)
             else:
                 print("Cowardly refusing to convert a directory without --bulk flag")
         elif not overwrite and os.path.exists(output):
             print("Cowardly refusing to overwrite existing file: {}".format(output))
         else:
-            convert_with_config(
-                input_to_cmd,
-                output,
-                config,
-                print_output=True,
-                overwrite=overwrite,
-                dry_run=dry_run,
-            )
+            _convert(input_to_cmd, output, config, **options)
 
 
 SubCommand.register(ConvertCommand)
@@ -0,0 +1,83 @@
+from . import SubCommand
+from .common import *
+
+
+class DupesCommand(SubCommand):
+    @property
+    def name(self):
+        return "dupes"
+
+    def build_argparse(self, subparser):
+        from media_management_scripts.support.dupes import (
+            DEFAULT_FRAMES,
+            DEFAULT_THRESHOLD,
+        )
+
+        parser = subparser.add_parser(
+            "dupes",
+            help="Find copies of the same video at different resolutions or bitrates",
+            parents=[parent_parser],
+        )
+        parser.add_argument("input", nargs="+", help="Input directories or files")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=DEFAULT_THRESHOLD,
+            help="Maximum average differing bits (of 64) per sampled frame. Default is {}".format(
+                DEFAULT_THRESHOLD
+            ),
+        )
+        parser.add_argument(
+            "--frames",
+            type=int,
+            default=DEFAULT_FRAMES,
+            help="Number of frames sampled per file. Default is {}".format(
+                DEFAULT_FRAMES
+            ),
+        )
+        parser.add_argument(
+            "--jobs",
+            help="The number of files to process at once. Default is the number of CPUs",
+            type=int,
+            default=None,
+        )
+
+    def subexecute(self, ns):
+        from media_management_scripts.support.cache import AnalysisCache
+        from media_management_scripts.support.dupes import (
+            compute_signatures,
+            find_duplicates,
+            rank_duplicates,
+        )
+        from media_management_scripts.support.files import get_files_in_directories
+        from media_management_scripts.support.formatting import bitrate_to_str
+        from media_management_scripts.utils import create_metadata_extractor
+
+        files = sorted(set(get_files_in_directories(ns["input"])))
+        with AnalysisCache() as cache:
+            signatures = compute_signatures(
+                files, ns["frames"], cache=cache, max_workers=ns["jobs"]
+            )
+        groups = find_duplicates(signatures, ns["threshold"])
+        extractor = create_metadata_extractor()
+        for group in groups:
+            ranked = rank_duplicates([extractor.extract(f) for f in group])
+            print("Duplicates:")
+            for i, metadata in enumerate(ranked):
+                video = metadata.video_streams[0]
+                print(
+                    "  {} {} ({}x{} {} {})".format(
+                        "*" if i == 0 else " ",
+                        metadata.file,
+                        video.width,
+                        video.height,
+                        video.codec,
+                        bitrate_to_str(metadata.bit_rate),
+                    )
+                )
+        print(
+            "Found {} duplicate sets in {} files".format(len(groups), len(signatures))
+        )
+
+
+SubCommand.register(DupesCommand)
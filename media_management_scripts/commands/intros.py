@@ -0,0 +1,69 @@
+from . import SubCommand
+from .common import *
+
+
+class IntrosCommand(SubCommand):
+    @property
+    def name(self):
+        return "intros"
+
+    def build_argparse(self, subparser):
+        from media_management_scripts.support.intro import HEAD_SECONDS, TAIL_SECONDS
+
+        parser = subparser.add_parser(
+            "intros",
+            help="Find the intro & credits shared by the episodes of a season",
+            parents=[parent_parser],
+        )
+        parser.add_argument("input", help="Season directory")
+        parser.add_argument(
+            "--head",
+            type=int,
+            default=HEAD_SECONDS,
+            help="Seconds from the start of each episode to search for the intro. Default is {}".format(
+                HEAD_SECONDS
+            ),
+        )
+        parser.add_argument(
+            "--tail",
+            type=int,
+            default=TAIL_SECONDS,
+            help="Seconds from the end of each episode to search for the credits. Default is {}".format(
+                TAIL_SECONDS
+            ),
+        )
+        parser.add_argument(
+            "--jobs",
+            help="The number of episodes to analyze at once",
+            type=int,
+            default=None,
+        )
+
+    def subexecute(self, ns):
+        from media_management_scripts.support.cache import AnalysisCache
+        from media_management_scripts.support.formatting import duration_to_str
+        from media_management_scripts.support.intro import (
+            detect_segments,
+            season_files,
+        )
+
+        files = season_files(ns["input"])
+        with AnalysisCache() as cache:
+            results = detect_segments(
+                files, ns["head"], ns["tail"], cache=cache, max_workers=ns["jobs"]
+            )
+        for file in files:
+            print(file)
+            if not results[file]:
+                print("   No intro or credits found")
+            for segment in results[file]:
+                print(
+                    "   {}: {} - {}".format(
+                        segment.title,
+                        duration_to_str(segment.start),
+                        duration_to_str(segment.end),
+                    )
+                )
+
+
+SubCommand.register(IntrosCommand)
@@ -27,16 +27,23 @@ class MetadataCommand(SubCommand):
         metadata_parser.add_argument(
             "--interlace",
             help="Try to detect interlacing",
-            choices=["none", "summary", "report"],
+            choices=["none", "summary", "report", "map"],
             default="none",
         )
+        metadata_parser.add_argument(
+            "--crop",
+            help="Detect black bars to crop",
+            action="store_const",
+            const=True,
+            default=False,
+        )
 
     def subexecute(self, ns):
         input_to_cmd = ns["input"]
         if ns["json"]:
-            print_metadata_json(input_to_cmd, ns["interlace"])
+            print_metadata_json(input_to_cmd, ns["interlace"], ns["crop"])
         else:
-            print_metadata(input_to_cmd, ns["popup"], ns["interlace"])
+            print_metadata(input_to_cmd, ns["popup"], ns["interlace"], ns["crop"])
 
 
 SubCommand.register(MetadataCommand)
@@ -46,6 +53,8 @@ import json
 from itertools import groupby
 
 from media_management_scripts.utils import create_metadata_extractor
+from media_management_scripts.support.telecine import classify
+from media_management_scripts.support.cache import AnalysisCache
 from media_management_scripts.support.formatting import (
     sizeof_fmt,
     duration_to_str,
@@ -74,15 +83,23 @@ class Encoder(json.JSONEncoder):
         return o.to_dict()
 
 
-def print_metadata_json(input, interlace="none"):
+def _extract(input, interlace="none", crop=False):
     extractor = create_metadata_extractor()
-    meta = extractor.extract(input, interlace != "none")
+    if crop:
+        with AnalysisCache() as cache:
+            return extractor.extract(
+                input, interlace != "none", interlace == "map", True, cache
+            )
+    return extractor.extract(input, interlace != "none", interlace == "map")
+
+
+def print_metadata_json(input, interlace="none", crop=False):
+    meta = _extract(input, interlace, crop)
     print(json.dumps(meta, cls=Encoder))
 
 
-def print_metadata(input, show_popup=False, interlace="none"):
-    extractor = create_metadata_extractor()
-    meta = extractor.extract(input, interlace != "none")
+def print_metadata(input, show_popup=False, interlace="none", crop=False):
+    meta = _extract(input, interlace, crop)
     o = []
 
     o.append(os.path.basename(input))
@@ -131,6 +148,18 @@ def print_metadata(input, show_popup=False, interlace="none"):
     if meta.interlace_report:
         if interlace == "summary":
             o.append(output("Interlaced: {}", meta.interlace_report.is_interlaced()))
+            o.append(output("Scan type: {}", classify(meta.interlace_report).value))
+        elif interlace == "map":
+            o.append(output("Interlaced: {}", meta.interlace_report.is_interlaced()))
+            for segment in meta.interlace_map.segments:
+                o.append(
+                    output(
+                        "  {}-{}: {:.2f}%",
+                        duration_to_str(segment.start),
+                        duration_to_str(segment.end),
+                        segment.report.ratio * 100,
+                    )
+                )
         elif interlace == "report":
             o.append(output("Interlaced:"))
             single = meta.interlace_report.single
@@ -155,6 +184,31 @@ def print_metadata(input, show_popup=False, interlace="none"):
                     multi.ratio * 100,
                 )
             )
+            repeated = meta.interlace_report.repeated
+            if repeated:
+                o.append(
+                    output(
+                        "  Repeated Fields: Neither={}, Top={}, Bottom={} ({:.2f}%)",
+                        repeated.neither,
+                        repeated.top,
+                        repeated.bottom,
+                        repeated.ratio * 100,
+                    )
+                )
+            o.append(output("  Scan type: {}", classify(meta.interlace_report).value))
+
+    if crop:
+        video = meta.video_streams[0] if meta.video_streams else None
+        if meta.crop and video:
+            o.append(
+                output(
+                    "Crop: {} ({:.2f}% of pixels removed)",
+                    meta.crop,
+                    meta.crop.removed_ratio(video.width, video.height) * 100,
+                )
+            )
+        else:
+            o.append(output("Crop: None"))
 
     final = "\n".join(o)
     if show_popup:
@@ -0,0 +1,62 @@
+from . import SubCommand
+from .common import *
+
+
+class ScenesCommand(SubCommand):
+    @property
+    def name(self):
+        return "scenes"
+
+    def build_argparse(self, subparser):
+        from media_management_scripts.support.scenes import (
+            ANALYSIS_WIDTH,
+            SCENE_THRESHOLD,
+        )
+
+        parser = subparser.add_parser(
+            "scenes",
+            help="Index the scene cuts of videos for thumbnails, CRF samples and chapters",
+            parents=[parent_parser],
+        )
+        parser.add_argument("input", nargs="+", help="Input directories or files")
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=SCENE_THRESHOLD,
+            help="Scene change score (0-1) above which a frame starts a new scene. Default is {}".format(
+                SCENE_THRESHOLD
+            ),
+        )
+        parser.add_argument(
+            "--width",
+            type=int,
+            default=ANALYSIS_WIDTH,
+            help="Width the video is scaled to for the analysis. Default is {}".format(
+                ANALYSIS_WIDTH
+            ),
+        )
+        parser.add_argument(
+            "--jobs",
+            help="The number of videos to index at once. Default is 1",
+            type=int,
+            default=1,
+        )
+
+    def subexecute(self, ns):
+        from media_management_scripts.support.cache import AnalysisCache
+        from media_management_scripts.support.files import get_files_in_directories
+        from media_management_scripts.support.scenes import index_scenes
+
+        files = sorted(get_files_in_directories(ns["input"]))
+        with AnalysisCache() as cache:
+            count = index_scenes(
+                files,
+                cache,
+                threshold=ns["threshold"],
+                width=ns["width"],
+                max_workers=ns["jobs"],
+            )
+        print("Indexed {} of {} files".format(count, len(files)))
+
+
+SubCommand.register(ScenesCommand)
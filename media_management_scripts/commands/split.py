@@ -18,12 +18,33 @@ class SplitCommand(SubCommand):
             type=int,
         )
 
+        mode_group = split_parser.add_mutually_exclusive_group()
+        mode_group.add_argument(
+            "--accurate",
+            help="Re-encode the video to start exactly at the start time instead of the keyframe before it",
+            action="store_const",
+            const=True,
+            default=False,
+        )
+        mode_group.add_argument(
+            "--smart",
+            help="Cut exactly by only re-encoding the partial GOPs at the start & end",
+            action="store_const",
+            const=True,
+            default=False,
+        )
+        split_parser.add_argument(
+            "--jobs",
+            help="The number of inputs to split by chapters at once. Default is 2",
+            type=int,
+            default=None,
+        )
         split_parser.add_argument("input", nargs="+", help="Input directory")
         split_parser.add_argument("--output", "-o", default="./", dest="output")
 
     def subexecute(self, ns):
         from media_management_scripts.support.files import get_files_in_directories
-        from media_management_scripts.support.split import split_by_chapter
+        from media_management_scripts.support.split import split_all_by_chapter
         from media_management_scripts.convert import cut
         import os
 
@@ -32,16 +53,21 @@ class SplitCommand(SubCommand):
         output = ns["output"]
         if ns.get("by_chapters", None) is not None:
             chapters = ns["by_chapters"]
-            count = 0
-            for file in get_files_in_directories(input_to_cmd):
-                count += split_by_chapter(file, output, chapters, initial_count=count)
-                # print(file)
+            files = list(get_files_in_directories(input_to_cmd))
+            split_all_by_chapter(files, output, chapters, max_workers=ns["jobs"])
         else:
             if os.path.isdir(output):
                 raise Exception("Output cannot be a directory")
             start = ns["start"]
             end = ns.get("end")
-            cut(input_to_cmd[0], output, start, end)
+            cut(
+                input_to_cmd[0],
+                output,
+                start,
+                end,
+                accurate=ns["accurate"],
+                smart=ns["smart"],
+            )
 
 
 SubCommand.register(SplitCommand)
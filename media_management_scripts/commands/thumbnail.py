@@ -1,11 +1,6 @@
-from media_management_scripts.convert import convert_subtitles_to_srt
 from . import SubCommand
 from .common import *
-import os
-import math
-from ..utils import extract_metadata
-from ..support.formatting import duration_from_str
-from ..support.executables import ffmpeg, execute_with_output
+from ..support.thumbnails import ThumbnailSelection, create_thumbnails
 
 
 class ThumbnailCommand(SubCommand):
@@ -26,39 +21,41 @@ class ThumbnailCommand(SubCommand):
             type=int,
             help="Number of thumbnails to generate. Default is 10",
         )
-
-    def _output_format(self, output, number):
-        basename, ext = os.path.splitext(os.path.basename(output))
-        dir = os.path.dirname(output)
-        count = math.floor(math.log10(number)) + 1
-        output_file = basename + "%0" + str(count) + "d" + ext
-        return os.path.join(dir, output_file)
+        parser.add_argument(
+            "--select",
+            default=ThumbnailSelection.KEYFRAME.value,
+            choices=[s.value for s in ThumbnailSelection],
+            help="How to pick the frame for each thumbnail: the keyframe at the target time, or the sharpest or "
+            "least black of the next few keyframes. Default: keyframe",
+        )
+        parser.add_argument(
+            "--jobs",
+            help="The number of thumbnails to extract at once",
+            type=int,
+            default=None,
+        )
 
     def subexecute(self, ns):
-        input_to_cmd = ns["input"]
-        output = ns.get("output", None)
-        number = ns.get("count", 10)
-        start = ns.get("start", None)
-        end = ns.get("end", None)
-
-        output = self._output_format(output, number)
-        duration = extract_metadata(input_to_cmd).estimated_duration
-
-        if end:
-            duration = end
-        if start:
-            duration -= start
-
-        every_frame = str(number / duration)
-
-        args = [ffmpeg(), "-y"]
-        if start:
-            args.extend(["-ss", str(start)])
-        if end:
-            args.extend(["-to", str(end)])
-        args.extend(["-i", input_to_cmd, "-vf", "fps=" + every_frame, output])
-        print(args)
-        execute_with_output(args, print_output=True)
+        from media_management_scripts.support.cache import AnalysisCache
+        from media_management_scripts.utils import create_metadata_extractor
+
+        extractor = create_metadata_extractor()
+        metadata = extractor.extract(ns["input"])
+        with AnalysisCache() as cache:
+            # Use the scenes if the scenes command has indexed the file
+            extractor.add_scenes(metadata, cache, detect=False)
+        outputs = create_thumbnails(
+            ns["input"],
+            ns["output"],
+            count=ns.get("count", 10),
+            start=ns.get("start", None),
+            end=ns.get("end", None),
+            selection=ThumbnailSelection(ns["select"]),
+            metadata=metadata,
+            max_workers=ns["jobs"],
+        )
+        for output in outputs:
+            print(output)
 
 
 SubCommand.register(ThumbnailCommand)
@@ -0,0 +1,67 @@
+from . import SubCommand
+from .common import *
+
+
+class TrickplayCommand(SubCommand):
+    @property
+    def name(self):
+        return "trickplay"
+
+    def build_argparse(self, subparser):
+        parser = subparser.add_parser(
+            "trickplay",
+            help="Create scrub preview sprite sheets for every video in directories",
+            parents=[parent_parser],
+        )
+        parser.add_argument("input", nargs="+", help="Input directories or files")
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=10,
+            help="Seconds between thumbnails. Default is 10",
+        )
+        parser.add_argument(
+            "--width",
+            type=int,
+            default=320,
+            help="Width of each thumbnail. Default is 320",
+        )
+        parser.add_argument(
+            "--tile",
+            default="10x10",
+            help="Thumbnails per sheet as columns x rows. Default is 10x10",
+        )
+        parser.add_argument(
+            "--jobs",
+            help="The number of files to process at once",
+            type=int,
+            default=None,
+        )
+        parser.add_argument(
+            "-y",
+            "--overwrite",
+            help="Recreate the sheets even if the file has not changed",
+            action="store_const",
+            default=False,
+            const=True,
+        )
+
+    def subexecute(self, ns):
+        from media_management_scripts.support.files import get_files_in_directories
+        from media_management_scripts.support.trickplay import (
+            TrickplaySettings,
+            create_all_trickplay,
+        )
+
+        columns, rows = [int(x) for x in ns["tile"].lower().split("x")]
+        settings = TrickplaySettings(
+            interval=ns["interval"], width=ns["width"], columns=columns, rows=rows
+        )
+        files = sorted(get_files_in_directories(ns["input"]))
+        count = create_all_trickplay(
+            files, settings, overwrite=ns["overwrite"], max_workers=ns["jobs"]
+        )
+        print("Created trickplay for {} of {} files".format(count, len(files)))
+
+
+SubCommand.register(TrickplayCommand)
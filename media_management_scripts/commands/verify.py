@@ -0,0 +1,91 @@
+from . import SubCommand
+from .common import *
+
+
+class VerifyCommand(SubCommand):
+    @property
+    def name(self):
+        return "verify"
+
+    def build_argparse(self, subparser):
+        from media_management_scripts.support.verify import IO_WORKERS, VerifyMode
+
+        parser = subparser.add_parser(
+            "verify",
+            help="Decode check every video in directories for corruption",
+            parents=[parent_parser],
+        )
+        parser.add_argument("input", nargs="+", help="Input directories or files")
+        parser.add_argument(
+            "--mode",
+            default=VerifyMode.FULL.value,
+            choices=[m.value for m in VerifyMode],
+            help="Decode every frame, only keyframes, or a few sampled windows of each file. Default: full",
+        )
+        parser.add_argument(
+            "--jobs",
+            help="The number of files to check at once. Default is the number of CPUs",
+            type=int,
+            default=None,
+        )
+        parser.add_argument(
+            "--io-jobs",
+            help="The number of files to read at once from each disk. Default is {}".format(
+                IO_WORKERS
+            ),
+            type=int,
+            default=IO_WORKERS,
+        )
+        parser.add_argument(
+            "--force",
+            action="store_const",
+            const=True,
+            default=False,
+            help="Check files again even if they are unchanged since they were last checked",
+        )
+
+    def subexecute(self, ns):
+        from media_management_scripts.support.cache import AnalysisCache
+        from media_management_scripts.support.files import (
+            get_files_in_directories,
+            movie_files_filter,
+        )
+        from media_management_scripts.support.verify import VerifyMode, verify_files
+
+        files = sorted(get_files_in_directories(ns["input"], movie_files_filter))
+        checked = []
+
+        def report(result, cached):
+            if not cached:
+                checked.append(result)
+            if not result.ok:
+                print(
+                    "Failed{}: {}".format(
+                        " (previously)" if cached else "", result.file
+                    )
+                )
+                for error in result.errors:
+                    print("   {}".format(error))
+
+        with AnalysisCache() as cache:
+            results = verify_files(
+                files,
+                cache,
+                mode=VerifyMode(ns["mode"]),
+                max_workers=ns["jobs"],
+                io_workers=ns["io_jobs"],
+                force=ns["force"],
+                callback=report,
+            )
+        failed = len([r for r in results if not r.ok])
+        print(
+            "{} files: {} ok, {} failed, {} unchanged since they were last checked".format(
+                len(results),
+                len(results) - failed,
+                failed,
+                len(results) - len(checked),
+            )
+        )
+
+
+SubCommand.register(VerifyCommand)
@@ -1,6 +1,10 @@
 import logging
+import math
 import os
-from typing import List, Optional
+import re
+import tempfile
+import time
+from typing import Callable, List, NamedTuple, Optional, Tuple
 
 from texttable import Texttable
 
@@ -8,23 +12,47 @@ from media_management_scripts.support.encoding import (
     DEFAULT_PRESET,
     DEFAULT_CRF,
     Resolution,
+    SizeFallback,
     SubtitleCodec,
     resolution_name,
     VideoCodec,
     AudioCodec,
 )
 from media_management_scripts.support.executables import (
+    ERROR_OUTPUT_LINES,
+    FFMpegProgress,
+    create_ffmpeg_callback,
     execute_with_output,
     ffmpeg,
     nice_exe,
     log_command,
 )
+from media_management_scripts.support.filters import (
+    VideoFilterChain,
+    create_filter_chain,
+    cropped_height,
+)
+from media_management_scripts.support.stream_plan import create_stream_plan
+from media_management_scripts.support.encode_stats import (
+    CRF_DOUBLING,
+    EncodePredictor,
+    EncodeStatsDatabase,
+    create_record,
+    encode_duration,
+)
 from media_management_scripts.support.files import (
     check_exists,
     create_dirs,
     get_input_output,
 )
 from media_management_scripts.support.formatting import sizeof_fmt
+from media_management_scripts.support.intro import (
+    SEGMENTS_CACHE_KEY,
+    SegmentAction,
+    ffmetadata_uri,
+    segment_chapters,
+    trim_segments,
+)
 from media_management_scripts.utils import (
     create_metadata_extractor,
     ConvertConfig,
@@ -34,6 +62,56 @@ from media_management_scripts.support.ttml2srt import convert_to_srt
 
 logger = logging.getLogger(__name__)
 
+# Projections are noisy until this fraction of the output has been encoded
+MIN_PROJECTION_PROGRESS = 0.05
+MAX_CRF = 51
+
+RESOLUTION_SUFFIX_PATTERN = re.compile(r" - \d+p$")
+
+# ffprobe's profile names to x264/x265's
+ENCODER_PROFILES = {
+    "Baseline": "baseline",
+    "Constrained Baseline": "baseline",
+    "Main": "main",
+    "High": "high",
+    "High 10": "high10",
+    "High 4:2:2": "high422",
+    "High 4:4:4 Predictive": "high444",
+    "Main 10": "main10",
+}
+
+
+class ProjectedSizeExceeded(Exception):
+    def __init__(self, projected_size: int, limit: int):
+        super().__init__(
+            "Projected size {} is larger than the limit of {}".format(
+                sizeof_fmt(projected_size), sizeof_fmt(limit)
+            )
+        )
+        self.projected_size = projected_size
+        self.limit = limit
+
+
+class SizeLimitDecision(NamedTuple):
+    """
+    Records that a conversion was aborted for being too large and what was done instead
+    """
+
+    input: str
+    projected_size: int
+    limit: int
+    fallback: SizeFallback
+    crf: Optional[int] = None
+
+    def __repr__(self):
+        return "<SizeLimitDecision: input={}, projected={}, limit={}, fallback={}, crf={}>".format(
+            self.input,
+            sizeof_fmt(self.projected_size),
+            sizeof_fmt(self.limit),
+            self.fallback.value,
+            self.crf,
+        )
+
 
 def convert_config_from_ns(ns):
     vars = {}
@@ -44,70 +122,29 @@ def convert_config_from_ns(ns):
 
 
 def execute(args, print_output=True):
-    ret, r = execute_with_output(args, print_output)
+    ret, r = execute_with_output(args, print_output, max_lines=ERROR_OUTPUT_LINES)
     return ret
 
 
-def auto_bitrate_from_config(resolution, convert_config: ConvertConfig):
-    if convert_config.scale:
-        resolution = resolution_name(convert_config.scale)
-    if resolution == Resolution.LOW_DEF:
-        return convert_config.auto_bitrate_240
-    elif resolution == Resolution.STANDARD_DEF:
-        return convert_config.auto_bitrate_480
-    elif resolution == Resolution.MEDIUM_DEF:
-        return convert_config.auto_bitrate_720
-    elif resolution == Resolution.HIGH_DEF:
-        return convert_config.auto_bitrate_1080
-    elif resolution == Resolution.ULTRA_HIGH_DEF:
-        return convert_config.auto_bitrate_2160
-    else:
-        raise Exception("No auto bitrate for {}".format(resolution))
-
-
-def convert_with_config(
-    input,
-    output,
-    config: ConvertConfig,
-    print_output=True,
-    overwrite=False,
-    metadata=None,
-    mappings=None,
-    use_nice=True,
-    dry_run=False,
-):
+def _size_limit_callback(duration: float, limit: int) -> Callable[[str], None]:
     """
-
-    :param input:
-    :param output:
-    :param config:
-    :param print_output:
-    :param overwrite:
-    :param metadata:
-    :param mappings: List of mappings (for example ['0:0', '0:1'])
-    :return:
+    Creates an ffmpeg output callback that raises ProjectedSizeExceeded when the average bitrate so far projects an
+    output larger than the limit
     """
-    if not overwrite and check_exists(output):
-        return -1
-    if print_output:
-        print("Converting {} -> {}".format(input, output))
-        print("Using config: {}".format(config))
 
-    if not metadata:
-        metadata = create_metadata_extractor().extract(
-            input, detect_interlace=config.deinterlace
-        )
-    elif config.deinterlace and not metadata.interlace_report:
-        raise Exception(
-            "Metadata provided without interlace report, but convert requires deinterlace checks"
-        )
+    def check(progress: FFMpegProgress):
+        bits = progress.bitrate_as_bits
+        if bits is None or progress.progress(duration) < MIN_PROJECTION_PROGRESS:
+            return
+        projected = int(bits / 8 * duration)
+        if projected > limit:
+            raise ProjectedSizeExceeded(projected, limit)
 
-    if use_nice and nice_exe:
-        args = [nice_exe, ffmpeg()]
-    else:
-        args = [ffmpeg()]
-    if overwrite:
-        args.append("-y")
+    return create_ffmpeg_callback(check)
+
+
+def _trim_args(config: ConvertConfig, metadata) -> List[str]:
+    args = []
     if config.start:
         args.extend(["-ss", str(config.start)])
     if config.end:
@@ -120,17 +157,96 @@ def convert_with_config(
             raise Exception(
                 "Could not estimate duration, so negative end time cannot be used"
             )
+    return args
 
-    if config.hardware_nvidia:
-        args.extend(["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"])
 
-    args.extend(["-i", input])
+def _end_time(config: ConvertConfig, duration: float) -> float:
+    """
+    The time in the input the output ends at
+    """
+    if config.end:
+        return config.end if config.end > 0 else duration + config.end
+    return duration
 
-    if config.scale:
-        if config.hardware_nvidia:
-            args.extend(["-vf", "scale_cuda=-1:{}".format(config.scale)])
-        else:
-            args.extend(["-vf", "scale=-1:{}".format(config.scale)])
+
+def _segment_args(
+    input, config: ConvertConfig, metadata, cache
+) -> Tuple[ConvertConfig, List[str]]:
+    """
+    Applies the intro & credits found by the intros command. Dropped segments at the start or end of the file are
+    trimmed, the rest are marked as chapters
+    :return: the config with any new start & end, and the input args for the chapters
+    """
+    if cache is None:
+        raise Exception("Applying segments requires the analysis cache")
+    segments = cache.get(input, SEGMENTS_CACHE_KEY)
+    if not segments or not metadata.estimated_duration:
+        return config, []
+    duration = metadata.estimated_duration
+    end = _end_time(config, duration)
+    if SegmentAction(config.segments) == SegmentAction.DROP:
+        new_start, new_end, segments = trim_segments(segments, duration)
+        if new_start is not None:
+            config = config._replace(start=max(config.start or 0, new_start))
+        if new_end is not None and new_end < end:
+            end = new_end
+            config = config._replace(end=end)
+        for s in segments:
+            logger.warning(
+                "Cannot drop the {} of {} at {:.1f}-{:.1f}s, marking it as a chapter instead".format(
+                    s.kind.value, input, s.start, s.end
+                )
+            )
+    if not segments:
+        return config, []
+    chapters = segment_chapters(
+        segments, end, metadata.chapters, offset=config.start or 0
+    )
+    return config, ["-f", "ffmetadata", "-i", ffmetadata_uri(chapters)]
+
+
+def _scene_chapter_args(input, config: ConvertConfig, metadata, cache) -> List[str]:
+    """
+    Chapters about every config.scene_chapters seconds starting on scene cuts, for an input without any
+    :return: the input args for the chapters
+    """
+    if metadata.chapters or not metadata.estimated_duration:
+        return []
+    create_metadata_extractor().add_scenes(metadata, cache)
+    if metadata.scenes is None:
+        return []
+    chapters = metadata.scenes.chapters(
+        config.scene_chapters,
+        offset=config.start or 0,
+        end=_end_time(config, metadata.estimated_duration),
+    )
+    if len(chapters) < 2:
+        return []
+    return ["-f", "ffmetadata", "-i", ffmetadata_uri(chapters)]
+
+
+def auto_bitrate_from_config(resolution, convert_config: ConvertConfig):
+    if convert_config.scale:
+        resolution = resolution_name(convert_config.scale)
+    if resolution == Resolution.LOW_DEF:
+        return convert_config.auto_bitrate_240
+    elif resolution == Resolution.STANDARD_DEF:
+        return convert_config.auto_bitrate_480
+    elif resolution == Resolution.MEDIUM_DEF:
+        return convert_config.auto_bitrate_720
+    elif resolution == Resolution.HIGH_DEF:
+        return convert_config.auto_bitrate_1080
+    elif resolution == Resolution.ULTRA_HIGH_DEF:
+        return convert_config.auto_bitrate_2160
+    else:
+        raise Exception("No auto bitrate for {}".format(resolution))
+
+
+def _video_encoder_args(config: ConvertConfig, metadata) -> List[str]:
+    """
+    The video codec, quality & bitrate arguments for an output
+    """
+    args = []
     if config.hardware_nvidia:
         vc = VideoCodec.from_code_name(config.video_codec).nvidia_codec_name
         if not vc:
@@ -183,59 +299,319 @@ def convert_with_config(
         args.extend(["-crf", str(crf)])
 
     args.extend(["-preset", config.preset])
+    return args
 
-    if config.deinterlace:
-        is_interlaced = metadata.interlace_report.is_interlaced(
-            config.deinterlace_threshold
-        )
-        if print_output:
-            print(
-                "{} - Interlaced: {}".format(metadata.interlace_report, is_interlaced)
-            )
-        if is_interlaced:
-            # Video is interlaced, so add the deinterlace filter
-            args.extend(["-vf", "yadif"])
-
-    args.extend(["-c:a", config.audio_codec])
-
-    index = 0
-    for audio in metadata.audio_streams:
-        if audio.channels == 7:
-            # 6.1 sound, so mix it up to 7.1
-            args.extend(["-ac:a:{}".format(index), "8"])
-        index += 1
 
+def _create_stream_plan(metadata, config: ConvertConfig, output, mappings):
     include_subtitles = (
         config.include_subtitles
         and config.subtitle_codec != SubtitleCodec.NONE.ffmpeg_codec_name
     )
+    return create_stream_plan(
+        metadata,
+        config.audio_codec,
+        config.subtitle_codec if include_subtitles else None,
+        output=output,
+        mappings=mappings,
+        drop_duplicate_commentary=config.drop_duplicate_commentary,
+        # Stream copied audio does not line up with a trimmed, transcoded video
+        copy_matching=not (config.start or config.end),
+    )
 
-    if include_subtitles:
-        args.extend(["-c:s", config.subtitle_codec])
 
-    if not mappings:
-        if metadata.video_streams:
-            args.extend(["-map", "0:v"])
-        if metadata.audio_streams:
-            args.extend(["-map", "0:a"])
-        if metadata.subtitle_streams and include_subtitles:
-            args.extend(["-map", "0:s"])
+def rendition_outputs(output: str, renditions: Optional[Tuple[int, ...]]) -> List[str]:
+    """
+    The output file of each rendition. The first rendition is the output itself and the rest are suffixed with their
+    height, replacing an existing resolution suffix: 'Movie (2000) - 1080p.mkv' -> 'Movie (2000) - 720p.mkv'
+    """
+    if not renditions:
+        return [output]
+    base, ext = os.path.splitext(output)
+    base = RESOLUTION_SUFFIX_PATTERN.sub("", base)
+    outputs = [output]
+    for height in renditions[1:]:
+        outputs.append("{} - {}p{}".format(base, height, ext))
+    return outputs
+
+
+def convert_with_config(
+    input,
+    output,
+    config: ConvertConfig,
+    print_output=True,
+    overwrite=False,
+    metadata=None,
+    mappings=None,
+    use_nice=True,
+    dry_run=False,
+    stats_db: Optional[EncodeStatsDatabase] = None,
+    on_size_limit: Optional[Callable[[SizeLimitDecision], None]] = None,
+    cache=None,
+    log_file: Optional[str] = None,
+):
+    """
+
+    :param input:
+    :param output:
+    :param config:
+    :param print_output:
+    :param overwrite:
+    :param metadata:
+    :param mappings: List of mappings (for example ['0:0', '0:1'])
+    :param stats_db: records the conversion's speed & size, in dry run mode it is used to print an estimate
+    :param on_size_limit: called when config.max_size_ratio aborts the conversion with what was done instead
+    :param cache: an AnalysisCache for the detected crop, the intro & credits for config.segments and the scene cuts
+        for config.scene_chapters
+    :param log_file: append ffmpeg's full output to this file, only the end of it is kept in memory
+    :return:
+    """
+    if config.renditions and config.scale:
+        raise Exception("Renditions cannot be combined with scale")
+    output_files = rendition_outputs(output, config.renditions)
+    if not overwrite and any([check_exists(o) for o in output_files]):
+        return -1
+    if print_output:
+        print("Converting {} -> {}".format(input, ", ".join(output_files)))
+        print("Using config: {}".format(config))
+
+    if not metadata:
+        metadata = create_metadata_extractor().extract(
+            input,
+            detect_interlace=config.deinterlace,
+            detect_interlace_map=config.deinterlace and config.deinterlace_segments,
+        )
+    elif config.deinterlace and not metadata.interlace_report:
+        raise Exception(
+            "Metadata provided without interlace report, but convert requires deinterlace checks"
+        )
+    elif config.deinterlace and config.deinterlace_segments:
+        create_metadata_extractor().add_interlace_map(metadata)
+    if config.auto_crop and not config.hardware_nvidia:
+        create_metadata_extractor().add_crop(metadata, cache)
+    chapter_args = []
+    if config.segments:
+        config, chapter_args = _segment_args(input, config, metadata, cache)
+    if config.scene_chapters and not chapter_args:
+        chapter_args = _scene_chapter_args(input, config, metadata, cache)
+
+    filter_chain = create_filter_chain(config, metadata, print_output)
+    if config.renditions:
+        # Decode & filter once, then split the frames for each rendition's scale & encoder
+        source_height = metadata.video_streams[0].height
+        heights = [
+            h if not source_height or h < source_height else None
+            for h in config.renditions
+        ]
+        if filter_chain.has("crop"):
+            heights = [cropped_height(h, metadata) if h else h for h in heights]
+        graph, labels = filter_chain.build_split(heights)
+        outputs = list(
+            zip(output_files, [config._replace(scale=h) for h in heights], labels)
+        )
     else:
-        for m in mappings:
-            if type(m) == int:
-                args.extend(["-map", "0:{}".format(m)])
-            else:
-                args.extend(["-map", m])
+        outputs = [(output, config, None)]
 
-    if config.include_meta:
-        args.extend(["-metadata", "ripped=true"])
-        args.extend(["-metadata:s:v:0", "ripped=true"])
-    args.append(output)
+    if use_nice and nice_exe:
+        args = [nice_exe, ffmpeg()]
+    else:
+        args = [ffmpeg()]
+    if overwrite:
+        args.append("-y")
+    args.extend(filter_chain.thread_args(complex_graph=bool(config.renditions)))
+    args.extend(_trim_args(config, metadata))
+
+    if config.hardware_nvidia:
+        args.extend(["-hwaccel", "cuda", "-hwaccel_output_format", "cuda"])
+
+    args.extend(["-i", input])
+    args.extend(chapter_args)
+
+    if config.renditions:
+        args.extend(["-filter_complex", graph])
+    for out, out_config, label in outputs:
+        if label:
+            args.extend(["-map", "[{}]".format(label)])
+        else:
+            args.extend(filter_chain.to_args())
+        args.extend(_video_encoder_args(out_config, metadata))
+        stream_plan = _create_stream_plan(metadata, out_config, out, mappings)
+        if print_output:
+            for planned in stream_plan:
+                print(planned)
+        args.extend(stream_plan.to_args(include_video=label is None))
+        if chapter_args:
+            args.extend(["-map_chapters", "1"])
+
+        if config.include_meta:
+            args.extend(["-metadata", "ripped=true"])
+            args.extend(["-metadata:s:v:0", "ripped=true"])
+        args.append(out)
 
     if dry_run:
         log_command(args, True)
+        if stats_db is not None and not config.renditions:
+            estimate = EncodePredictor(stats_db).estimate(metadata, config)
+            print("Estimate: {}".format(estimate))
     else:
-        return execute(args, print_output)
+        callback = None
+        # ffmpeg reports the progress of all renditions combined, so size limits & stats only apply to single outputs
+        if (
+            config.max_size_ratio
+            and metadata.estimated_duration
+            and not config.renditions
+        ):
+            callback = _size_limit_callback(
+                encode_duration(metadata, config),
+                int(metadata.size * config.max_size_ratio),
+            )
+        start_time = time.monotonic()
+        try:
+            ret, ffmpeg_output = execute_with_output(
+                args,
+                print_output,
+                callback=callback,
+                max_lines=ERROR_OUTPUT_LINES,
+                log_file=log_file,
+            )
+        except ProjectedSizeExceeded as e:
+            return _size_fallback(
+                input,
+                output,
+                config,
+                metadata,
+                e,
+                print_output=print_output,
+                mappings=mappings,
+                use_nice=use_nice,
+                stats_db=stats_db,
+                on_size_limit=on_size_limit,
+                log_file=log_file,
+            )
+        if ret == 0 and stats_db is not None and not config.renditions:
+            try:
+                record = create_record(
+                    input,
+                    output,
+                    metadata,
+                    config,
+                    time.monotonic() - start_time,
+                    ffmpeg_output,
+                )
+                stats_db.record(record)
+            except Exception:
+                logger.exception("Unable to record encode stats for {}".format(input))
+        return ret
+
+
+def _size_fallback(
+    input,
+    output,
+    config: ConvertConfig,
+    metadata,
+    exceeded: ProjectedSizeExceeded,
+    print_output=True,
+    mappings=None,
+    use_nice=True,
+    stats_db=None,
+    on_size_limit=None,
+    log_file=None,
+):
+    fallback = SizeFallback(config.size_fallback)
+    crf = None
+    if fallback == SizeFallback.CRF:
+        # Raise the CRF enough to bring the bitrate down to the limit
+        crf = config.crf + max(
+            1,
+            math.ceil(
+                CRF_DOUBLING * math.log2(exceeded.projected_size / exceeded.limit)
+            ),
+        )
+        if config.hardware_nvidia or (
+            config.bitrate is not None and config.bitrate != "disabled"
+        ):
+            logger.debug("CRF does not control the size, remuxing instead")
+            fallback, crf = SizeFallback.REMUX, None
+        elif crf > MAX_CRF:
+            fallback, crf = SizeFallback.REMUX, None
+    decision = SizeLimitDecision(
+        input, exceeded.projected_size, exceeded.limit, fallback, crf
+    )
+    logger.warning("Aborted conversion: {}".format(decision))
+    if print_output:
+        print("Aborted conversion: {}".format(decision))
+    if on_size_limit:
+        on_size_limit(decision)
+
+    if fallback == SizeFallback.CRF:
+        return convert_with_config(
+            input,
+            output,
+            config._replace(crf=crf, size_fallback=SizeFallback.REMUX.value),
+            print_output=print_output,
+            overwrite=True,
+            metadata=metadata,
+            mappings=mappings,
+            use_nice=use_nice,
+            stats_db=stats_db,
+            on_size_limit=on_size_limit,
+            log_file=log_file,
+        )
+    elif fallback == SizeFallback.REMUX:
+        return remux_with_config(
+            input,
+            output,
+            config,
+            metadata,
+            mappings,
+            print_output,
+            use_nice,
+            log_file=log_file,
+        )
+    if os.path.exists(output):
+        os.remove(output)
+    return -1
+
+
+def remux_with_config(
+    input,
+    output,
+    config: ConvertConfig,
+    metadata=None,
+    mappings=None,
+    print_output=True,
+    use_nice=True,
+    log_file: Optional[str] = None,
+):
+    """
+    Copies the streams of the input into the output container, honoring the start, end & subtitles of the config
+    """
+    if not metadata:
+        metadata = create_metadata_extractor().extract(input)
+    args = [ffmpeg(), "-y"]
+    args.extend(_trim_args(config, metadata))
+    args.extend(["-i", input, "-c:v", "copy"])
+    include_subtitles = (
+        config.include_subtitles
+        and config.subtitle_codec != SubtitleCodec.NONE.ffmpeg_codec_name
+    )
+    stream_plan = create_stream_plan(
+        metadata,
+        AudioCodec.COPY.ffmpeg_codec_name,
+        SubtitleCodec.COPY.ffmpeg_codec_name if include_subtitles else None,
+        output=output,
+        mappings=mappings,
+        drop_duplicate_commentary=config.drop_duplicate_commentary,
+    )
+    args.extend(stream_plan.to_args())
+    args.append(output)
+    ret, _ = execute_with_output(
+        args,
+        print_output,
+        use_nice=use_nice,
+        max_lines=ERROR_OUTPUT_LINES,
+        log_file=log_file,
+    )
+    return ret
 
 
 def create_remux_args(
@@ -303,7 +679,12 @@ def combine(
     crf=DEFAULT_CRF,
     preset=DEFAULT_PRESET,
     skip_eia_608=True,
+    filter_chain: Optional[VideoFilterChain] = None,
 ):
+    """
+    Adds a subtitle file to a video as a new stream
+    :param filter_chain: video filters to apply, only used if convert is True
+    """
     if not overwrite and check_exists(output):
         return -1
 
@@ -314,7 +695,10 @@ def combine(
         convert_to_srt(srt, srt_out)
         srt = srt_out
     create_dirs(output)
-    args = [ffmpeg(), "-i", video]
+    args = [ffmpeg()]
+    if convert and filter_chain:
+        args.extend(filter_chain.thread_args())
+    args.extend(["-i", video])
     if overwrite:
         args.append("-y")
     args.extend(["-i", srt])
@@ -327,6 +711,8 @@ def combine(
         args.extend(["-map", "0:s?"])
     args.extend(["-map", "1:0"])
     if convert:
+        if filter_chain:
+            args.extend(filter_chain.to_args())
         args.extend(["-c:v", "libx264", "-crf", str(crf), "-preset", preset])
         args.extend(["-c:a", "aac"])
     else:
@@ -340,21 +726,246 @@ def combine(
     return execute(args)
 
 
-def cut(input, output, start=None, end=None):
+def _smart_render_encoder_args(video, config: ConvertConfig) -> List[str]:
+    """
+    Encoder arguments matching the source video stream so re-encoded frames can be joined with copied ones
+    """
+    try:
+        codec = VideoCodec.from_code_name(video.codec)
+    except ValueError:
+        codec = None
+    if codec is None or codec == VideoCodec.COPY:
+        raise Exception("Smart render does not support {}".format(video.codec))
+    args = ["-c:v", codec.ffmpeg_encoder_name]
+    if video.pix_fmt:
+        args.extend(["-pix_fmt", video.pix_fmt])
+    if codec in (VideoCodec.H264, VideoCodec.H265):
+        profile = ENCODER_PROFILES.get(video.profile)
+        if profile:
+            args.extend(["-profile:v", profile])
+        args.extend(["-crf", str(config.crf), "-preset", config.preset])
+    if codec == VideoCodec.H264 and video.level and video.level > 0:
+        args.extend(["-level:v", "{:.1f}".format(video.level / 10)])
+    return args
+
+
+def _smart_cut(
+    input,
+    output,
+    start,
+    end,
+    config: ConvertConfig,
+    metadata,
+    print_output=True,
+):
+    """
+    Re-encodes only the partial GOPs at the start and end, stream copies the GOPs in between and joins them.
+
+    Parts are cut by frame count rather than duration so no frame is duplicated or dropped at the joins. This assumes
+    closed GOPs (frames before a keyframe do not reference frames after it), which is the x264 default.
+    """
+    extractor = create_metadata_extractor()
+    extractor.add_keyframes(metadata)
+    video = metadata.video_streams[0]
+    fps = video.frame_rate
+    start = start or 0
+    end = end or metadata.estimated_duration
+    first = metadata.keyframes.after(start)
+    last = metadata.keyframes.before(end)
+    if not fps or not first or not last or first.time >= last.time:
+        logger.info("No complete GOP to copy in {}, re-encoding".format(input))
+        return cut(input, output, start, end, True, config, metadata, print_output)
+
+    encoder_args = _smart_render_encoder_args(video, config)
+    with tempfile.TemporaryDirectory() as tmp:
+        parts = []
+
+        def add_part(seek, frames, codec_args):
+            file = os.path.join(tmp, "part{}.mkv".format(len(parts)))
+            args = [ffmpeg(), "-y"]
+            if seek:
+                args.extend(["-ss", str(seek)])
+            args.extend(["-i", input, "-map", "0:v:0", "-frames:v", str(frames)])
+            args.extend(codec_args)
+            args.append(file)
+            ret = execute(args, print_output)
+            if ret != 0:
+                raise Exception("Error creating smart render part: {}".format(ret))
+            parts.append((file, frames / fps))
+
+        head = round((first.time - start) * fps)
+        if head > 0:
+            add_part(start, head, encoder_args)
+        seek, _ = metadata.keyframes.seek_position(first.time)
+        add_part(
+            seek,
+            round((last.time - first.time) * fps),
+            ["-c:v", "copy", "-avoid_negative_ts", "make_zero"],
+        )
+        tail = round((end - last.time) * fps)
+        if tail > 0:
+            add_part(last.time, tail, encoder_args)
+        logger.info(
+            "Smart render of {}: re-encoding {} frames, copying {}".format(
+                input, head + tail, round((last.time - first.time) * fps)
+            )
+        )
+
+        concat_file = os.path.join(tmp, "concat.txt")
+        with open(concat_file, "w") as f:
+            for file, duration in parts:
+                # Explicit durations keep the encoder delay of each part from leaving gaps
+                f.write("file '{}'\nduration {}\n".format(file, duration))
+        args = [ffmpeg(), "-f", "concat", "-safe", "0", "-i", concat_file]
+        if start:
+            args.extend(["-ss", str(start)])
+        args.extend(["-i", input, "-t", str(end - start)])
+        args.extend(["-map", "0:v", "-map", "1:a?", "-map", "1:s?", "-c", "copy"])
+        # Drop the audio & subtitles before the start that the input seek landed on
+        args.extend(["-copypriorss", "0"])
+        args.append(output)
+        return execute(args, print_output)
+
+
+def cut(
+    input,
+    output,
+    start=None,
+    end=None,
+    accurate=False,
+    config: Optional[ConvertConfig] = None,
+    metadata=None,
+    print_output=True,
+    smart=False,
+):
+    """
+    Cuts the input between start and end without re-encoding.
+
+    Seeking before the input jumps straight to the start instead of demuxing everything before it. A stream copy can
+    only start on a keyframe, so the start is moved back to the keyframe at or before it, which is printed.
+
+    :param start: the start time in seconds
+    :param end: the end time in seconds
+    :param accurate: re-encode the video so the output starts exactly at the start
+    :param config: the ConvertConfig for re-encoding the video if accurate or smart is set
+    :param metadata: the Metadata of the input
+    :param smart: only re-encode the partial GOPs at the start & end so the cut is exact, but mostly copied
+    :return:
+    """
     if check_exists(output):
         return -1
     create_dirs(output)
-    args = [ffmpeg(), "-i", input]
-    args.extend(["-c:v", "copy"])
+    if smart and accurate:
+        raise Exception("Smart render and accurate cuts cannot be combined")
+    if smart:
+        if metadata is None:
+            metadata = create_metadata_extractor().extract(input)
+        return _smart_cut(
+            input, output, start, end, config or ConvertConfig(), metadata, print_output
+        )
+    seek, actual_start = start, start
+    if start and not accurate:
+        extractor = create_metadata_extractor()
+        if metadata is None:
+            metadata = extractor.extract(input)
+        extractor.add_keyframes(metadata)
+        seek, actual_start = metadata.keyframes.seek_position(start)
+        if seek and end and seek >= end:
+            seek = start
+        logger.info(
+            "Cutting {} from keyframe {} instead of {}".format(
+                input, actual_start, start
+            )
+        )
+        if print_output:
+            print("Actual start: {:.3f} (requested {:.3f})".format(actual_start, start))
+
+    args = [ffmpeg()]
+    if seek:
+        args.extend(["-ss", str(seek)])
+    args.extend(["-i", input])
+    if end:
+        # Timestamps restart at zero after an input seek
+        args.extend(["-t", str(end - (seek or 0))])
+    args.extend(["-map", "0"])
+    if accurate:
+        if metadata is None:
+            metadata = create_metadata_extractor().extract(input)
+        args.extend(_video_encoder_args(config or ConvertConfig(), metadata))
+    else:
+        args.extend(["-c:v", "copy"])
+        # Keep the frames between the keyframe and the seek position
+        args.extend(["-avoid_negative_ts", "make_zero"])
     args.extend(["-c:a", "copy"])
     args.extend(["-c:s", "copy"])
-    args.extend(["-map", "0"])
-    if start:
-        args.extend(["-ss", str(start)])
-    if end:
-        args.extend(["-to", str(end)])
     args.append(output)
-    return execute(args)
+    return execute(args, print_output)
+
+
+def remove_ranges(
+    input,
+    output,
+    ranges: List[Tuple[float, float]],
+    metadata=None,
+    print_output=True,
+):
+    """
+    Removes the time ranges (eg commercial breaks) from the input without re-encoding.
+
+    Each part that is kept is cut with a stream copy. A part starts at the first keyframe after the range before it,
+    so no frames of a removed range are kept. The parts are then joined with the concat demuxer.
+    :param ranges: the sorted (start, end) times to remove
+    :return: the ffmpeg return code
+    """
+    if check_exists(output):
+        return -1
+    create_dirs(output)
+    extractor = create_metadata_extractor()
+    if metadata is None:
+        metadata = extractor.extract(input)
+    extractor.add_keyframes(metadata)
+    duration = metadata.estimated_duration
+    keep = []
+    position = 0.0
+    for start, end in list(ranges) + [(duration, duration)]:
+        if start > position:
+            keep.append((position, start))
+        position = max(position, end)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        parts = []
+        for start, end in keep:
+            if start > 0:
+                keyframe = metadata.keyframes.after(start)
+                if keyframe is None or keyframe.time >= end:
+                    continue
+                start = keyframe.time
+            file = os.path.join(tmp, "part{}.mkv".format(len(parts)))
+            ret = cut(
+                input,
+                file,
+                start or None,
+                end,
+                metadata=metadata,
+                print_output=print_output,
+            )
+            if ret != 0:
+                raise Exception("Error cutting {}-{} of {}".format(start, end, input))
+            parts.append((file, end - start))
+        if not parts:
+            raise Exception("Nothing left of {} to keep".format(input))
+        logger.info(
+            "Removing {} ranges from {}, keeping {:.1f}s".format(
+                len(ranges), input, sum(d for f, d in parts)
+            )
+        )
+        concat_file = os.path.join(tmp, "concat.txt")
+        with open(concat_file, "w") as f:
+            for file, part_duration in parts:
+                f.write("file '{}'\nduration {}\n".format(file, part_duration))
+        args = [ffmpeg(), "-f", "concat", "-safe", "0", "-i", concat_file]
+        args.extend(["-map", "0", "-c", "copy", output])
+        return execute(args, print_output)
 
 
 def main(input_dir, output_dir, config):
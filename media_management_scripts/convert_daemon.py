@@ -7,18 +7,39 @@ import shlex
 import shutil
 import sqlite3
 import subprocess
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Tuple, NamedTuple
-
-from media_management_scripts.convert import convert_with_config
+from typing import List, Optional, Tuple, NamedTuple
+
+from media_management_scripts.convert import convert_with_config, rendition_outputs
+from media_management_scripts.support.cache import DEFAULT_CACHE_FILE, AnalysisCache
+from media_management_scripts.support.encode_stats import (
+    EncodePredictor,
+    EncodeStatsDatabase,
+)
 from media_management_scripts.support.files import create_dirs, get_input_output
-from media_management_scripts.utils import convert_config_from_config_section
+from media_management_scripts.support.formatting import sizeof_fmt
+from media_management_scripts.support.verify import (
+    VerifyMode,
+    VerifyResult,
+    verify_output,
+)
+from media_management_scripts.utils import (
+    ConvertConfig,
+    convert_config_from_config_section,
+    create_metadata_extractor,
+)
 
 logger = logging.getLogger(__name__)
 
 TV_NAME_REGEX = re.compile(r".+ - S\d{2,}E\d{2,}(-E\d{2,})?( - .+)?\.mkv")
 MOVIE_NAME_REGEX = re.compile(r".+ \(\d{4}\)( - .+)?\.mkv")
 
+# The number of times a file is converted in a run if its output fails verification
+VERIFY_ATTEMPTS = 2
+
 
 class ConvertDvdResults(NamedTuple):
     movie_processed_count: int
@@ -49,12 +70,23 @@ class ProcessStatus:
         )
 
 
+class PendingVerification(NamedTuple):
+    input_file: str
+    output_file: str
+    temp_file: str
+    status: ProcessStatus
+    future: Future
+
+
 class ProcessedDatabase:
     def __init__(self, db):
         self.conn = sqlite3.connect(db)
         self.conn.execute(
             "CREATE TABLE IF NOT EXISTS processed(input PRIMARY KEY, output VARCHAR, backup BOOLEAN, convert BOOLEAN);"
         )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS verified(output PRIMARY KEY, input VARCHAR, ok BOOLEAN, mode VARCHAR, errors VARCHAR, verified_at REAL);"
+        )
         self.conn.commit()
 
     def get(self, input_file, output_file):
@@ -79,6 +111,45 @@ class ProcessedDatabase:
         )
         self.conn.commit()
 
+    def save_verification(self, input_file, result: VerifyResult):
+        logger.debug("Saving: {}".format(result))
+        self.conn.execute(
+            "REPLACE INTO verified (output, input, ok, mode, errors, verified_at) VALUES (?, ?, ?, ?, ?, ?);",
+            (
+                result.file,
+                input_file,
+                result.ok,
+                result.mode.value,
+                "\n".join(result.errors),
+                result.verified_at,
+            ),
+        )
+        self.conn.commit()
+
+    def get_verification(self, output_file) -> Optional[VerifyResult]:
+        row = self.conn.execute(
+            "SELECT mode, errors, verified_at FROM verified WHERE output = ?",
+            (output_file,),
+        ).fetchone()
+        if not row:
+            return None
+        errors = row[1].split("\n") if row[1] else []
+        return VerifyResult(output_file, VerifyMode(row[0]), errors, row[2])
+
+
+def _estimate_sort_key(estimate):
+    # Files without an estimate go last
+    seconds = estimate.seconds if estimate else None
+    return seconds is None, seconds or 0
+
+
+def _uses_cache(convert_config: ConvertConfig) -> bool:
+    return bool(
+        convert_config.auto_crop
+        or convert_config.segments
+        or convert_config.scene_chapters
+    )
+
 
 class ConvertDvds:
     def __init__(self, config_file):
@@ -123,6 +194,42 @@ class ConvertDvds:
                 logging.config.dictConfig(log_config)
         db_file = config.get("logging", "db", fallback="processed.shelve")
         self.db = ProcessedDatabase(db_file)
+        stats_file = config.get("logging", "stats.db", fallback=None)
+        self.stats_db = EncodeStatsDatabase(stats_file) if stats_file else None
+        # The detected crop & scene cuts are stored by fingerprint, so they are not detected again when a file is
+        # re-queued, and the intro & credits found by the intros command are read from it
+        self.cache = None
+        if _uses_cache(self.movie_convert_config) or _uses_cache(
+            self.tv_convert_config
+        ):
+            cache_file = config.get(
+                "logging", "analysis.cache", fallback=DEFAULT_CACHE_FILE
+            )
+            self.cache = AnalysisCache(os.path.expanduser(cache_file))
+        # Each conversion's full ffmpeg output is written here, only the end of it is kept in memory
+        self.ffmpeg_log_dir = config.get("logging", "ffmpeg.dir", fallback=None)
+
+        # Scheduler
+        self.schedule_order = config.get("scheduler", "order", fallback="name")
+        if self.schedule_order not in ("name", "shortest"):
+            raise Exception("Unknown scheduler order: {}".format(self.schedule_order))
+        # Minutes per run, 0 is unlimited
+        self.time_limit = config.getint("scheduler", "time.limit", fallback=0)
+        self._deadline = None
+        self.size_limit_count = 0
+
+        # Verification
+        verify_mode = config.get("verify", "mode", fallback=VerifyMode.KEYFRAMES.value)
+        if verify_mode == "none":
+            self.verify_mode = None
+        else:
+            try:
+                self.verify_mode = VerifyMode(verify_mode)
+            except ValueError:
+                raise Exception("Unknown verify mode: {}".format(verify_mode))
+        # Outputs are verified one at a time while the next file converts
+        self._verifier = ThreadPoolExecutor(max_workers=1)
+        self._pending: List[PendingVerification] = []
 
     def backup_file(self, file, target_dir) -> subprocess.Popen:
         target_path = os.path.join(self.backup_path, target_dir)
@@ -198,22 +305,39 @@ class ConvertDvds:
         if not status.convert and not os.path.exists(output_file):
             # Start convert
             logger.debug("Not converted: {}".format(input_file))
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
+            for temp in rendition_outputs(temp_file, convert_config.renditions):
+                if os.path.exists(temp):
+                    os.remove(temp)
             result = convert_with_config(
-                input_file, temp_file, convert_config, print_output=False
+                input_file,
+                temp_file,
+                convert_config,
+                print_output=False,
+                stats_db=self.stats_db,
+                on_size_limit=self._size_limit,
+                cache=self.cache,
+                log_file=self._ffmpeg_log_file(input_file),
             )
-            if result == 0:
+            if result == 0 and self.verify_mode:
                 logger.debug("Conversion successful for {}".format(input_file))
-                shutil.copyfile(temp_file, output_file)
+                future = self._verifier.submit(
+                    self._verify, input_file, output_file, temp_file, convert_config
+                )
+                self._pending.append(
+                    PendingVerification(
+                        input_file, output_file, temp_file, status, future
+                    )
+                )
+            elif result == 0:
+                logger.debug("Conversion successful for {}".format(input_file))
+                self._finish_outputs(temp_file, output_file, convert_config, True)
                 status.convert = True
             else:
                 logger.error(
                     "Error converting: code={}, file={}".format(result, input_file)
                 )
                 error = True
-            if os.path.exists(temp_file):
-                os.remove(temp_file)
+                self._finish_outputs(temp_file, output_file, convert_config, False)
         if backup_popen:
             logger.debug("Waiting for backup...")
             ret_code = backup_popen.wait()
@@ -230,13 +354,163 @@ class ConvertDvds:
                 error = True
         return not error
 
+    def _ffmpeg_log_file(self, input_file) -> Optional[str]:
+        if not self.ffmpeg_log_dir:
+            return None
+        log_file = os.path.join(
+            self.ffmpeg_log_dir, os.path.basename(input_file) + ".log"
+        )
+        create_dirs(log_file)
+        return log_file
+
+    def _finish_outputs(
+        self, temp_file, output_file, convert_config: ConvertConfig, keep: bool
+    ):
+        """
+        Copies the converted temp files to their final location if they are kept, then removes them
+        """
+        temps = rendition_outputs(temp_file, convert_config.renditions)
+        if keep:
+            outputs = rendition_outputs(output_file, convert_config.renditions)
+            for temp, output in zip(temps, outputs):
+                shutil.copyfile(temp, output)
+        for temp in temps:
+            if os.path.exists(temp):
+                os.remove(temp)
+
+    def _verify(
+        self, input_file, output_file, temp_file, convert_config: ConvertConfig
+    ) -> List[VerifyResult]:
+        """
+        Verifies the converted temp files and only moves them to their final location if they all pass.
+        This runs on the verifier thread, so it does not touch the database.
+        :return: the result for each output
+        """
+        results = []
+        try:
+            source_metadata = create_metadata_extractor().extract(input_file)
+            for temp, output in zip(
+                rendition_outputs(temp_file, convert_config.renditions),
+                rendition_outputs(output_file, convert_config.renditions),
+            ):
+                result = verify_output(
+                    input_file, temp, convert_config, self.verify_mode, source_metadata
+                )
+                results.append(result._replace(file=output))
+        finally:
+            ok = bool(results) and all(r.ok for r in results)
+            self._finish_outputs(temp_file, output_file, convert_config, ok)
+        return results
+
+    def _collect_verifications(self, wait=False) -> List[PendingVerification]:
+        """
+        Records the verdicts of the finished verifications
+        :param wait: wait for all of the pending verifications to finish
+        :return: the verifications which failed
+        """
+        failed = []
+        remaining = []
+        for pending in self._pending:
+            if not wait and not pending.future.done():
+                remaining.append(pending)
+                continue
+            try:
+                results = pending.future.result()
+            except Exception:
+                logger.exception(
+                    "Exception while verifying {}".format(pending.input_file)
+                )
+                results = []
+            for result in results:
+                self.db.save_verification(pending.input_file, result)
+            if results and all(r.ok for r in results):
+                logger.info("Verified {}".format(pending.output_file))
+                pending.status.convert = True
+            else:
+                logger.error("Verification failed for {}".format(pending.input_file))
+                failed.append(pending)
+            self.db.save(pending.status)
+        self._pending = remaining
+        return failed
+
+    def _size_limit(self, decision):
+        logger.info(
+            "Output projected to be too large ({} > {}), using {}{}: {}".format(
+                sizeof_fmt(decision.projected_size),
+                sizeof_fmt(decision.limit),
+                decision.fallback.value,
+                " {}".format(decision.crf) if decision.crf is not None else "",
+                decision.input,
+            )
+        )
+        self.size_limit_count += 1
+
+    def _estimate(self, to_process, convert_config):
+        """
+        Estimates the conversion time of each file from previous conversions
+        :return: dict of input file to estimate
+        """
+        extractor = create_metadata_extractor()
+        predictor = EncodePredictor(self.stats_db)
+        estimates = {}
+        for input_file, output_file, temp_file in to_process:
+            if os.path.exists(output_file):
+                continue
+            try:
+                metadata = extractor.extract(input_file)
+                estimates[input_file] = predictor.estimate(metadata, convert_config)
+            except Exception:
+                logger.exception("Unable to estimate {}".format(input_file))
+        known = [e for e in estimates.values() if e.seconds is not None]
+        if known:
+            logger.info(
+                "Estimated {} to convert {} files ({} could not be estimated)".format(
+                    timedelta(seconds=int(sum(e.seconds for e in known))),
+                    len(known),
+                    len(estimates) - len(known),
+                )
+            )
+        return estimates
+
+    def _has_time(self, input_file, estimates) -> bool:
+        if self._deadline is None:
+            return True
+        estimate = estimates.get(input_file)
+        seconds = estimate.seconds if estimate and estimate.seconds else 0
+        return time.monotonic() + seconds <= self._deadline
+
     def _run(self, in_dir, out_dir, convert_config):
-        total_files = 0
         count = 0
         error_count = 0
         to_process = list(get_input_output(in_dir, out_dir, self.working_dir))
-        for input_file, output_file, temp_file in to_process:
-            total_files += 1
+        total_files = len(to_process)
+        estimates = {}
+        if self.stats_db:
+            estimates = self._estimate(to_process, convert_config)
+            if self.schedule_order == "shortest":
+                to_process.sort(key=lambda t: _estimate_sort_key(estimates.get(t[0])))
+        queue = deque(to_process)
+        attempts = {}
+        # The files included in count, a file whose backup failed is not even though its conversion may be verified
+        counted = set()
+        while queue or self._pending:
+            # Verifications run while the next file converts, then wait for the last ones which may re-queue files
+            failed = self._collect_verifications(wait=not queue)
+            for pending in failed:
+                if pending.input_file in counted:
+                    counted.remove(pending.input_file)
+                    count -= 1
+                attempts[pending.input_file] = attempts.get(pending.input_file, 1) + 1
+                if attempts[pending.input_file] <= VERIFY_ATTEMPTS:
+                    logger.info("Re-queueing {}".format(pending.input_file))
+                    queue.append(
+                        (pending.input_file, pending.output_file, pending.temp_file)
+                    )
+                else:
+                    error_count += 1
+            if not queue:
+                continue
+            input_file, output_file, temp_file = queue.popleft()
             try:
                 status = self.db.get(input_file, output_file)
                 if status.should_process():
@@ -249,6 +523,12 @@ class ConvertDvds:
                                 input_file
                             )
                         )
+                    elif not self._has_time(input_file, estimates):
+                        logger.info(
+                            "Not enough time left in this run, skipping: {}".format(
+                                input_file
+                            )
+                        )
                     else:
                         logger.info("Starting {}".format(input_file))
                         if self.process(
@@ -260,6 +540,7 @@ class ConvertDvds:
                             convert_config,
                         ):
                             count += 1
+                            counted.add(input_file)
                         self.db.save(status)
                 else:
                     logger.debug("Not processing: {}".format(input_file))
@@ -270,14 +551,30 @@ class ConvertDvds:
 
     def run(self):
         logger.info("Starting new run")
+        self.size_limit_count = 0
+        if self.time_limit:
+            self._deadline = time.monotonic() + self.time_limit * 60
         movie_counts = self._run(
             self.movie_in_dir, self.movie_out_dir, self.movie_convert_config
         )
         tv_counts = self._run(self.tv_in_dir, self.tv_out_dir, self.tv_convert_config)
         logger.info("Processed {} of {} movie files ({} errors)".format(*movie_counts))
         logger.info("Processed {} of {} tv files ({} errors)".format(*tv_counts))
+        if self.size_limit_count:
+            logger.info(
+                "{} conversions were projected to be too large".format(
+                    self.size_limit_count
+                )
+            )
         return ConvertDvdResults(*movie_counts, *tv_counts)
 
+    def close(self):
+        self._verifier.shutdown()
+        if self.cache:
+            self.cache.close()
+        if self.stats_db:
+            self.stats_db.close()
+
     def get_existing_success(self, in_dir, out_dir):
         for input_file, output_file in get_input_output(in_dir, out_dir):
             if os.path.exists(output_file):
@@ -316,15 +613,18 @@ def main():
     config = ns["config"]
     convert_dvds = ConvertDvds(config)
 
-    if cmd == "run":
-        convert_dvds.run()
-    elif cmd == "list":
-        results = convert_dvds.get_all_existing_success()
-        for r in results:
-            if ns["0"]:
-                print(r, end="\0")
-            else:
-                print(r)
+    try:
+        if cmd == "run":
+            convert_dvds.run()
+        elif cmd == "list":
+            results = convert_dvds.get_all_existing_success()
+            for r in results:
+                if ns["0"]:
+                    print(r, end="\0")
+                else:
+                    print(r)
+    finally:
+        convert_dvds.close()
 
 
 if __name__ == "__main__":
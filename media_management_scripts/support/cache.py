@@ -0,0 +1,81 @@
+import hashlib
+import os
+import shelve
+import threading
+from typing import Any
+
+DEFAULT_CACHE_FILE = os.path.expanduser("~/.cache/mms/analysis.shelve")
+
+# Bytes read from the start and end of a file for its fingerprint
+FINGERPRINT_CHUNK_SIZE = 64 * 1024
+
+
+def file_fingerprint(file: str) -> str:
+    """
+    Creates a fingerprint of a file's contents from its size and its first and last bytes.
+
+    Reading the whole file would take minutes for large videos, while this is stable across renames and moves.
+    """
+    size = os.path.getsize(file)
+    h = hashlib.sha1(str(size).encode("utf-8"))
+    with open(file, "rb") as f:
+        h.update(f.read(FINGERPRINT_CHUNK_SIZE))
+        if size > FINGERPRINT_CHUNK_SIZE:
+            f.seek(max(FINGERPRINT_CHUNK_SIZE, size - FINGERPRINT_CHUNK_SIZE))
+            h.update(f.read(FINGERPRINT_CHUNK_SIZE))
+    return h.hexdigest()
+
+
+class AnalysisCache:
+    """
+    Stores analysis results (crop, scene cuts, CRF samples, etc) keyed by the fingerprint of a file.
+
+    Results survive renames and are invalidated when the file's content changes.
+    This is safe to use from multiple threads, but not from multiple processes.
+    """
+
+    def __init__(self, db_file: str = DEFAULT_CACHE_FILE):
+        dir = os.path.dirname(db_file)
+        if dir:
+            os.makedirs(dir, exist_ok=True)
+        self.db = shelve.open(db_file)
+        self._lock = threading.Lock()
+        self._fingerprints = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        with self._lock:
+            self.db.close()
+
+    def fingerprint(self, file: str) -> str:
+        stat = os.stat(file)
+        key = (os.path.realpath(file), stat.st_size, stat.st_mtime_ns)
+        fingerprint = self._fingerprints.get(key)
+        if fingerprint is None:
+            fingerprint = file_fingerprint(file)
+            self._fingerprints[key] = fingerprint
+        return fingerprint
+
+    def _key(self, file: str, key: str) -> str:
+        return "{}/{}".format(self.fingerprint(file), key)
+
+    def get(self, file: str, key: str, default=None) -> Any:
+        db_key = self._key(file, key)
+        with self._lock:
+            return self.db.get(db_key, default)
+
+    def put(self, file: str, key: str, value: Any):
+        db_key = self._key(file, key)
+        with self._lock:
+            self.db[db_key] = value
+            self.db.sync()
+
+    def contains(self, file: str, key: str) -> bool:
+        db_key = self._key(file, key)
+        with self._lock:
+            return db_key in self.db
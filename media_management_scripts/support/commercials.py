@@ -0,0 +1,192 @@
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from media_management_scripts.support.executables import execute_with_output, ffmpeg
+from media_management_scripts.utils import extract_metadata
+
+logger = logging.getLogger(__name__)
+
+BLACK_PATTERN = re.compile(r"black_start:\s*([\d.]+)\s+black_end:\s*([\d.]+)")
+SILENCE_START_PATTERN = re.compile(r"silence_start:\s*(-?[\d.]+)")
+SILENCE_END_PATTERN = re.compile(r"silence_end:\s*([\d.]+)")
+
+# Width the video is scaled to before blackdetect
+ANALYSIS_WIDTH = 320
+# Minimum seconds of black/silence for a boundary between programs & commercials
+MIN_BOUNDARY = 0.1
+# Maximum ratio of non-black pixels for a frame to be black
+BLACK_PIXEL_THRESHOLD = 0.1
+SILENCE_NOISE = "-50dB"
+# Boundaries at most this many seconds apart are commercials in the same break
+MAX_COMMERCIAL = 120
+# The minimum length of a break
+MIN_BREAK = 30
+# The maximum length of a break. Longer chains of boundaries are fades within the programme, not commercials
+MAX_BREAK = 480
+
+
+class Break(NamedTuple):
+    start: float
+    end: float
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+def _parse_black(output: str) -> List[Tuple[float, float]]:
+    return [(float(s), float(e)) for s, e in BLACK_PATTERN.findall(output)]
+
+
+def _parse_silence(output: str, duration: Optional[float]) -> List[Tuple[float, float]]:
+    """
+    Pairs silence_start & silence_end lines. A silence still running at the end of the file has no end line.
+    """
+    intervals = []
+    start = None
+    for line in output.splitlines():
+        m = SILENCE_START_PATTERN.search(line)
+        if m:
+            start = max(0.0, float(m.group(1)))
+            continue
+        m = SILENCE_END_PATTERN.search(line)
+        if m and start is not None:
+            intervals.append((start, float(m.group(1))))
+            start = None
+    if start is not None and duration:
+        intervals.append((start, duration))
+    return intervals
+
+
+def boundaries(
+    black: List[Tuple[float, float]], silence: Optional[List[Tuple[float, float]]]
+) -> List[Tuple[float, float]]:
+    """
+    The ranges which are both black and silent. If there is no audio, the black ranges alone.
+    """
+    if silence is None:
+        return sorted(black)
+    result = []
+    for b_start, b_end in black:
+        for s_start, s_end in silence:
+            start, end = max(b_start, s_start), min(b_end, s_end)
+            if end > start:
+                result.append((start, end))
+    return sorted(result)
+
+
+def find_breaks(
+    boundaries: List[Tuple[float, float]],
+    max_commercial: float = MAX_COMMERCIAL,
+    min_break: float = MIN_BREAK,
+    max_break: float = MAX_BREAK,
+) -> List[Break]:
+    """
+    Groups boundaries close enough together to be separating commercials. Each group spanning between min_break and
+    max_break is a break from the start of its first boundary to the end of its last.
+
+    A longer group is dropped rather than split, since it is likely programme content with frequent fades to black
+    and removing any of it would cut the programme.
+    """
+    breaks = []
+    group = []
+
+    def close():
+        if not group:
+            return
+        length = group[-1][1] - group[0][0]
+        if length > max_break:
+            logger.debug(
+                "Ignoring {:.1f}s of boundaries from {:.1f}s, longer than a break".format(
+                    length, group[0][0]
+                )
+            )
+        elif length >= min_break:
+            breaks.append(Break(group[0][0], group[-1][1]))
+
+    for boundary in boundaries:
+        if group and boundary[0] - group[-1][1] > max_commercial:
+            close()
+            group = []
+        group.append(boundary)
+    close()
+    return breaks
+
+
+def _execute_ffmpeg(input_file, width: int, has_audio: bool) -> str:
+    args = [ffmpeg(), "-hide_banner", "-nostats", "-i", input_file]
+    args.extend(["-map", "0:v:0"])
+    args.extend(
+        [
+            "-vf",
+            "scale={}:-2,blackdetect=d={}:pix_th={}".format(
+                width, MIN_BOUNDARY, BLACK_PIXEL_THRESHOLD
+            ),
+        ]
+    )
+    if has_audio:
+        args.extend(["-map", "0:a:0"])
+        args.extend(
+            ["-af", "silencedetect=n={}:d={}".format(SILENCE_NOISE, MIN_BOUNDARY)]
+        )
+    args.extend(["-f", "null", "-"])
+    ret, output = execute_with_output(args)
+    if ret != 0:
+        raise Exception("Error detecting commercials: {}".format(output))
+    return output
+
+
+def detect_commercials(
+    input_file,
+    metadata=None,
+    width: int = ANALYSIS_WIDTH,
+    max_commercial: float = MAX_COMMERCIAL,
+    min_break: float = MIN_BREAK,
+    max_break: float = MAX_BREAK,
+    cache=None,
+) -> List[Break]:
+    """
+    Finds the commercial breaks in a recording from the black & silent boundaries around each commercial.
+
+    blackdetect (on a downscaled copy of the video) and silencedetect run in a single decode of the file. The
+    boundaries are cached, so the grouping can be tuned without decoding again.
+    :param width: the width the video is scaled to for blackdetect
+    :param max_commercial: the maximum seconds between boundaries in the same break
+    :param min_break: the minimum length of a break
+    :param max_break: the maximum length of a break
+    :param cache: an AnalysisCache
+    :return: the breaks
+    """
+    key = "commercials:{}:{}:{}:{}".format(
+        width, MIN_BOUNDARY, BLACK_PIXEL_THRESHOLD, SILENCE_NOISE
+    )
+    found = cache.get(input_file, key) if cache else None
+    if found is None:
+        if metadata is None:
+            metadata = extract_metadata(input_file)
+        has_audio = bool(metadata.audio_streams)
+        output = _execute_ffmpeg(input_file, width, has_audio)
+        silence = (
+            _parse_silence(output, metadata.estimated_duration) if has_audio else None
+        )
+        found = boundaries(_parse_black(output), silence)
+        if cache:
+            cache.put(input_file, key, found)
+    breaks = find_breaks(found, max_commercial, min_break, max_break)
+    logger.debug("Commercial breaks in {}: {}".format(input_file, breaks))
+    return breaks
+
+
+def detect_all_commercials(
+    files: List[str], max_workers: Optional[int] = None, **kwargs
+) -> Dict[str, List[Break]]:
+    """
+    Runs detect_commercials on the files concurrently
+    :param kwargs: passed to detect_commercials
+    :return: file => breaks
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(lambda f: detect_commercials(f, **kwargs), files)
+        return dict(zip(files, results))
@@ -1,64 +1,178 @@
 import os
+import shutil
 import subprocess
 import tempfile
-from media_management_scripts.support.executables import ffmpeg, execute_with_output
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from media_management_scripts.support.executables import (
+    ERROR_OUTPUT_LINES,
+    ffmpeg,
+    execute_with_output,
+)
 from media_management_scripts.utils import extract_metadata
 from media_management_scripts.support.encoding import VideoCodec, AudioCodec
 
+PIPE_CHUNK_SIZE = 1024 * 1024
+# Files converted ahead of the one being piped into the muxer, so the next stream is ready without a process per file
+PIPE_LOOKAHEAD = 1
 
-def _temp_convert(input, output, print_output=False):
-    # ffmpeg -i input1.mp4 -c copy -bsf:v h264_mp4toannexb -f mpegts intermediate1.ts
-    print("Converting {}".format(input))
-    args = [
+
+def _stream_signature(metadata):
+    """
+    The codec parameters that must match for files to be joined with the concat demuxer, which keeps the first
+    file's codec headers for the whole output
+    """
+    video = metadata.video_streams[0]
+    audio = tuple(
+        (a.codec, a.channels, a._data.get("sample_rate", None))
+        for a in metadata.audio_streams
+    )
+    return (
+        video.codec,
+        video.width,
+        video.height,
+        video.profile,
+        video.level,
+        video.pix_fmt,
+        audio,
+    )
+
+
+def _concat_list_entry(file):
+    # The concat demuxer's list format escapes single quotes by closing the quote
+    return "file '{}'\n".format(os.path.abspath(file).replace("'", "'\\''"))
+
+
+def _concat_demuxer(files, output, print_output=False):
+    # ffmpeg -f concat -safe 0 -i list.txt -map 0 -c copy output.mp4
+    with tempfile.TemporaryDirectory() as tmp:
+        concat_list = os.path.join(tmp, "concat.txt")
+        with open(concat_list, "w") as f:
+            for file in files:
+                f.write(_concat_list_entry(file))
+        args = [
+            ffmpeg(),
+            "-loglevel",
+            "fatal",
+            "-y",
+            "-f",
+            "concat",
+            "-safe",
+            "0",
+            "-i",
+            concat_list,
+            "-map",
+            "0",
+            "-c",
+            "copy",
+            output,
+        ]
+        ret, r = execute_with_output(
+            args, print_output=print_output, max_lines=ERROR_OUTPUT_LINES
+        )
+    if ret != 0:
+        raise Exception("Error during ffmpeg: {}".format(r))
+
+
+def _annexb_args(input):
+    # ffmpeg -i input1.mp4 -c copy -bsf:v h264_mp4toannexb -f mpegts pipe:1
+    return [
         ffmpeg(),
         "-loglevel",
         "fatal",
         "-i",
         input,
-        "-c:v",
-        "copy",
-        "-c:a",
-        "copy",
-        "-c:s",
+        "-map",
+        "0",
+        "-c",
         "copy",
         "-bsf:v",
         "h264_mp4toannexb",
         "-f",
         "mpegts",
-        output,
+        "pipe:1",
     ]
-    ret, r = execute_with_output(args, print_output=print_output)
-    if ret != 0:
-        raise Exception("Error during ffmpeg: {}".format(r))
 
 
-def _concat(files, output, print_output=False):
-    # ffmpeg -i "concat:intermediate1.ts|intermediate2.ts" -c copy -bsf:a aac_adtstoasc output.mp4
-    concat_str = "concat:"
-    for f in files:
-        concat_str += f + "|"
-    concat_str = concat_str[0:-1]
-    print(concat_str)
+def _concat_pipe(files, output, print_output=False):
+    """
+    Joins files whose codec parameters differ. Each file is converted to an MPEG-TS stream (which carries its codec
+    headers in-band) by its own ffmpeg process, and the streams are piped in order into a single muxing ffmpeg.
+    Converters are started PIPE_LOOKAHEAD files ahead of the one being piped, so only a few run at once however many
+    files there are. Nothing is written to disk but the output; a converter that is not being read yet blocks once
+    its pipe buffer is full.
+    """
+    # ffmpeg -f mpegts -i pipe:0 -c copy -bsf:a aac_adtstoasc output.mp4
     args = [
         ffmpeg(),
         "-loglevel",
         "fatal",
         "-y",
+        "-f",
+        "mpegts",
         "-i",
-        concat_str,
-        "-c:v",
-        "copy",
-        "-c:a",
-        "copy",
-        "-c:s",
+        "pipe:0",
+        "-map",
+        "0",
+        "-c",
         "copy",
         "-bsf:a",
         "aac_adtstoasc",
         output,
     ]
-    ret, r = execute_with_output(args, print_output=print_output)
-    if ret != 0:
-        raise Exception("Error during ffmpeg: {}".format(r))
+    if print_output:
+        print(
+            "Concatenating {} files with differing codec parameters".format(len(files))
+        )
+    with tempfile.TemporaryFile() as errors:
+        muxer = subprocess.Popen(
+            args, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=errors
+        )
+        converters = deque()
+        started = 0
+        try:
+            for file in files:
+                while started < len(files) and len(converters) <= PIPE_LOOKAHEAD:
+                    converters.append(
+                        subprocess.Popen(
+                            _annexb_args(files[started]),
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL,
+                        )
+                    )
+                    started += 1
+                converter = converters[0]
+                try:
+                    shutil.copyfileobj(converter.stdout, muxer.stdin, PIPE_CHUNK_SIZE)
+                except BrokenPipeError:
+                    # The muxer exited, its error is reported below
+                    break
+                converter.stdout.close()
+                ret = converter.wait()
+                converters.popleft()
+                if ret != 0:
+                    raise Exception(
+                        "Error converting {}, return code={}".format(file, ret)
+                    )
+        finally:
+            for converter in converters:
+                if converter.poll() is None:
+                    converter.kill()
+                    converter.wait()
+            try:
+                muxer.stdin.close()
+            except BrokenPipeError:
+                pass
+            ret = muxer.wait()
+        if ret != 0:
+            errors.seek(0)
+            raise Exception(
+                "Error during ffmpeg, return code={}: {}".format(
+                    ret, errors.read().decode()
+                )
+            )
 
 
 def _validate_file(file):
@@ -72,22 +186,27 @@ def _validate_file(file):
     ]
     if non_aac_audio:
         raise Exception("Not all audio streams are AAC: {}".format(file))
+    return metadata
+
+
+def validate_files(files: List[str], max_workers=None):
+    """
+    Probes and validates the files concurrently
+    :return: the Metadata of each file in order
+    """
+    with ThreadPoolExecutor(max_workers=max_workers or len(files)) as executor:
+        return list(executor.map(_validate_file, files))
 
 
 def concat_mp4(output, files, overwrite=False, print_output=False):
     if not overwrite and os.path.exists(output):
         print("Cowardly refusing to overwrite existing file: {}".format(output))
         return
-    temp_files = []
-    try:
-        for f in files:
-            file = os.path.abspath(f)
-            _validate_file(file)
-            tmp = tempfile.NamedTemporaryFile(mode="w", suffix=".ts").name
-            temp_files.append(tmp)
-            _temp_convert(file, tmp, print_output)
-        _concat(temp_files, output, print_output)
-    finally:
-        for f in temp_files:
-            if os.path.exists(f):
-                os.remove(f)
+    if not files:
+        raise Exception("No files to concat")
+    files = [os.path.abspath(f) for f in files]
+    metadata = validate_files(files)
+    if len(set(_stream_signature(m) for m in metadata)) == 1:
+        _concat_demuxer(files, output, print_output)
+    else:
+        _concat_pipe(files, output, print_output)
@@ -0,0 +1,373 @@
+import logging
+import os
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional, Tuple
+
+from media_management_scripts.convert import convert_with_config
+from media_management_scripts.support.cache import AnalysisCache
+from media_management_scripts.support.encoding import AudioCodec, VideoCodec
+from media_management_scripts.support.executables import (
+    ERROR_OUTPUT_LINES,
+    execute_with_output,
+    ffmpeg,
+)
+from media_management_scripts.support.files import check_exists
+from media_management_scripts.support.filters import (
+    VideoFilterChain,
+    create_filter_chain,
+)
+from media_management_scripts.support.formatting import sizeof_fmt
+from media_management_scripts.support.metadata import Metadata
+from media_management_scripts.utils import ConvertConfig, create_metadata_extractor
+
+logger = logging.getLogger(__name__)
+
+SSIM_PATTERN = re.compile(r"SSIM .*All:(\d+(\.\d+)?)")
+PSNR_PATTERN = re.compile(r"PSNR .*average:(\d+(\.\d+)?|inf)")
+
+DEFAULT_SAMPLE_COUNT = 5
+DEFAULT_SAMPLE_LENGTH = 10
+DEFAULT_MIN_CRF = 10
+DEFAULT_MAX_CRF = 35
+
+# Used to estimate the size of transcoded audio streams when the bitrate is unknown
+AUDIO_BITRATE_PER_CHANNEL = 64_000
+
+
+class SampleResult(NamedTuple):
+    crf: int
+    start: float
+    duration: float
+    size: int
+    ssim: float
+    psnr: float
+
+
+class CrfSearchResult(NamedTuple):
+    crf: int
+    ssim: float
+    psnr: float
+    estimated_size: int
+    met_target: bool
+
+    def __repr__(self):
+        return "<CrfSearchResult: crf={}, ssim={:.4f}, psnr={:.2f}, estimated_size={}, met_target={}>".format(
+            self.crf,
+            self.ssim,
+            self.psnr,
+            sizeof_fmt(self.estimated_size),
+            self.met_target,
+        )
+
+
+def sample_positions(
+    start: float, end: float, count: int, length: float
+) -> List[Tuple[float, float]]:
+    """
+    Evenly spaced (start, duration) samples between start and end. Short inputs are a single sample.
+    """
+    duration = end - start
+    if duration <= count * length:
+        return [(start, duration)]
+    return [
+        (start + duration * (i + 1) / (count + 1) - length / 2, length)
+        for i in range(count)
+    ]
+
+
+def align_samples(
+    samples: List[Tuple[float, float]], scenes, end: float
+) -> List[Tuple[float, float]]:
+    """
+    Moves each sample to start on a nearby scene cut, so it measures whole shots rather than a transition between
+    them. Samples which would then overlap another are left where they are.
+    :param scenes: the SceneIndex of the input
+    :param end: samples must finish before this
+    """
+    if len(samples) < 2:
+        return samples
+    aligned = []
+    for start, length in samples:
+        new_start = scenes.align(start, length, end)
+        if aligned and new_start < aligned[-1][0] + aligned[-1][1]:
+            new_start = start
+        aligned.append((new_start, length))
+    return aligned
+
+
+def _parse_quality(output: str) -> Tuple[float, float]:
+    ssim, psnr = None, None
+    for line in output.splitlines():
+        m = SSIM_PATTERN.search(line)
+        if m:
+            ssim = float(m.group(1))
+        m = PSNR_PATTERN.search(line)
+        if m:
+            psnr = float(m.group(1))
+    if ssim is None or psnr is None:
+        raise Exception("Could not find SSIM/PSNR in ffmpeg output: {}".format(output))
+    return ssim, psnr
+
+
+class CrfSearch:
+    def __init__(
+        self,
+        input: str,
+        config: ConvertConfig,
+        metadata: Metadata,
+        sample_count: int = DEFAULT_SAMPLE_COUNT,
+        sample_length: float = DEFAULT_SAMPLE_LENGTH,
+        cache: Optional[AnalysisCache] = None,
+        max_workers: Optional[int] = None,
+    ):
+        video_codec = VideoCodec.from_code_name(config.video_codec)
+        if video_codec not in (VideoCodec.H264, VideoCodec.H265):
+            raise Exception(
+                "CRF search requires H.264 or H.265, not {}".format(config.video_codec)
+            )
+        if config.hardware_accelerated:
+            raise Exception("CRF search is not supported with hardware acceleration")
+        if config.bitrate is not None and config.bitrate != "disabled":
+            raise Exception("CRF search cannot be combined with a bitrate")
+        if config.renditions:
+            raise Exception("CRF search cannot be combined with renditions")
+        if not metadata.estimated_duration:
+            raise Exception("Could not estimate duration of {}".format(input))
+
+        self.input = input
+        self.config = config
+        self.metadata = metadata
+        self.cache = cache
+        self.max_workers = max_workers
+
+        start = config.start or 0
+        end = metadata.estimated_duration
+        if config.end and config.end > 0:
+            end = config.end
+        elif config.end:
+            end += config.end
+        self.duration = end - start
+        self.samples = sample_positions(start, end, sample_count, sample_length)
+        if cache is not None:
+            create_metadata_extractor().add_scenes(metadata, cache, detect=False)
+        if metadata.scenes is not None:
+            self.samples = align_samples(self.samples, metadata.scenes, end)
+
+    def _filter_chain(self, start: float) -> VideoFilterChain:
+        """
+        The filters of the real encode for a sample. Each sample seeks to its start, so the deinterlaced ranges of
+        config.deinterlace_segments are offset by it rather than by config.start
+        """
+        return create_filter_chain(self.config._replace(start=start), self.metadata)
+
+    def _cache_key(self, crf: int, start: float, duration: float) -> str:
+        return "crf_sample:{}:{}:{}:{}:{:.3f}:{:.3f}".format(
+            self.config.video_codec,
+            self.config.preset,
+            self._filter_chain(start).build(),
+            crf,
+            start,
+            duration,
+        )
+
+    def _encode_sample(self, crf: int, start: float, duration: float) -> SampleResult:
+        key = self._cache_key(crf, start, duration)
+        if self.cache is not None:
+            result = self.cache.get(self.input, key)
+            if result is not None:
+                return result
+
+        filter_chain = self._filter_chain(start)
+        with tempfile.TemporaryDirectory() as tmp:
+            sample_file = os.path.join(tmp, "sample.mkv")
+            args = [ffmpeg(), "-y", "-ss", str(start), "-i", self.input]
+            args.extend(["-t", str(duration), "-map", "0:v:0", "-an", "-sn"])
+            args.extend(filter_chain.to_args())
+            args.extend(["-c:v", self.config.video_codec])
+            args.extend(["-crf", str(crf), "-preset", self.config.preset])
+            args.append(sample_file)
+            ret, output = execute_with_output(args, max_lines=ERROR_OUTPUT_LINES)
+            if ret != 0:
+                raise Exception("Error encoding sample: {}".format(output))
+            size = os.path.getsize(sample_file)
+
+            # Compare to the source after applying the same filters
+            ref_filters = filter_chain.build() or "null"
+            graph = "[0:v]split=2[d1][d2];[1:v]{},split=2[r1][r2];[d1][r1]ssim;[d2][r2]psnr".format(
+                ref_filters
+            )
+            args = [ffmpeg(), "-nostats", "-i", sample_file]
+            args.extend(["-ss", str(start), "-t", str(duration), "-i", self.input])
+            args.extend(["-lavfi", graph, "-f", "null", "-"])
+            ret, output = execute_with_output(args)
+            if ret != 0:
+                raise Exception("Error measuring sample: {}".format(output))
+            ssim, psnr = _parse_quality(output)
+
+        result = SampleResult(crf, start, duration, size, ssim, psnr)
+        if self.cache is not None:
+            self.cache.put(self.input, key, result)
+        return result
+
+    def _estimate_audio_size(self) -> float:
+        size = 0
+        for a in self.metadata.audio_streams:
+            if (
+                AudioCodec.COPY.equals(self.config.audio_codec)
+                or a.codec == self.config.audio_codec
+            ) and a.bit_rate:
+                bit_rate = a.bit_rate
+            else:
+                bit_rate = AUDIO_BITRATE_PER_CHANNEL * (a.channels or 2)
+            size += bit_rate / 8 * self.duration
+        return size
+
+    def evaluate(self, crf: int) -> CrfSearchResult:
+        """
+        Encodes all of the samples at the CRF in parallel
+        """
+        with ThreadPoolExecutor(
+            max_workers=self.max_workers or len(self.samples)
+        ) as executor:
+            results = list(
+                executor.map(lambda s: self._encode_sample(crf, *s), self.samples)
+            )
+        total_duration = sum(r.duration for r in results)
+        ssim = sum(r.ssim * r.duration for r in results) / total_duration
+        psnr = sum(r.psnr * r.duration for r in results) / total_duration
+        video_size = sum(r.size for r in results) / total_duration * self.duration
+        estimated_size = int(video_size + self._estimate_audio_size())
+        logger.debug(
+            "CRF {}: ssim={}, psnr={}, size={}".format(crf, ssim, psnr, estimated_size)
+        )
+        return CrfSearchResult(crf, ssim, psnr, estimated_size, True)
+
+    def search(
+        self,
+        target_ssim: Optional[float] = None,
+        target_size: Optional[int] = None,
+        min_crf: int = DEFAULT_MIN_CRF,
+        max_crf: int = DEFAULT_MAX_CRF,
+    ) -> CrfSearchResult:
+        """
+        Bisects for the highest CRF that meets the SSIM target and/or the lowest CRF that meets the size target.
+
+        If both are given, quality wins: the highest CRF meeting the SSIM target is used even if it is too large.
+        """
+        if target_ssim is None and target_size is None:
+            raise Exception("A target SSIM or size is required")
+        results = {}
+
+        def evaluate(crf):
+            if crf not in results:
+                results[crf] = self.evaluate(crf)
+            return results[crf]
+
+        if target_ssim is not None:
+            best = None
+            lo, hi = min_crf, max_crf
+            while lo <= hi:
+                crf = (lo + hi) // 2
+                if evaluate(crf).ssim >= target_ssim:
+                    best = crf
+                    lo = crf + 1
+                else:
+                    hi = crf - 1
+            if best is None:
+                logger.warning(
+                    "No CRF reaches SSIM {} for {}".format(target_ssim, self.input)
+                )
+                return evaluate(min_crf)._replace(met_target=False)
+            result = evaluate(best)
+            if target_size is not None and result.estimated_size > target_size:
+                logger.warning(
+                    "CRF {} meets SSIM {}, but not the target size".format(
+                        best, target_ssim
+                    )
+                )
+                return result._replace(met_target=False)
+            return result
+
+        best = None
+        lo, hi = min_crf, max_crf
+        while lo <= hi:
+            crf = (lo + hi) // 2
+            if evaluate(crf).estimated_size <= target_size:
+                best = crf
+                hi = crf - 1
+            else:
+                lo = crf + 1
+        if best is None:
+            logger.warning(
+                "No CRF reaches size {} for {}".format(
+                    sizeof_fmt(target_size), self.input
+                )
+            )
+            return evaluate(max_crf)._replace(met_target=False)
+        return evaluate(best)
+
+
+def find_crf(
+    input: str,
+    config: ConvertConfig,
+    target_ssim: Optional[float] = None,
+    target_size: Optional[int] = None,
+    metadata: Optional[Metadata] = None,
+    cache: Optional[AnalysisCache] = None,
+    **kwargs,
+) -> CrfSearchResult:
+    if not metadata:
+        metadata = create_metadata_extractor().extract(
+            input,
+            detect_interlace=config.deinterlace,
+            detect_interlace_map=config.deinterlace and config.deinterlace_segments,
+            detect_crop=config.auto_crop,
+            cache=cache,
+        )
+    return CrfSearch(input, config, metadata, cache=cache, **kwargs).search(
+        target_ssim, target_size
+    )
+
+
+def convert_with_target(
+    input: str,
+    output: str,
+    config: ConvertConfig,
+    target_ssim: Optional[float] = None,
+    target_size: Optional[int] = None,
+    cache: Optional[AnalysisCache] = None,
+    print_output=True,
+    overwrite=False,
+    dry_run=False,
+    stats_db=None,
+    on_size_limit=None,
+):
+    """
+    Finds the CRF meeting the target using samples, then converts the whole file with it
+    """
+    if not overwrite and check_exists(output):
+        return -1
+    metadata = create_metadata_extractor().extract(
+        input,
+        detect_interlace=config.deinterlace,
+        detect_interlace_map=config.deinterlace and config.deinterlace_segments,
+        detect_crop=config.auto_crop,
+        cache=cache,
+    )
+    result = find_crf(input, config, target_ssim, target_size, metadata, cache)
+    if print_output:
+        print("Selected {}".format(result))
+    return convert_with_config(
+        input,
+        output,
+        config._replace(crf=result.crf),
+        print_output=print_output,
+        overwrite=overwrite,
+        metadata=metadata,
+        dry_run=dry_run,
+        stats_db=stats_db,
+        on_size_limit=on_size_limit,
+        cache=cache,
+    )
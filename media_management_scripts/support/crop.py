@@ -0,0 +1,146 @@
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional
+
+from media_management_scripts.support.executables import execute_with_output, ffmpeg
+from media_management_scripts.support.interlace import _window_bounds
+
+logger = logging.getLogger(__name__)
+
+# [Parsed_cropdetect_0 @ 0x111317c0] x1:0 x2:639 y1:45 y2:314 w:640 h:268 x:0 y:46 pts:760 t:0.760000 limit:24.000000 crop=640:268:0:46
+# The crop= values are rounded towards the center, so the exact bounds are used instead
+BOUNDS_PATTERN = re.compile(r"x1:(-?\d+) x2:(-?\d+) y1:(-?\d+) y2:(-?\d+)")
+
+DEFAULT_CROP_WINDOWS = 6
+DEFAULT_CROP_FRAMES = 48
+# Luma below this (out of 255) is considered black
+DEFAULT_CROP_LIMIT = 24
+# Borders thinner than this are noise or overscan, not letterboxing
+MIN_CROP_PIXELS = 8
+
+
+class CropRect(NamedTuple):
+    width: int
+    height: int
+    x: int
+    y: int
+
+    def removed_ratio(self, width: int, height: int) -> float:
+        """
+        The ratio of the pixels of a width x height frame which are cropped away
+        """
+        return 1 - (self.width * self.height) / (width * height)
+
+    def union(self, other: "CropRect") -> "CropRect":
+        """
+        The smallest rectangle containing both, so picture visible in either is kept
+        """
+        x = min(self.x, other.x)
+        y = min(self.y, other.y)
+        x2 = max(self.x + self.width, other.x + other.width)
+        y2 = max(self.y + self.height, other.y + other.height)
+        return CropRect(x2 - x, y2 - y, x, y)
+
+    def to_dict(self):
+        return {"width": self.width, "height": self.height, "x": self.x, "y": self.y}
+
+    def __str__(self):
+        return "{}x{}+{}+{}".format(self.width, self.height, self.x, self.y)
+
+
+def _parse_output(output: str) -> Optional[CropRect]:
+    """
+    cropdetect accumulates the bounds over every frame, so the last line covers the whole window
+    """
+    matches = BOUNDS_PATTERN.findall(output)
+    if not matches:
+        return None
+    x1, x2, y1, y2 = [int(v) for v in matches[-1]]
+    if x2 < x1 or y2 < y1:
+        # Every frame was black
+        return None
+    return CropRect(x2 - x1 + 1, y2 - y1 + 1, x1, y1)
+
+
+def _execute_ffmpeg(
+    input_file: str, start: float, frames: int, limit: int = DEFAULT_CROP_LIMIT
+) -> Optional[CropRect]:
+    args = [ffmpeg(), "-nostats", "-ss", str(start), "-i", input_file]
+    args.extend(["-map", "0:v:0", "-frames:v", str(frames)])
+    args.extend(["-filter:v", "cropdetect=limit={}:reset=0".format(limit)])
+    args.extend(["-an", "-sn", "-f", "null", "-y", "/dev/null"])
+    ret, output = execute_with_output(args, print_output=False)
+    if ret != 0:
+        raise Exception(
+            "Non-zero ffmpeg return code: {}. Output={}".format(ret, output)
+        )
+    return _parse_output(output)
+
+
+def reduce_crops(
+    crops: List[Optional[CropRect]], width: int, height: int
+) -> Optional[CropRect]:
+    """
+    Reduces the crop of each window to a single crop that is safe for the whole file
+    :param crops: the crop detected in each window, None if the window was entirely black
+    :param width: the width of the source
+    :param height: the height of the source
+    :return: the crop or None if there is nothing worth cropping
+    """
+    crops = [c for c in crops if c is not None]
+    if not crops:
+        return None
+    crop = crops[0]
+    for c in crops[1:]:
+        crop = crop.union(c)
+    # Grow to even offsets so interlaced fields are not swapped and even dimensions for chroma subsampling
+    x, y = crop.x - crop.x % 2, crop.y - crop.y % 2
+    x2 = min(crop.x + crop.width + (crop.x + crop.width) % 2, width)
+    y2 = min(crop.y + crop.height + (crop.y + crop.height) % 2, height)
+    crop = CropRect((x2 - x) - (x2 - x) % 2, (y2 - y) - (y2 - y) % 2, x, y)
+    if width - crop.width < MIN_CROP_PIXELS and height - crop.height < MIN_CROP_PIXELS:
+        return None
+    return crop
+
+
+def find_crop(
+    input_file: str,
+    metadata,
+    windows: int = DEFAULT_CROP_WINDOWS,
+    frames: int = DEFAULT_CROP_FRAMES,
+    limit: int = DEFAULT_CROP_LIMIT,
+    cache=None,
+    max_workers: Optional[int] = None,
+) -> Optional[CropRect]:
+    """
+    Detects black bars by running cropdetect on windows spread across the file in parallel
+    :param input_file:
+    :param metadata: the Metadata of the file
+    :param windows: the number of windows to sample
+    :param frames: the number of frames to analyze in each window
+    :param limit: the luma (0-255) at or below which pixels are considered black
+    :param cache: an AnalysisCache to store the result in, keyed by the file's fingerprint
+    :param max_workers: the maximum number of ffmpeg processes to run at once, defaults to one per window
+    :return: the crop or None if there are no black bars
+    """
+    key = "crop:{}:{}:{}".format(windows, frames, limit)
+    if cache is not None and cache.contains(input_file, key):
+        return cache.get(input_file, key)
+
+    video = metadata.video_streams[0]
+    starts = [
+        start for start, end in _window_bounds(metadata.estimated_duration, windows)
+    ]
+    with ThreadPoolExecutor(max_workers=max_workers or len(starts)) as executor:
+        crops = list(
+            executor.map(
+                lambda start: _execute_ffmpeg(input_file, start, frames, limit), starts
+            )
+        )
+    logger.debug("Crops of {}: {}".format(input_file, crops))
+    crop = reduce_crops(crops, video.width, video.height)
+
+    if cache is not None:
+        cache.put(input_file, key, crop)
+    return crop
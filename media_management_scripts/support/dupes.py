@@ -0,0 +1,238 @@
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, Generic, List, NamedTuple, Optional, Tuple, TypeVar
+
+from media_management_scripts.support.frames import sample_frames
+from media_management_scripts.utils import extract_metadata
+
+logger = logging.getLogger(__name__)
+
+# The number of frames hashed per file
+DEFAULT_FRAMES = 16
+# Frames are sampled between these fractions of the duration to avoid intros & credits which are shared by episodes
+SAMPLE_START = 0.1
+SAMPLE_END = 0.9
+# The maximum average number of differing bits per frame hash for files to be duplicates
+DEFAULT_THRESHOLD = 10
+# The maximum difference in duration for files to be duplicates
+DURATION_TOLERANCE = 0.02
+MIN_DURATION_TOLERANCE = 2.0
+
+HASH_WIDTH = 9
+HASH_HEIGHT = 8
+
+# Preference of video codecs when ranking duplicates, higher is better
+CODEC_RANK = {"av1": 4, "hevc": 3, "vp9": 3, "h264": 2, "mpeg4": 1, "mpeg2video": 0}
+
+T = TypeVar("T")
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class Signature(NamedTuple):
+    duration: float
+    # A 64 bit difference hash of each sampled frame
+    hashes: Tuple[int, ...]
+
+    def distance(self, other: "Signature") -> int:
+        """
+        The total number of differing bits between the frame hashes. This is a metric, so it can be used in a BKTree.
+        """
+        return sum(hamming(a, b) for a, b in zip(self.hashes, other.hashes))
+
+    def duration_matches(self, other: "Signature") -> bool:
+        tolerance = max(
+            MIN_DURATION_TOLERANCE,
+            DURATION_TOLERANCE * max(self.duration, other.duration),
+        )
+        return abs(self.duration - other.duration) <= tolerance
+
+
+def difference_hash(frame, width=HASH_WIDTH, height=HASH_HEIGHT) -> int:
+    """
+    Hashes a grayscale frame of width x height pixels by whether each pixel is brighter than the one to its right.
+
+    This survives scaling, re-encoding and small color changes which is what separates copies of the same video.
+    """
+    pixels = bytes(frame)
+    value = 0
+    for row in range(height):
+        offset = row * width
+        for col in range(width - 1):
+            value <<= 1
+            if pixels[offset + col] > pixels[offset + col + 1]:
+                value |= 1
+    return value
+
+
+def sample_times(duration: float, frames: int) -> List[float]:
+    """
+    The same relative positions in every file so copies of different lengths still line up
+    """
+    start = duration * SAMPLE_START
+    step = duration * (SAMPLE_END - SAMPLE_START) / frames
+    return [start + step * (i + 0.5) for i in range(frames)]
+
+
+def _hash_frame(input_file, time: float) -> Optional[int]:
+    batches = sample_frames(
+        input_file,
+        HASH_WIDTH,
+        HASH_HEIGHT,
+        start=time,
+        batch_size=1,
+        scale_flags="area",
+    )
+    try:
+        batch = next(batches, None)
+        return difference_hash(batch.frame(0)) if batch else None
+    finally:
+        batches.close()
+
+
+def compute_signature(input_file, frames: int = DEFAULT_FRAMES) -> Signature:
+    """
+    Computes the perceptual signature of a file by seeking to and hashing a few downscaled frames
+    """
+    metadata = extract_metadata(input_file)
+    duration = metadata.estimated_duration
+    if not duration or not metadata.video_streams:
+        raise Exception("No video or duration for {}".format(input_file))
+    hashes = tuple(_hash_frame(input_file, t) for t in sample_times(duration, frames))
+    if None in hashes:
+        raise Exception("Could not decode all frames of {}".format(input_file))
+    return Signature(duration, hashes)
+
+
+class BKTree(Generic[T]):
+    """
+    A Burkhard-Keller tree for finding the items within a distance of a key without comparing against every item
+    """
+
+    def __init__(self, distance: Callable[[T, T], int]):
+        self.distance = distance
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, key: T, item):
+        self._size += 1
+        node = (key, item, {})
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            d = self.distance(key, current[0])
+            child = current[2].get(d)
+            if child is None:
+                current[2][d] = node
+                return
+            current = child
+
+    def search(self, key: T, radius: int) -> List[Tuple[int, T, object]]:
+        """
+        :return: (distance, key, item) for each item within the radius of the key
+        """
+        results = []
+        nodes = [self._root] if self._root else []
+        while nodes:
+            node_key, item, children = nodes.pop()
+            d = self.distance(key, node_key)
+            if d <= radius:
+                results.append((d, node_key, item))
+            for child_distance, child in children.items():
+                if d - radius <= child_distance <= d + radius:
+                    nodes.append(child)
+        return results
+
+
+def find_duplicates(
+    signatures: Dict[str, Signature], threshold: float = DEFAULT_THRESHOLD
+) -> List[List[str]]:
+    """
+    Groups files whose signatures are within the threshold of each other
+    :param signatures: file => signature
+    :param threshold: the maximum average differing bits per frame hash
+    :return: each set of duplicate files, sorted
+    """
+    tree = BKTree(Signature.distance)
+    parents = {}
+
+    def root(file):
+        while parents[file] != file:
+            parents[file] = parents[parents[file]]
+            file = parents[file]
+        return file
+
+    for file, signature in sorted(signatures.items()):
+        parents[file] = file
+        radius = int(threshold * len(signature.hashes))
+        for _, other_signature, other in tree.search(signature, radius):
+            if len(other_signature.hashes) == len(
+                signature.hashes
+            ) and signature.duration_matches(other_signature):
+                parents[root(other)] = root(file)
+        tree.add(signature, file)
+
+    groups = {}
+    for file in parents:
+        groups.setdefault(root(file), []).append(file)
+    return sorted(sorted(g) for g in groups.values() if len(g) > 1)
+
+
+def quality_key(metadata):
+    """
+    Sort key for how desirable a copy is: resolution, then codec, then bitrate
+    """
+    video = metadata.video_streams[0] if metadata.video_streams else None
+    pixels = video.width * video.height if video and video.width else 0
+    codec = CODEC_RANK.get(video.codec, -1) if video else -1
+    return pixels, codec, metadata.bit_rate or 0
+
+
+def rank_duplicates(metadatas: List) -> List:
+    """
+    Sorts the Metadata of a duplicate set from best to worst
+    """
+    return sorted(metadatas, key=quality_key, reverse=True)
+
+
+def compute_signatures(
+    files: List[str],
+    frames: int = DEFAULT_FRAMES,
+    cache=None,
+    max_workers: Optional[int] = None,
+) -> Dict[str, Signature]:
+    """
+    Computes the signatures of files in a process pool. Files which fail are logged and omitted.
+    :param cache: an AnalysisCache, signatures are stored by the file's fingerprint
+    """
+    key = "dupes:{}".format(frames)
+    signatures = {}
+    missing = []
+    for file in files:
+        signature = cache.get(file, key) if cache else None
+        if signature:
+            signatures[file] = signature
+        else:
+            missing.append(file)
+    if missing:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                (f, executor.submit(compute_signature, f, frames)) for f in missing
+            ]
+            for file, future in futures:
+                try:
+                    signature = future.result()
+                except Exception:
+                    logger.exception("Error computing signature of {}".format(file))
+                    continue
+                signatures[file] = signature
+                if cache:
+                    cache.put(file, key, signature)
+    return signatures
@@ -0,0 +1,243 @@
+import logging
+import os
+import re
+import sqlite3
+import statistics
+import threading
+import time
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+
+from media_management_scripts.support.filters import cropped_height
+from media_management_scripts.support.formatting import duration_to_str, sizeof_fmt
+from media_management_scripts.support.metadata import Metadata
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STATS_FILE = os.path.expanduser("~/.cache/mms/encode_stats.db")
+
+FPS_PATTERN = re.compile(r"fps=\s*(\d+(\.\d+)?)")
+
+# Rule of thumb for x264/x265: every +6 CRF halves the bitrate
+CRF_DOUBLING = 6.0
+
+# Fewer matching records than this falls back to a broader match
+MIN_RECORDS = 3
+
+
+class EncodeRecord(NamedTuple):
+    input: str
+    source_codec: Optional[str]
+    width: int
+    height: int
+    duration: float
+    video_codec: str
+    preset: str
+    crf: int
+    hardware: bool
+    fps: Optional[float]
+    elapsed: float
+    input_size: int
+    output_size: int
+
+    @property
+    def pixels(self):
+        return self.width * self.height
+
+    @property
+    def speed(self):
+        """
+        Seconds of media encoded per second of wall time
+        """
+        return self.duration / self.elapsed if self.elapsed else None
+
+
+class EncodeEstimate(NamedTuple):
+    seconds: Optional[float]
+    size: Optional[int]
+    records: int
+
+    def __repr__(self):
+        return "<EncodeEstimate: time={}, size={}, records={}>".format(
+            duration_to_str(self.seconds) if self.seconds is not None else None,
+            sizeof_fmt(self.size) if self.size is not None else None,
+            self.records,
+        )
+
+
+def output_dimensions(metadata: Metadata, config) -> Tuple[int, int]:
+    """
+    The dimensions of the video after cropping and scaling
+    """
+    video = metadata.video_streams[0]
+    width, height = video.width or 0, video.height or 0
+    scale = config.scale
+    if config.auto_crop and metadata.crop and height:
+        if scale:
+            scale = cropped_height(scale, metadata)
+        width, height = metadata.crop.width, metadata.crop.height
+    if scale and height:
+        width = int(width * scale / height)
+        height = scale
+    return width, height
+
+
+def encode_duration(metadata: Metadata, config) -> float:
+    """
+    The duration of the video after applying the start & end of the config
+    """
+    duration = metadata.estimated_duration
+    if config.end and config.end > 0:
+        duration = config.end
+    elif config.end:
+        duration += config.end
+    if config.start:
+        duration -= config.start
+    return duration
+
+
+def parse_fps(output: str) -> Optional[float]:
+    """
+    The last fps reported in ffmpeg's progress output
+    """
+    matches = FPS_PATTERN.findall(output or "")
+    return float(matches[-1][0]) if matches else None
+
+
+def create_record(
+    input: str,
+    output: str,
+    metadata: Metadata,
+    config,
+    elapsed: float,
+    ffmpeg_output: Optional[str] = None,
+) -> EncodeRecord:
+    width, height = output_dimensions(metadata, config)
+    duration = encode_duration(metadata, config)
+    return EncodeRecord(
+        input=input,
+        source_codec=metadata.video_streams[0].codec,
+        width=width,
+        height=height,
+        duration=duration,
+        video_codec=config.video_codec,
+        preset=config.preset,
+        crf=config.crf,
+        hardware=config.hardware_accelerated,
+        fps=parse_fps(ffmpeg_output),
+        elapsed=elapsed,
+        input_size=int(metadata.size),
+        output_size=os.path.getsize(output),
+    )
+
+
+class EncodeStatsDatabase:
+    """
+    Stores the results of every conversion to predict future ones
+    """
+
+    def __init__(self, db_file: str = DEFAULT_STATS_FILE):
+        dir = os.path.dirname(db_file)
+        if dir:
+            os.makedirs(dir, exist_ok=True)
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS encodes(input VARCHAR, source_codec VARCHAR, width INTEGER, height INTEGER, duration REAL, video_codec VARCHAR, preset VARCHAR, crf INTEGER, hardware BOOLEAN, fps REAL, elapsed REAL, input_size INTEGER, output_size INTEGER, created REAL);"
+        )
+        self.conn.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.close()
+
+    def close(self):
+        self.conn.close()
+
+    def record(self, record: EncodeRecord):
+        logger.debug("Recording: {}".format(record))
+        with self._lock:
+            self.conn.execute(
+                "INSERT INTO encodes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);",
+                (*record, time.time()),
+            )
+            self.conn.commit()
+
+    def find(
+        self,
+        video_codec: str,
+        hardware: bool,
+        preset: Optional[str] = None,
+        source_codec: Optional[str] = None,
+    ) -> List[EncodeRecord]:
+        query = "SELECT input, source_codec, width, height, duration, video_codec, preset, crf, hardware, fps, elapsed, input_size, output_size FROM encodes WHERE video_codec = ? AND hardware = ?"
+        params = [video_codec, hardware]
+        if preset is not None:
+            query += " AND preset = ?"
+            params.append(preset)
+        if source_codec is not None:
+            query += " AND source_codec = ?"
+            params.append(source_codec)
+        with self._lock:
+            rows = self.conn.execute(query, params).fetchall()
+        return [EncodeRecord(*row) for row in rows]
+
+
+class EncodePredictor:
+    """
+    Estimates wall time and output size from similar past conversions.
+
+    Time is predicted from the pixel throughput (pixels * media seconds per wall second) and size from the
+    bytes per pixel per second, normalized to the planned CRF.
+    """
+
+    def __init__(self, db: EncodeStatsDatabase):
+        self.db = db
+
+    def _similar(self, metadata: Metadata, config) -> List[EncodeRecord]:
+        source_codec = metadata.video_streams[0].codec
+        hardware = config.hardware_accelerated
+        for preset, codec in ((config.preset, source_codec), (config.preset, None)):
+            records = self.db.find(config.video_codec, hardware, preset, codec)
+            if len(records) >= MIN_RECORDS:
+                return records
+        return self.db.find(config.video_codec, hardware)
+
+    def estimate(self, metadata: Metadata, config) -> EncodeEstimate:
+        if not metadata.video_streams or not metadata.estimated_duration:
+            return EncodeEstimate(None, None, 0)
+        records = [r for r in self._similar(metadata, config) if r.pixels and r.elapsed]
+        if not records:
+            return EncodeEstimate(None, None, 0)
+        width, height = output_dimensions(metadata, config)
+        pixels = width * height
+        duration = encode_duration(metadata, config)
+
+        throughput = statistics.median(r.speed * r.pixels for r in records)
+        seconds = duration * pixels / throughput
+
+        bytes_per_pixel_second = statistics.median(
+            r.output_size
+            / (r.pixels * r.duration)
+            * 2 ** ((r.crf - config.crf) / CRF_DOUBLING)
+            for r in records
+        )
+        size = int(bytes_per_pixel_second * pixels * duration)
+        return EncodeEstimate(seconds, size, len(records))
+
+    def estimate_queue(
+        self, jobs: Iterable[Tuple[Metadata, object]]
+    ) -> Tuple[List[EncodeEstimate], EncodeEstimate]:
+        """
+        Estimates each (metadata, config) job and the total of the queue
+        :return: the list of estimates and the total. The total only includes jobs which could be estimated
+        """
+        estimates = [self.estimate(m, c) for m, c in jobs]
+        known = [e for e in estimates if e.seconds is not None]
+        total = EncodeEstimate(
+            sum(e.seconds for e in known),
+            sum(e.size for e in known),
+            len(known),
+        )
+        return estimates, total
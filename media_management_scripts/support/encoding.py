@@ -206,6 +206,16 @@ class H264Preset(Enum):
         raise ValueError(f"Invalid preset: {value}")
 
 
+class SizeFallback(Enum):
+    """
+    What to do when a conversion is projected to be larger than allowed
+    """
+
+    REMUX = "remux"
+    CRF = "crf"
+    NONE = "none"
+
+
 class SubtitleCodec(Enum):
     COPY = "copy"
     SRT = "srt"
@@ -1,3 +1,4 @@
+from collections import deque
 from io import StringIO
 import logging
 import subprocess
@@ -77,6 +78,12 @@ exe_logger = logging.getLogger("executable-logger")
 DEBUG_MODE = False
 logger = logging.getLogger(__name__)
 
+# ffmpeg's periodic progress lines, eg frame=  128 fps= 85 q=28.0 size=      27kB time=00:00:05.66 ...
+PROGRESS_PATTERN = re.compile(r"^\s*(frame|size)=.*time=")
+LINE_END_PATTERN = re.compile(r"[\r\n]")
+# The number of lines of output to keep when it is only needed to report errors
+ERROR_OUTPUT_LINES = 200
+
 
 class FFMpegProgress(NamedTuple):
     """
@@ -96,6 +103,18 @@ class FFMpegProgress(NamedTuple):
         except ValueError:
             return None
 
+    @property
+    def bitrate_as_bits(self):
+        """
+        The average bitrate of the output so far in bits per second
+        """
+        if self.bitrate.endswith("kbits/s"):
+            try:
+                return float(self.bitrate[: -len("kbits/s")]) * 1000
+            except ValueError:
+                return None
+        return None
+
     def progress(self, duration: float):
         return self.time_as_seconds / duration if self.time_as_seconds else 0
 
@@ -168,7 +187,100 @@ def execute_with_timeout(
             raise e
 
 
-def execute_with_output(args, print_output=False, use_nice=True) -> Tuple[int, str]:
+class OutputCapture:
+    """
+    Captures the output of a process.
+
+    By default all of the output is kept. With max_lines only the last lines are kept in a ring buffer, and ffmpeg's
+    progress lines are dropped except for the last one, so memory does not grow with the length of the run. The full
+    output can be streamed to a log file in either mode.
+    """
+
+    def __init__(self, max_lines: Optional[int] = None, log_file: Optional[str] = None):
+        self._output = StringIO() if max_lines is None else None
+        self._lines = deque(maxlen=max_lines) if max_lines is not None else None
+        self._line = []
+        # A line ended by a carriage return, which is progress unless the next character makes it a \r\n
+        self._returned = None
+        self._progress = None
+        self._log = open(log_file, "a") if log_file else None
+
+    def _add_line(self, line: str, progress: bool):
+        if progress or PROGRESS_PATTERN.match(line):
+            self._progress = line
+        elif line:
+            self._lines.append(line)
+
+    def write(self, text: str):
+        if self._log:
+            self._log.write(text)
+        if self._output is not None:
+            self._output.write(text)
+            return
+        start = 0
+        for m in LINE_END_PATTERN.finditer(text):
+            if self._returned is not None:
+                line = self._returned
+                self._returned = None
+                if m.start() == start and m.group() == "\n":
+                    self._add_line(line, False)
+                    start = m.end()
+                    continue
+                self._add_line(line, True)
+            self._line.append(text[start : m.start()])
+            line = "".join(self._line)
+            self._line = []
+            if m.group() == "\r":
+                self._returned = line
+            else:
+                self._add_line(line, False)
+            start = m.end()
+        if start < len(text):
+            if self._returned is not None:
+                self._add_line(self._returned, True)
+                self._returned = None
+            self._line.append(text[start:])
+
+    def getvalue(self) -> str:
+        if self._output is not None:
+            return self._output.getvalue()
+        lines = list(self._lines)
+        progress = self._progress
+        if self._returned:
+            progress = self._returned
+        partial = "".join(self._line)
+        if PROGRESS_PATTERN.match(partial):
+            progress = partial
+        elif partial:
+            lines.append(partial)
+        if progress:
+            lines.append(progress)
+        return "\n".join(lines)
+
+    def close(self):
+        if self._log:
+            self._log.close()
+            self._log = None
+        if self._output is not None:
+            self._output.close()
+
+
+def execute_with_output(
+    args,
+    print_output=False,
+    use_nice=True,
+    callback: Optional[Callable[[str], None]] = None,
+    max_lines: Optional[int] = None,
+    log_file: Optional[str] = None,
+) -> Tuple[int, str]:
+    """
+    Executes the args, capturing stdout & stderr
+    :param callback: optionally called with each line of output. If it raises, the process is killed and the exception re-raised
+    :param max_lines: only keep the last lines of output, without progress lines other than the last. Use this when
+        the output is only needed to report errors, eg ERROR_OUTPUT_LINES
+    :param log_file: also append all of the output to this file
+    :return: the return code and the output
+    """
     if not args:
         raise ValueError("No args provided")
     args = maybe_add_nice(args, use_nice)
@@ -177,7 +289,8 @@ def execute_with_output(args, print_output=False, use_nice=True) -> Tuple[int, s
         logger.debug("Debug mod enabled, skipping actual execution")
         return 0
     with subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT) as p:
-        output = StringIO()
+        output = OutputCapture(max_lines, log_file)
+        line = StringIO()
         while p.poll() is None:
             l = p.stdout.read(1)
             try:
@@ -189,6 +302,18 @@ def execute_with_output(args, print_output=False, use_nice=True) -> Tuple[int, s
                 if print_output:
                     print(ex)
                 output.write(str(ex))
+                continue
+            if callback:
+                if l == "\n" or l == "\r":
+                    try:
+                        callback(line.getvalue())
+                    except Exception as ex:
+                        p.kill()
+                        output.close()
+                        raise ex
+                    line = StringIO()
+                else:
+                    line.write(l)
         l = p.stdout.read()
         if l:
             try:
@@ -200,11 +325,14 @@ def execute_with_output(args, print_output=False, use_nice=True) -> Tuple[int, s
                 if print_output:
                     print(ex)
                 output.write(str(ex))
+                l = ""
+        if callback:
+            for remaining in (line.getvalue() + (l or "")).splitlines():
+                callback(remaining)
         result = output.getvalue()
         output.close()
         if print_output:
             exe_logger.debug(result)
-        output.close()
         return p.poll(), result
 
 
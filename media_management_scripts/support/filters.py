@@ -0,0 +1,245 @@
+from typing import List, Optional, Tuple
+
+from media_management_scripts.support.telecine import (
+    INVERSE_TELECINE_FILTER,
+    ScanType,
+    classify,
+)
+
+# Filters are always applied in this order regardless of the order they are set:
+# crop first so every later filter works on fewer pixels, deinterlace before
+# any resize (scaling interlaced frames blends the fields), then frame rate,
+# scale and finally the pixel format conversion.
+FILTER_ORDER = ["crop", "deinterlace", "fps", "scale", "format"]
+
+
+class VideoFilterChain:
+    """
+    Builds a single ffmpeg video filter chain.
+
+    ffmpeg only honors the last -vf argument, so every video filter must be combined into one chain.
+    """
+
+    def __init__(
+        self, hardware_nvidia: bool = False, filter_threads: Optional[int] = None
+    ):
+        self.hardware_nvidia = hardware_nvidia
+        self.filter_threads = filter_threads
+        self._filters = {}
+
+    def crop(self, width: int, height: int, x: int = 0, y: int = 0):
+        if self.hardware_nvidia:
+            raise Exception(
+                "Cropping is not supported with nvidia hardware acceleration"
+            )
+        self._filters["crop"] = "crop={}:{}:{}:{}".format(width, height, x, y)
+        return self
+
+    def deinterlace(
+        self, filter: str = "yadif", ranges: Optional[List[Tuple[float, float]]] = None
+    ):
+        """
+        :param filter: the deinterlace filter, it must support timeline editing (yadif, bwdif) if ranges are given
+        :param ranges: only deinterlace these (start, end) time ranges of the output
+        """
+        if self.hardware_nvidia and ranges:
+            raise Exception(
+                "Deinterlacing ranges is not supported with nvidia hardware acceleration"
+            )
+        if self.hardware_nvidia and filter == "yadif":
+            filter = "yadif_cuda"
+        if ranges:
+            enable = "+".join(
+                "between(t,{:.3f},{:.3f})".format(start, end) for start, end in ranges
+            )
+            filter = "{}{}enable='{}'".format(
+                filter, ":" if "=" in filter else "=", enable
+            )
+        self._filters["deinterlace"] = filter
+        return self
+
+    def inverse_telecine(self):
+        """
+        Recovers the progressive frames of telecined content. This replaces any deinterlace filter.
+        """
+        if self.hardware_nvidia:
+            raise Exception(
+                "Inverse telecine is not supported with nvidia hardware acceleration"
+            )
+        self._filters["deinterlace"] = INVERSE_TELECINE_FILTER
+        return self
+
+    def fps(self, fps):
+        self._filters["fps"] = "fps={}".format(fps)
+        return self
+
+    def scale(self, height: int, width: int = -2):
+        """
+        Scale to the given height. The default width of -2 keeps the aspect ratio while ensuring an even width.
+        """
+        if self.hardware_nvidia:
+            self._filters["scale"] = "scale_cuda={}:{}".format(width, height)
+        else:
+            self._filters["scale"] = "scale={}:{}".format(width, height)
+        return self
+
+    def format(self, pix_fmt: str):
+        self._filters["format"] = "format={}".format(pix_fmt)
+        return self
+
+    def has(self, name: str) -> bool:
+        return name in self._filters
+
+    def filters(self) -> List[str]:
+        return [self._filters[f] for f in FILTER_ORDER if f in self._filters]
+
+    def build(self) -> Optional[str]:
+        filters = self.filters()
+        return ",".join(filters) if filters else None
+
+    def build_split(
+        self, heights: List[Optional[int]], input_label: str = "0:v"
+    ) -> Tuple[str, List[str]]:
+        """
+        Builds a filtergraph which runs the chain once, then splits the frames into one branch per height.
+
+        The scale filter of the chain is replaced by each branch's own scale.
+        :param heights: the height of each branch, None keeps the height
+        :param input_label: the input stream of the graph
+        :return: the graph for -filter_complex and the output label of each branch
+        """
+        shared = [
+            self._filters[f]
+            for f in FILTER_ORDER
+            if f in self._filters and f != "scale"
+        ]
+        shared.append("split={}".format(len(heights)))
+        labels = ["v{}".format(i) for i in range(len(heights))]
+        graph = "[{}]{}{}".format(
+            input_label,
+            ",".join(shared),
+            "".join("[s{}]".format(i) for i in range(len(heights))),
+        )
+        for i, height in enumerate(heights):
+            if height is None:
+                branch = "null"
+            elif self.hardware_nvidia:
+                branch = "scale_cuda=-2:{}".format(height)
+            else:
+                branch = "scale=-2:{}".format(height)
+            graph += ";[s{}]{}[{}]".format(i, branch, labels[i])
+        return graph, labels
+
+    def __bool__(self):
+        return len(self._filters) > 0
+
+    def __repr__(self):
+        return "<VideoFilterChain: {}>".format(self.build())
+
+    def thread_args(self, complex_graph: bool = False) -> List[str]:
+        """
+        The global thread arguments for the filtergraph. These must be placed before any inputs
+        """
+        if not self.filter_threads:
+            return []
+        if complex_graph:
+            return ["-filter_complex_threads", str(self.filter_threads)]
+        return ["-filter_threads", str(self.filter_threads)]
+
+    def to_args(self) -> List[str]:
+        chain = self.build()
+        return ["-vf", chain] if chain else []
+
+
+def _deinterlace_all(
+    chain: VideoFilterChain, config, report, is_interlaced: bool, print_output=False
+):
+    """
+    Inverse telecines the whole file if the report shows a pulldown cadence, otherwise deinterlaces it if interlaced
+    """
+    if (
+        config.inverse_telecine
+        and not config.hardware_nvidia
+        and classify(report, config.deinterlace_threshold) == ScanType.TELECINED
+    ):
+        if print_output:
+            print("Telecined: {}".format(report.repeated))
+        chain.inverse_telecine()
+    elif is_interlaced:
+        chain.deinterlace()
+
+
+def cropped_height(height: int, metadata) -> int:
+    """
+    Scales a target height of the full frame to the cropped frame, so cropping does not change the scale factor
+    :param height: the target height of the full frame
+    :param metadata: the Metadata of the input with the crop
+    :return: the even target height of the cropped frame
+    """
+    source_height = metadata.video_streams[0].height
+    height = int(round(height * metadata.crop.height / source_height))
+    return height - height % 2
+
+
+def create_filter_chain(config, metadata=None, print_output=False) -> VideoFilterChain:
+    """
+    Creates the video filter chain for a convert
+    :param config: the ConvertConfig
+    :param metadata: the Metadata of the input, required if config.deinterlace is set. If
+        config.deinterlace_segments is also set and it has an interlace map, only the interlaced ranges are deinterlaced.
+        If config.inverse_telecine is set, telecined content is inverse telecined instead of deinterlaced.
+        If config.auto_crop is set, it is cropped to metadata.crop
+    :param print_output: whether to print the interlace decision
+    :return:
+    """
+    chain = VideoFilterChain(
+        hardware_nvidia=config.hardware_nvidia, filter_threads=config.filter_threads
+    )
+    crop = (
+        config.auto_crop
+        and metadata is not None
+        and metadata.crop
+        and not config.hardware_nvidia
+    )
+    if crop:
+        if print_output:
+            print("Cropping to {}".format(metadata.crop))
+        chain.crop(*metadata.crop)
+    if (
+        config.deinterlace
+        and config.deinterlace_segments
+        and metadata.interlace_map
+        and not config.hardware_nvidia
+    ):
+        interlace_map = metadata.interlace_map
+        # Filter timestamps start at zero after seeking to the start
+        offset = config.start or 0
+        ranges = [
+            (max(start - offset, 0), end - offset)
+            for start, end in interlace_map.interlaced_ranges(
+                config.deinterlace_threshold
+            )
+            if end > offset
+        ]
+        if print_output:
+            print("Interlaced ranges: {}".format(ranges))
+        if ranges and interlace_map.is_mixed(config.deinterlace_threshold):
+            chain.deinterlace(ranges=ranges)
+        elif ranges:
+            _deinterlace_all(chain, config, interlace_map.report, True, print_output)
+    elif config.deinterlace:
+        is_interlaced = metadata.interlace_report.is_interlaced(
+            config.deinterlace_threshold
+        )
+        if print_output:
+            print(
+                "{} - Interlaced: {}".format(metadata.interlace_report, is_interlaced)
+            )
+        _deinterlace_all(
+            chain, config, metadata.interlace_report, is_interlaced, print_output
+        )
+    if config.scale and crop:
+        chain.scale(cropped_height(config.scale, metadata))
+    elif config.scale:
+        chain.scale(config.scale)
+    return chain
@@ -2,6 +2,8 @@ import re
 from typing import Optional
 
 DURATION_PATTERN = re.compile(r"-?(((\d+(\.\d+)?)h)?(\d+(\.\d+)?)m)?(\d+(\.\d+)?)s")
+SIZE_PATTERN = re.compile(r"^(\d+(\.\d+)?)\s*([KMGTP]?)i?B?$", re.IGNORECASE)
+SIZE_UNITS = ["", "K", "M", "G", "T", "P"]
 
 
 def sizeof_fmt(num, suffix="B"):
@@ -12,6 +14,20 @@ def sizeof_fmt(num, suffix="B"):
     return "%.1f%s%s" % (num, "Yi", suffix)
 
 
+def size_from_str(size_str):
+    """
+    Converts a size such as 700M or 2.5G to bytes (using 1024 like sizeof_fmt)
+    :param size_str:
+    :return:
+    """
+    m = SIZE_PATTERN.match(size_str.strip())
+    if m:
+        unit = SIZE_UNITS.index(m.group(3).upper())
+        return int(float(m.group(1)) * (1024**unit))
+    else:
+        raise Exception("Invalid size format: " + size_str)
+
+
 def duration_to_str(seconds):
     m, s = divmod(seconds, 60)
     h, m = divmod(m, 60)
@@ -0,0 +1,245 @@
+import re
+import subprocess
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterator, List, NamedTuple, Optional, Tuple
+
+from media_management_scripts.support.executables import ffmpeg
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Bytes per pixel of the supported raw pixel formats
+PIXEL_FORMATS = {"gray": 1, "rgb24": 3, "bgr24": 3}
+
+DEFAULT_BATCH_SIZE = 32
+
+SHOWINFO_PTS_PATTERN = re.compile(
+    r"Parsed_showinfo_\d+ @ \w+\] n:\s*\d+ pts:\s*-?\d+ pts_time:(-?[\d.]+)"
+)
+
+
+class FrameBatch(NamedTuple):
+    """
+    Consecutive decoded frames and their timestamps.
+
+    The frames are a view of the sampler's buffer which is reused for the next batch, so copy any frames that need to
+    be kept. With numpy the frames are a uint8 array of shape (count, height, width) or (count, height, width,
+    channels), otherwise a memoryview of the raw bytes.
+    """
+
+    # Seconds from the start of the file
+    times: List[float]
+    frames: Any
+    width: int
+    height: int
+    channels: int
+
+    @property
+    def count(self):
+        return len(self.times)
+
+    @property
+    def frame_size(self):
+        return self.width * self.height * self.channels
+
+    def frame(self, i: int):
+        """
+        A single frame, as an array if numpy is available otherwise as bytes
+        """
+        if numpy is not None:
+            return self.frames[i]
+        return self.frames[i * self.frame_size : (i + 1) * self.frame_size]
+
+
+def scaled_height(metadata, width: int) -> int:
+    """
+    The even height which keeps the aspect ratio of the video when scaled to the width
+    """
+    video = metadata.video_streams[0]
+    return max(2, int(round(width * video.height / video.width / 2)) * 2)
+
+
+class _TimestampReader(threading.Thread):
+    """
+    Collects the frame timestamps showinfo writes to ffmpeg's stderr while the frames are read from stdout
+    """
+
+    def __init__(self, stream):
+        super().__init__(daemon=True)
+        self.stream = stream
+        self.times = []
+        self.done = False
+        # The last few lines of other output, for errors
+        self.output = deque(maxlen=20)
+        self._condition = threading.Condition()
+
+    def run(self):
+        for line in self.stream:
+            line = line.decode("utf-8", errors="replace")
+            m = SHOWINFO_PTS_PATTERN.search(line)
+            with self._condition:
+                if m:
+                    self.times.append(float(m.group(1)))
+                    self._condition.notify_all()
+                else:
+                    self.output.append(line)
+        with self._condition:
+            self.done = True
+            self._condition.notify_all()
+
+    def get(self, i: int) -> Optional[float]:
+        with self._condition:
+            self._condition.wait_for(lambda: len(self.times) > i or self.done)
+            return self.times[i] if len(self.times) > i else None
+
+
+def _allocate(batch_size: int, width: int, height: int, channels: int):
+    if numpy is not None:
+        shape = (batch_size, height, width)
+        if channels > 1:
+            shape += (channels,)
+        array = numpy.empty(shape, dtype=numpy.uint8)
+        return array, memoryview(array).cast("B")
+    buffer = bytearray(batch_size * width * height * channels)
+    return buffer, memoryview(buffer)
+
+
+def _read_frame(stream, view) -> bool:
+    """
+    Reads exactly one frame into the view
+    :return: False at the end of the stream
+    """
+    read = 0
+    while read < len(view):
+        n = stream.readinto(view[read:])
+        if not n:
+            if read:
+                raise Exception(
+                    "Partial frame: read {} of {} bytes".format(read, len(view))
+                )
+            return False
+        read += n
+    return True
+
+
+def sample_frames(
+    input_file,
+    width: int,
+    height: int,
+    pix_fmt="gray",
+    fps: float = None,
+    start: float = None,
+    end: float = None,
+    batch_size=DEFAULT_BATCH_SIZE,
+    keyframes_only=False,
+    scale_flags: str = None,
+) -> Iterator[FrameBatch]:
+    """
+    Decodes frames scaled down to the given size and yields them in batches.
+
+    ffmpeg writes raw frames to a pipe which are read directly into a preallocated buffer, so there is no copy per
+    frame. Install numpy to get the frames as arrays.
+    :param input_file:
+    :param width:
+    :param height:
+    :param pix_fmt: one of PIXEL_FORMATS
+    :param fps: sample at this rate, defaults to every frame
+    :param start: input seek to this time
+    :param end: stop at this time
+    :param batch_size: the maximum number of frames per batch
+    :param keyframes_only: only decode keyframes
+    :param scale_flags: the scaling algorithm, eg area when shrinking a lot
+    """
+    if pix_fmt not in PIXEL_FORMATS:
+        raise Exception("Unsupported pixel format: {}".format(pix_fmt))
+    channels = PIXEL_FORMATS[pix_fmt]
+    filters = []
+    if fps:
+        filters.append("fps={}".format(fps))
+    scale = "scale={}:{}".format(width, height)
+    if scale_flags:
+        scale += ":flags={}".format(scale_flags)
+    filters.append(scale)
+    filters.append("format={}".format(pix_fmt))
+    filters.append("showinfo")
+
+    args = [ffmpeg(), "-hide_banner", "-nostats"]
+    if keyframes_only:
+        args.extend(["-skip_frame", "nokey"])
+    if start:
+        args.extend(["-ss", str(start)])
+    args.extend(["-i", input_file])
+    if end is not None:
+        args.extend(["-t", str(end - (start or 0))])
+    args.extend(["-map", "0:v:0", "-vf", ",".join(filters), "-vsync", "0"])
+    args.extend(["-f", "rawvideo", "-pix_fmt", pix_fmt, "pipe:1"])
+
+    frames, view = _allocate(batch_size, width, height, channels)
+    frame_size = width * height * channels
+    offset = start or 0
+    with subprocess.Popen(
+        args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    ) as p:
+        reader = _TimestampReader(p.stderr)
+        reader.start()
+        try:
+            index = 0
+            finished = False
+            while not finished:
+                count = 0
+                while count < batch_size:
+                    frame_view = view[count * frame_size : (count + 1) * frame_size]
+                    if not _read_frame(p.stdout, frame_view):
+                        finished = True
+                        break
+                    count += 1
+                if count:
+                    times = []
+                    for i in range(index, index + count):
+                        time = reader.get(i)
+                        times.append(offset + time if time is not None else None)
+                    index += count
+                    batch = (
+                        frames[:count]
+                        if numpy is not None
+                        else view[: count * frame_size]
+                    )
+                    yield FrameBatch(times, batch, width, height, channels)
+            ret = p.wait()
+            reader.join()
+            if ret != 0:
+                raise Exception(
+                    "ffmpeg error, return code={}, output={}".format(
+                        ret, "".join(reader.output)
+                    )
+                )
+        finally:
+            if p.poll() is None:
+                p.kill()
+
+
+def map_windows(
+    input_file,
+    bounds: List[Tuple[float, Optional[float]]],
+    fn: Callable[[Iterator[FrameBatch]], Any],
+    max_workers: Optional[int] = None,
+    **kwargs,
+) -> List[Any]:
+    """
+    Samples each (start, end) window concurrently, each with its own ffmpeg process and buffer
+    :param bounds: the windows, see interlace._window_bounds
+    :param fn: called with the batches of a window, its result is returned
+    :param kwargs: passed to sample_frames
+    :return: the result of fn for each window in order
+    """
+
+    def run(window):
+        start, end = window
+        return fn(sample_frames(input_file, start=start, end=end, **kwargs))
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(bounds)) as executor:
+        return list(executor.map(run, bounds))
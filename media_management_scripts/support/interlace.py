@@ -1,13 +1,25 @@
 from media_management_scripts.support.executables import ffmpeg
 from media_management_scripts.support.executables import execute_with_output
-from typing import NamedTuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, NamedTuple, Optional, Tuple
 from collections import namedtuple
+import math
 import re
 
 REPORT_PATTERN = re.compile(
     r"(Single|Multi)[\w\s]+: TFF:\s+(\d+) BFF:\s+(\d+) Progressive:\s+(\d+) Undetermined:\s+(\d+)"
 )
+REPEATED_PATTERN = re.compile(
+    r"Repeated Fields: Neither:\s+(\d+) Top:\s+(\d+) Bottom:\s+(\d+)"
+)
 
+DEFAULT_WINDOWS = 4
+DEFAULT_FRAME_RATE = 30000 / 1001
+SKIP_START = 180
+MIN_SKIP_DURATION = 200
+# 99% confidence
+CONFIDENCE_Z = 2.576
+DEFAULT_SEGMENT_LENGTH = 30
 
 # [Parsed_idet_0 @ 0x7f86dfc07f00] Repeated Fields: Neither:    81 Top:     0 Bottom:     0
 # [Parsed_idet_0 @ 0x7f86dfc07f00] Single frame detection: TFF:     0 BFF:     0 Progressive:    31 Undetermined:    50
@@ -59,9 +71,48 @@ class InterlaceGroup(
         }
 
 
-class InterlaceReport(namedtuple("InterlaceReportBase", ["single", "multi"])):
+class RepeatedFields(namedtuple("RepeatedFieldsBase", ["neither", "top", "bottom"])):
+    """
+    Counts of frames where a field repeats the previous frame's, as happens with telecined content
+    """
+
+    @property
+    def repeated(self):
+        return self.top + self.bottom
+
+    @property
+    def total_frames(self):
+        return self.neither + self.top + self.bottom
+
+    @property
+    def ratio(self):
+        if self.total_frames:
+            return self.repeated / self.total_frames
+        else:
+            return 0
+
+    def combine(self, other):
+        return RepeatedFields(
+            neither=self.neither + other.neither,
+            top=self.top + other.top,
+            bottom=self.bottom + other.bottom,
+        )
+
+    def to_dict(self):
+        return {
+            "neither": self.neither,
+            "top": self.top,
+            "bottom": self.bottom,
+            "total_frames": self.total_frames,
+        }
+
+
+class InterlaceReport(
+    namedtuple("InterlaceReportBase", ["single", "multi", "repeated"], defaults=[None])
+):
     single: InterlaceGroup
     multi: InterlaceGroup
+    repeated: Optional[RepeatedFields]
 
     @property
     def ratio(self):
@@ -95,25 +146,32 @@ class InterlaceReport(namedtuple("InterlaceReportBase", ["single", "multi"])):
         return self.ratio >= threshold
 
     def combine(self, other):
+        if self.repeated and other.repeated:
+            repeated = self.repeated.combine(other.repeated)
+        else:
+            repeated = self.repeated or other.repeated
         return InterlaceReport(
             single=self.single.combine(other.single),
             multi=self.multi.combine(other.multi),
+            repeated=repeated,
         )
 
     def to_dict(self):
         return {
             "interlaced": self.is_interlaced(),
             "single": self.single.to_dict(),
-            "multi": self.single.to_dict(),
+            "multi": self.multi.to_dict(),
+            "repeated": self.repeated.to_dict() if self.repeated else None,
         }
 
 
 def _parse_output(output: str):
-    lines = output.splitlines(False)
-    lines = lines[-2::]
-    single, multi = None, None
+    lines = [l for l in output.splitlines(False) if "Parsed_idet" in l]
+    lines = lines[-3::]
+    single, multi, repeated = None, None, None
     for line in lines:
         m = REPORT_PATTERN.search(line)
+        r = REPEATED_PATTERN.search(line)
         if m:
             if m.group(1) == "Single":
                 single = InterlaceGroup(
@@ -123,60 +181,85 @@ def _parse_output(output: str):
                 multi = InterlaceGroup(
                     int(m.group(2)), int(m.group(3)), int(m.group(4)), int(m.group(5))
                 )
+        elif r:
+            repeated = RepeatedFields(int(r.group(1)), int(r.group(2)), int(r.group(3)))
         else:
             raise Exception("Not matched: {}".format(line))
-    return InterlaceReport(single, multi)
-
-
-def _execute_ffmpeg(input_file: str, frames: int, start: int = 0):
-    args = [
-        ffmpeg(),
-        "-ss",
-        str(start),
-        "-i",
-        input_file,
-        "-filter:v",
-        "idet",
-        "-frames:v",
-        str(frames),
-        "-an",
-        "-f",
-        "rawvideo",
-        "-y",
-        "/dev/null",
-    ]
+    if single is None or multi is None:
+        raise Exception("No idet report found in: {}".format(output))
+    return InterlaceReport(single, multi, repeated)
+
+
+def _execute_ffmpeg(
+    input_file: str, frames: int, start: float = 0, duration: Optional[float] = None
+) -> Optional[InterlaceReport]:
+    """
+    Runs idet on up to the number of frames starting at the start time
+    :param duration: optionally stop after this many seconds
+    :return: the report or None if there were no frames to analyze
+    """
+    # Input seeking jumps to the nearest keyframe instead of decoding up to the start
+    args = [ffmpeg(), "-ss", str(start), "-i", input_file]
+    if duration is not None:
+        args.extend(["-t", str(duration)])
+    args.extend(
+        [
+            "-filter:v",
+            "idet",
+            "-frames:v",
+            str(frames),
+            "-an",
+            "-sn",
+            "-f",
+            "null",
+            "-y",
+            "/dev/null",
+        ]
+    )
     ret, output = execute_with_output(args, print_output=False)
     if ret != 0:
         raise Exception(
             "Non-zero ffmpeg return code: {}. Output={}".format(ret, output)
         )
+    if "Parsed_idet" not in output:
+        return None
     return _parse_output(output)
 
 
-def _find_interlace(
-    input_file: str,
-    frames: int = 100,
-    max_frames: int = 6400,
-    undetermined_threshold: float = 0.5,
-    metadata=None,
-) -> InterlaceReport:
-    # ffmpeg -filter:v idet -frames:v 100 -an -f rawvideo -y /dev/null -i
-    if metadata and metadata.estimated_duration and metadata.estimated_duration < 200:
-        start = 0
-    else:
-        # Skip the first three minutes as this is usually commercials or introduction
-        start = 180
-    report = _execute_ffmpeg(input_file, frames, start=start)
-    if metadata and metadata.estimated_duration:
-        midpoint = int(metadata.estimated_duration / 2)
-        report2 = _execute_ffmpeg(input_file, frames, start=midpoint)
-        report = report.combine(report2)
-    if report.is_undetermined(undetermined_threshold):
-        if frames * 2 < max_frames:
-            report = _find_interlace(
-                input_file, frames * 2, max_frames, undetermined_threshold, metadata
-            )
-    return report
+def _window_bounds(
+    duration: Optional[float], windows: int
+) -> List[Tuple[float, Optional[float]]]:
+    """
+    Evenly spaced (start, end) windows across the file
+    """
+    if not duration:
+        return [(0, None)]
+    # Skip the first three minutes as this is usually commercials or introduction
+    start = SKIP_START if duration >= MIN_SKIP_DURATION else 0
+    length = (duration - start) / windows
+    return [(start + i * length, start + (i + 1) * length) for i in range(windows)]
+
+
+def is_confident(
+    report: InterlaceReport,
+    decision_threshold: float = 0.5,
+    undetermined_threshold: float = 0.33,
+    z: float = CONFIDENCE_Z,
+) -> bool:
+    """
+    Whether the interlaced ratio is far enough from the threshold that more frames would not change the decision.
+
+    Uses the Wilson score interval of the ratio. Frames within a window are correlated, so the interval is optimistic
+    which is why the samples are spread across several windows.
+    """
+    n = report.total_frames
+    if not n or report.is_undetermined(undetermined_threshold):
+        return False
+    p = report.ratio
+    denominator = 1 + z**2 / n
+    center = (p + z**2 / (2 * n)) / denominator
+    half_width = z * math.sqrt(p * (1 - p) / n + z**2 / (4 * n**2)) / denominator
+    return not (center - half_width <= decision_threshold <= center + half_width)
 
 
 def find_interlace(
@@ -185,9 +268,161 @@ def find_interlace(
     max_frames: int = 6400,
     undetermined_threshold: float = 0.33,
     metadata=None,
+    windows: int = DEFAULT_WINDOWS,
+    decision_threshold: float = 0.5,
+    max_workers: Optional[int] = None,
 ) -> InterlaceReport:
+    """
+    Runs idet on evenly spaced windows of the file concurrently.
+
+    Each round continues every window from where it stopped with twice as many frames as the last round. Counts
+    accumulate across rounds and the scan stops once the decision is confident (see is_confident) or each window
+    has analyzed max_frames.
+    :param frames: the frames per window in the first round
+    :param max_frames: the maximum frames per window
+    :param windows: the number of windows, short files or files without a duration use fewer
+    :param decision_threshold: the interlaced ratio the decision is made at
+    """
     if frames > max_frames:
         raise Exception("Frames cannot be larger than max")
-    return _find_interlace(
-        input_file, frames, max_frames, undetermined_threshold, metadata
+    duration = metadata.estimated_duration if metadata else None
+    frame_rate = DEFAULT_FRAME_RATE
+    if metadata and metadata.video_streams and metadata.video_streams[0].frame_rate:
+        frame_rate = metadata.video_streams[0].frame_rate
+    if duration:
+        # Each window should have at least a full first round of frames
+        windows = max(1, min(windows, int(duration * frame_rate / frames)))
+    bounds = _window_bounds(duration, windows)
+    positions = [start for start, end in bounds]
+    active = list(range(len(bounds)))
+
+    def run(i, batch):
+        end = bounds[i][1]
+        return _execute_ffmpeg(
+            input_file,
+            batch,
+            positions[i],
+            end - positions[i] if end is not None else None,
+        )
+
+    report = None
+    analyzed = 0
+    batch = frames
+    with ThreadPoolExecutor(max_workers=max_workers or len(bounds)) as executor:
+        while active:
+            results = list(executor.map(lambda i: run(i, batch), active))
+            next_active = []
+            for i, result in zip(active, results):
+                if result is None or result.single.total_frames == 0:
+                    continue
+                report = result if report is None else report.combine(result)
+                positions[i] += result.single.total_frames / frame_rate
+                end = bounds[i][1]
+                if result.single.total_frames >= batch and (
+                    end is None or positions[i] < end
+                ):
+                    next_active.append(i)
+            analyzed += batch
+            if report and is_confident(
+                report, decision_threshold, undetermined_threshold
+            ):
+                break
+            active = next_active
+            batch = min(batch * 2, max_frames - analyzed)
+            if batch <= 0:
+                break
+    if report is None:
+        empty = InterlaceGroup(0, 0, 0, 0)
+        report = InterlaceReport(empty, empty)
+    return report
+
+
+class InterlaceSegment(NamedTuple):
+    start: float
+    end: float
+    report: InterlaceReport
+
+    def to_dict(self):
+        return {
+            "start": self.start,
+            "end": self.end,
+            "ratio": self.report.ratio,
+            "interlaced": self.report.is_interlaced(),
+        }
+
+
+class InterlaceMap(NamedTuple):
+    """
+    The interlace report of each time segment of a file, for content that mixes interlaced & progressive video
+    """
+
+    segments: List[InterlaceSegment]
+
+    @property
+    def report(self) -> InterlaceReport:
+        """
+        The report of the whole file
+        """
+        empty = InterlaceGroup(0, 0, 0, 0)
+        report = InterlaceReport(empty, empty)
+        for segment in self.segments:
+            report = report.combine(segment.report)
+        return report
+
+    def interlaced_ranges(self, threshold=0.5) -> List[Tuple[float, float]]:
+        """
+        The (start, end) ranges of adjacent interlaced segments
+        """
+        ranges = []
+        for segment in self.segments:
+            if not segment.report.is_interlaced(threshold):
+                continue
+            if ranges and ranges[-1][1] >= segment.start:
+                ranges[-1] = (ranges[-1][0], segment.end)
+            else:
+                ranges.append((segment.start, segment.end))
+        return ranges
+
+    def is_mixed(self, threshold=0.5) -> bool:
+        interlaced = [s.report.is_interlaced(threshold) for s in self.segments]
+        return any(interlaced) and not all(interlaced)
+
+    def to_dict(self):
+        return [s.to_dict() for s in self.segments]
+
+
+def find_interlace_map(
+    input_file: str,
+    metadata,
+    segment_length: float = DEFAULT_SEGMENT_LENGTH,
+    frames: int = 100,
+    max_workers: Optional[int] = None,
+) -> InterlaceMap:
+    """
+    Runs idet on the start of every segment of the file concurrently
+    :param segment_length: the length of each segment in seconds
+    :param frames: the frames to analyze per segment
+    """
+    duration = metadata.estimated_duration
+    if not duration:
+        raise Exception("Could not estimate duration of {}".format(input_file))
+    # A short remainder is folded into the last segment
+    count = max(1, round(duration / segment_length))
+    bounds = [
+        (i * segment_length, (i + 1) * segment_length if i < count - 1 else duration)
+        for i in range(count)
+    ]
+
+    def run(bound):
+        start, end = bound
+        return _execute_ffmpeg(input_file, frames, start, end - start)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        reports = list(executor.map(run, bounds))
+    empty = InterlaceGroup(0, 0, 0, 0)
+    return InterlaceMap(
+        [
+            InterlaceSegment(start, end, report or InterlaceReport(empty, empty))
+            for (start, end), report in zip(bounds, reports)
+        ]
     )
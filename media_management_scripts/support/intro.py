@@ -0,0 +1,328 @@
+import base64
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from media_management_scripts.support.dupes import (
+    HASH_HEIGHT,
+    HASH_WIDTH,
+    difference_hash,
+    hamming,
+)
+from media_management_scripts.support.episode_finder import find_episodes
+from media_management_scripts.support.files import movie_files_filter
+from media_management_scripts.support.frames import numpy, sample_frames
+from media_management_scripts.utils import extract_metadata
+
+logger = logging.getLogger(__name__)
+
+# Seconds at the start of each episode searched for an intro and at the end for credits
+HEAD_SECONDS = 600
+TAIL_SECONDS = 300
+# The maximum differing bits for two frame hashes to match
+BIT_THRESHOLD = 10
+# The minimum length in seconds of a shared segment
+MIN_SEGMENT = 15
+# Seconds of mismatched frames allowed within a shared segment, eg from an episode title over the intro
+MAX_GAP = 2
+# The number of episodes before & after each episode it is compared with
+NEIGHBOURS = 2
+# Segments within this many seconds of the start or end of a file can be dropped by trimming
+EDGE_TOLERANCE = 1.0
+
+SEGMENTS_CACHE_KEY = "segments"
+
+
+class SegmentKind(Enum):
+    INTRO = "intro"
+    CREDITS = "credits"
+
+
+class SegmentAction(Enum):
+    CHAPTER = "chapter"
+    DROP = "drop"
+
+
+class Segment(NamedTuple):
+    kind: SegmentKind
+    start: float
+    end: float
+
+    @property
+    def title(self):
+        return self.kind.value.capitalize()
+
+    def to_dict(self):
+        return {"kind": self.kind.value, "start": self.start, "end": self.end}
+
+
+class EpisodeHashes(NamedTuple):
+    """
+    A frame hash per second of the start and end of a file
+    """
+
+    duration: float
+    head: Tuple[int, ...]
+    tail_start: float
+    tail: Tuple[int, ...]
+
+
+class SegmentMatch(NamedTuple):
+    # Seconds
+    length: int
+    # Index of the first matching hash in each sequence
+    a_start: int
+    b_start: int
+
+
+def _hash_range(input_file, start: float, end: float) -> Tuple[int, ...]:
+    hashes = []
+    for batch in sample_frames(
+        input_file,
+        HASH_WIDTH,
+        HASH_HEIGHT,
+        fps=1,
+        start=start,
+        end=end,
+        batch_size=64,
+        scale_flags="area",
+    ):
+        hashes.extend(difference_hash(batch.frame(i)) for i in range(batch.count))
+    return tuple(hashes)
+
+
+def compute_hashes(
+    input_file, head: int = HEAD_SECONDS, tail: int = TAIL_SECONDS
+) -> EpisodeHashes:
+    duration = extract_metadata(input_file).estimated_duration
+    if not duration:
+        raise Exception("Cannot determine the duration of {}".format(input_file))
+    head_end = min(head, duration)
+    # The windows do not overlap so the intro of a short episode is not also found as its credits
+    tail_start = max(head_end, math.floor(duration - tail))
+    return EpisodeHashes(
+        duration,
+        _hash_range(input_file, 0, head_end),
+        tail_start,
+        _hash_range(input_file, tail_start, duration),
+    )
+
+
+def episode_hashes(
+    input_file, head: int = HEAD_SECONDS, tail: int = TAIL_SECONDS, cache=None
+) -> EpisodeHashes:
+    """
+    The hashes of a file, computed once and stored by its fingerprint in the AnalysisCache
+    """
+    key = "intro-hashes:{}:{}".format(head, tail)
+    hashes = cache.get(input_file, key) if cache else None
+    if hashes is None:
+        hashes = compute_hashes(input_file, head, tail)
+        if cache:
+            cache.put(input_file, key, hashes)
+    return hashes
+
+
+def _match_matrix(a: Tuple[int, ...], b: Tuple[int, ...], threshold: int):
+    """
+    Whether each hash in a matches each hash in b
+    """
+    if numpy is not None:
+        x = (
+            numpy.array(a, dtype=numpy.uint64)[:, None]
+            ^ numpy.array(b, dtype=numpy.uint64)[None, :]
+        )
+        bits = numpy.unpackbits(x.view(numpy.uint8).reshape(len(a), len(b), 8), axis=2)
+        return bits.sum(axis=2) <= threshold
+    return [[hamming(i, j) <= threshold for j in b] for i in a]
+
+
+def _diagonal(matrix, offset: int) -> List[int]:
+    """
+    The indexes along the diagonal matrix[i][i + offset] which match
+    """
+    if numpy is not None:
+        return numpy.flatnonzero(numpy.diagonal(matrix, offset)).tolist()
+    start = max(0, -offset)
+    end = min(len(matrix), len(matrix[0]) - offset)
+    return [k for k, i in enumerate(range(start, end)) if matrix[i][i + offset]]
+
+
+def _runs(indexes: List[int], max_gap: int) -> Iterator[Tuple[int, int]]:
+    """
+    The (first, last) of each run of sorted indexes with at most max_gap missing between consecutive ones
+    """
+    if not indexes:
+        return
+    first = previous = indexes[0]
+    for i in indexes[1:]:
+        if i - previous > max_gap + 1:
+            yield first, previous
+            first = i
+        previous = i
+    yield first, previous
+
+
+def longest_match(
+    a: Tuple[int, ...],
+    b: Tuple[int, ...],
+    threshold: int = BIT_THRESHOLD,
+    max_gap: int = MAX_GAP,
+) -> Optional[SegmentMatch]:
+    """
+    Cross-correlates two hash sequences: every alignment of b against a is a diagonal of the match matrix, and the
+    longest run of matches along any diagonal is the longest shared segment
+    """
+    if not a or not b:
+        return None
+    matrix = _match_matrix(a, b, threshold)
+    best = None
+    for offset in range(-(len(a) - 1), len(b)):
+        base = max(0, -offset)
+        for first, last in _runs(_diagonal(matrix, offset), max_gap):
+            length = last - first + 1
+            if best is None or length > best.length:
+                best = SegmentMatch(length, base + first, base + first + offset)
+    return best
+
+
+def _best_segment(
+    hashes: List[EpisodeHashes], i: int, neighbours: int, kind: SegmentKind
+) -> Optional[Segment]:
+    best = None
+    others = [j for j in range(i - neighbours, i + neighbours + 1) if j != i]
+    for j in others:
+        if not 0 <= j < len(hashes):
+            continue
+        if kind == SegmentKind.INTRO:
+            match = longest_match(hashes[i].head, hashes[j].head)
+            offset = 0
+        else:
+            match = longest_match(hashes[i].tail, hashes[j].tail)
+            offset = hashes[i].tail_start
+        if match and match.length >= MIN_SEGMENT:
+            if best is None or match.length > best.end - best.start:
+                start = offset + match.a_start
+                best = Segment(
+                    kind, start, min(start + match.length, hashes[i].duration)
+                )
+    return best
+
+
+def season_files(dir) -> List[str]:
+    """
+    The video files of a season directory in episode order
+    """
+    episodes = sorted(e for e in find_episodes(dir) if movie_files_filter(e.path))
+    return [e.path for e in episodes]
+
+
+def detect_segments(
+    files: List[str],
+    head: int = HEAD_SECONDS,
+    tail: int = TAIL_SECONDS,
+    neighbours: int = NEIGHBOURS,
+    cache=None,
+    max_workers: Optional[int] = None,
+) -> Dict[str, List[Segment]]:
+    """
+    Finds the intro & credits of each episode of a season by the segments it shares with nearby episodes.
+
+    The segments are stored in the cache so convert can chapter mark or drop them.
+    :param files: the episodes in order
+    :param head: seconds from the start searched for an intro
+    :param tail: seconds from the end searched for credits
+    :param neighbours: the number of episodes before & after each episode it is compared with
+    :return: file => segments
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        hashes = list(
+            executor.map(lambda f: episode_hashes(f, head, tail, cache), files)
+        )
+    results = {}
+    for i, file in enumerate(files):
+        segments = [
+            s
+            for s in (
+                _best_segment(hashes, i, neighbours, SegmentKind.INTRO),
+                _best_segment(hashes, i, neighbours, SegmentKind.CREDITS),
+            )
+            if s
+        ]
+        logger.debug("Segments of {}: {}".format(file, segments))
+        results[file] = segments
+        if cache:
+            cache.put(file, SEGMENTS_CACHE_KEY, segments)
+    return results
+
+
+def trim_segments(
+    segments: List[Segment], duration: float
+) -> Tuple[Optional[float], Optional[float], List[Segment]]:
+    """
+    How to drop the segments at the very start or end of a file by trimming
+    :return: the new start & end (None if unchanged) and the segments that cannot be dropped this way
+    """
+    start, end, remaining = None, None, []
+    for s in segments:
+        if s.start <= EDGE_TOLERANCE:
+            start = max(start or 0, s.end)
+        elif s.end >= duration - EDGE_TOLERANCE:
+            end = min(end or duration, s.start)
+        else:
+            remaining.append(s)
+    return start, end, remaining
+
+
+def segment_chapters(
+    segments: List[Segment], duration: float, chapters=(), offset: float = 0
+) -> List[Tuple[float, float, str]]:
+    """
+    Chapters marking the segments, keeping the file's existing chapters around them
+    :param chapters: the file's Chapters
+    :param offset: the start time of the output in the input, chapters are shifted and clipped to it
+    :return: (start, end, title) of each chapter
+    """
+    boundaries = {0.0, float(duration)}
+    boundaries.update(c.start_time for c in chapters)
+    for s in segments:
+        boundaries.update((s.start, s.end))
+    boundaries = sorted(b for b in boundaries if 0 <= b <= duration)
+    result = []
+    for start, end in zip(boundaries, boundaries[1:]):
+        title = next((s.title for s in segments if s.start <= start < s.end), None)
+        if title is None:
+            title = next(
+                (c.title for c in chapters if c.start_time <= start < c.end_time), None
+            )
+        title = title or "Chapter"
+        if result and result[-1][2] == title:
+            result[-1] = (result[-1][0], end, title)
+        else:
+            result.append((start, end, title))
+    shifted = []
+    for start, end, title in result:
+        start, end = max(0.0, start - offset), end - offset
+        if end > start:
+            shifted.append((start, end, title))
+    return shifted
+
+
+def ffmetadata_uri(chapters: List[Tuple[float, float, str]]) -> str:
+    """
+    An ffmpeg data URI of an FFMETADATA file with the chapters, used as an input with -map_chapters
+    """
+    lines = [";FFMETADATA1"]
+    for start, end, title in chapters:
+        lines.append("[CHAPTER]")
+        lines.append("TIMEBASE=1/1000")
+        lines.append("START={}".format(int(start * 1000)))
+        lines.append("END={}".format(int(end * 1000)))
+        escaped = title
+        for c in "\\=;#\n":
+            escaped = escaped.replace(c, "\\" + c)
+        lines.append("title={}".format(escaped))
+    data = base64.b64encode("\n".join(lines).encode("utf-8")).decode("ascii")
+    return "data:text/plain;base64,{}".format(data)
@@ -0,0 +1,153 @@
+import subprocess
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+from media_management_scripts.support.executables import ffprobe
+
+# ffmpeg seeks up to 3/23s before the requested time for streams with B-frames, so an input seek exactly on a
+# keyframe can land on the previous one. Seeking partway into the GOP still lands on the intended keyframe.
+SEEK_MARGIN = 0.5
+
+
+class Keyframe(NamedTuple):
+    time: float
+    # The byte offset of the packet in the file, -1 if unknown
+    offset: int
+
+
+class KeyframeIndex:
+    """
+    The sorted keyframe timestamps and byte offsets of a video stream.
+
+    Stored in arrays rather than lists of tuples: a 2 hour film with a keyframe every 2 seconds is about 58KB.
+    """
+
+    def __init__(self, times: array = None, offsets: array = None):
+        self.times = times if times is not None else array("d")
+        self.offsets = offsets if offsets is not None else array("q")
+        if len(self.times) != len(self.offsets):
+            raise Exception(
+                "Mismatched keyframe times ({}) and offsets ({})".format(
+                    len(self.times), len(self.offsets)
+                )
+            )
+
+    def __len__(self):
+        return len(self.times)
+
+    def __getitem__(self, index) -> Keyframe:
+        return Keyframe(self.times[index], self.offsets[index])
+
+    def __iter__(self) -> Iterator[Keyframe]:
+        return (Keyframe(t, o) for t, o in zip(self.times, self.offsets))
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, KeyframeIndex)
+            and self.times == other.times
+            and self.offsets == other.offsets
+        )
+
+    def __repr__(self):
+        return "<KeyframeIndex: keyframes={}>".format(len(self))
+
+    def before(self, time: float) -> Optional[Keyframe]:
+        """
+        The last keyframe at or before the time
+        """
+        i = bisect_right(self.times, time)
+        return self[i - 1] if i > 0 else None
+
+    def after(self, time: float) -> Optional[Keyframe]:
+        """
+        The first keyframe at or after the time
+        """
+        i = bisect_left(self.times, time)
+        return self[i] if i < len(self) else None
+
+    def nearest(self, time: float) -> Optional[Keyframe]:
+        candidates = [k for k in (self.before(time), self.after(time)) if k]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda k: abs(k.time - time))
+
+    def seek_position(self, time: float) -> Tuple[Optional[float], float]:
+        """
+        Where to input seek (-ss before -i) to stream copy from the last keyframe at or before the time
+        :param time:
+        :return: the position to seek to (None if the file should be read from the start) and the time of the
+            keyframe the output will actually start at
+        """
+        i = bisect_right(self.times, time) - 1
+        if i <= 0:
+            return None, 0.0
+        margin = SEEK_MARGIN
+        if i + 1 < len(self):
+            margin = min(margin, (self.times[i + 1] - self.times[i]) / 2)
+        return self.times[i] + margin, self.times[i]
+
+    def to_bytes(self) -> bytes:
+        return array("q", [len(self)]).tobytes() + (
+            self.times.tobytes() + self.offsets.tobytes()
+        )
+
+    @staticmethod
+    def from_bytes(blob: bytes) -> "KeyframeIndex":
+        count = array("q")
+        count.frombytes(blob[: count.itemsize])
+        count = count[0]
+        times, offsets = array("d"), array("q")
+        start = offsets.itemsize
+        times.frombytes(blob[start : start + count * times.itemsize])
+        start += count * times.itemsize
+        offsets.frombytes(blob[start : start + count * offsets.itemsize])
+        return KeyframeIndex(times, offsets)
+
+
+def _parse_packet(line: str) -> Optional[Tuple[float, int]]:
+    """
+    Parses a "pts_time,dts_time,pos,flags" line, returning the (time, offset) if it is a keyframe
+    """
+    parts = line.strip().split(",")
+    if len(parts) < 4 or not parts[3].startswith("K"):
+        return None
+    pts_time, dts_time, pos = parts[0], parts[1], parts[2]
+    time = pts_time if pts_time not in ("", "N/A") else dts_time
+    if time in ("", "N/A"):
+        return None
+    return float(time), int(pos) if pos not in ("", "N/A") else -1
+
+
+def scan_keyframes(input_file: str, stream: str = "v:0") -> KeyframeIndex:
+    """
+    Scans the packets of a video stream for keyframes without decoding.
+
+    ffprobe's output is parsed as it streams so the full packet list (millions of lines for a long file) is never
+    held in memory.
+    :param input_file:
+    :param stream: the ffprobe stream specifier
+    :return:
+    """
+    args = [ffprobe(), "-v", "error", "-select_streams", stream]
+    args.extend(["-show_entries", "packet=pts_time,dts_time,pos,flags"])
+    args.extend(["-of", "csv=p=0", input_file])
+    times, offsets = array("d"), array("q")
+    with subprocess.Popen(
+        args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
+    ) as p:
+        for line in p.stdout:
+            keyframe = _parse_packet(line)
+            if keyframe:
+                times.append(keyframe[0])
+                offsets.append(keyframe[1])
+        stderr = p.stderr.read()
+        ret = p.wait()
+    if ret != 0:
+        raise Exception("ffprobe error, return code={}, stderr={}".format(ret, stderr))
+    # Packets are in decode order which may not be presentation order
+    if any(times[i] > times[i + 1] for i in range(len(times) - 1)):
+        keyframes = sorted(zip(times, offsets))
+        times = array("d", (t for t, o in keyframes))
+        offsets = array("q", (o for t, o in keyframes))
+    return KeyframeIndex(times, offsets)
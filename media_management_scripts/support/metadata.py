@@ -8,7 +8,15 @@ import re
 import operator
 from typing import List, Optional, Tuple
 from media_management_scripts.support.encoding import BitDepth, resolution_name
-from media_management_scripts.support.interlace import find_interlace, InterlaceReport
+from media_management_scripts.support.interlace import (
+    find_interlace,
+    find_interlace_map,
+    InterlaceMap,
+    InterlaceReport,
+)
+from media_management_scripts.support.crop import CropRect, find_crop
+from media_management_scripts.support.keyframes import KeyframeIndex, scan_keyframes
+from media_management_scripts.support.scenes import SceneIndex, cache_key, detect_scenes
 from media_management_scripts.support.formatting import (
     sizeof_fmt,
     duration_to_str,
@@ -52,6 +60,10 @@ class Metadata:
         self._ffprobe_output = ffprobe_output
         self.mime_type = get_mime(file)
         self.interlace_report = interlace_report
+        self.interlace_map: Optional[InterlaceMap] = None
+        self.crop: Optional[CropRect] = None
+        self.keyframes: Optional[KeyframeIndex] = None
+        self.scenes: Optional[SceneIndex] = None
         if "streams" not in ffprobe_output:
             raise Exception(
                 "Invalid ffprobe output ({}): {}".format(file, ffprobe_output)
@@ -154,6 +166,10 @@ class Metadata:
             "interlace": self.interlace_report.to_dict()
             if self.interlace_report
             else None,
+            "interlace_map": self.interlace_map.to_dict()
+            if self.interlace_map
+            else None,
+            "crop": self.crop.to_dict() if self.crop else None,
         }
 
     def __repr__(self):
@@ -183,6 +199,19 @@ class Chapter:
         )
 
 
+def _parse_frame_rate(value: Optional[str]) -> Optional[float]:
+    """
+    Parses ffprobe's frame rates, for example 30000/1001
+    """
+    if not value:
+        return None
+    try:
+        num, _, den = value.partition("/")
+        return float(num) / float(den) if den else float(num)
+    except (ValueError, ZeroDivisionError):
+        return None
+
+
 class Stream:
     def __init__(self, stream):
         self.index = stream["index"]
@@ -192,11 +221,13 @@ class Stream:
         self.width = int(stream["width"]) if "width" in stream else None
         self.height = int(stream["height"]) if "height" in stream else None
         self.tags = copy.copy(stream.get("tags", {}))
+        self.disposition = copy.copy(stream.get("disposition", {}))
         self.title = self.tags.get("title", None)
         if not self.title:
             self.title = self.tags.get("Title", None)
         self.language = self.tags.get("language", self.tags.get("LANGUAGE", "unknown"))
         self.duration = float(stream["duration"]) if "duration" in stream else None
+        self.bit_rate = float(stream["bit_rate"]) if "bit_rate" in stream else None
         self._data = stream
         if self.is_audio():
             self.channels = int(stream["channels"]) if "channels" in stream else None
@@ -210,7 +241,12 @@ class Stream:
                     parts = [float(s) for s in self.tags[tag].split(":")]
                     self.duration = parts[0] * 60 * 60 + parts[1] * 60 + parts[2]
         if self.is_video():
+            self.frame_rate = _parse_frame_rate(
+                stream.get("avg_frame_rate", None)
+            ) or _parse_frame_rate(stream.get("r_frame_rate", None))
             self.level = stream.get("level", None)
+            self.profile = stream.get("profile", None)
+            self.pix_fmt = stream.get("pix_fmt", None)
             self.bit_depth = None
             if self.codec in ("h264", "hevc"):
                 pix_fmt = stream.get("pix_fmt", None)
@@ -306,7 +342,21 @@ class MetadataExtractor:
             )
         return json.loads(stdout.decode("UTF-8"))
 
-    def extract(self, file: str, detect_interlace=False) -> Metadata:
+    def extract(
+        self,
+        file: str,
+        detect_interlace=False,
+        detect_interlace_map=False,
+        detect_crop=False,
+        cache=None,
+    ) -> Metadata:
+        """
+        :param detect_interlace: run interlace detection on the whole file
+        :param detect_interlace_map: build an interlace map of each segment of the file. If detect_interlace is also
+            set, the whole file report is derived from the map
+        :param detect_crop: detect black bars to crop
+        :param cache: an AnalysisCache to store the crop in
+        """
         if self.db is not None and file in self.db:
             output = self.db[file]
         else:
@@ -317,11 +367,18 @@ class MetadataExtractor:
                 self.db[file] = output
 
         metadata = Metadata(file, output)
+        if detect_interlace_map and movie_files_filter(file):
+            self.add_interlace_map(metadata)
         if detect_interlace and movie_files_filter(file):
-            interlace_report = find_interlace(file, metadata=metadata)
+            if metadata.interlace_map:
+                interlace_report = metadata.interlace_map.report
+            else:
+                interlace_report = find_interlace(file, metadata=metadata)
         else:
             interlace_report = None
         metadata.interlace_report = interlace_report
+        if detect_crop and movie_files_filter(file):
+            self.add_crop(metadata, cache)
 
         return metadata
 
@@ -329,3 +386,55 @@ class MetadataExtractor:
         if metadata.interlace_report is None:
             metadata.interlace_report = find_interlace(metadata.file, metadata=metadata)
         return metadata
+
+    def add_interlace_map(self, metadata: Metadata):
+        """
+        Adds the interlace map, which is stored alongside the ffprobe output if there is a database
+        """
+        if metadata.interlace_map is None:
+            key = "interlace_map:{}".format(metadata.file)
+            if self.db is not None and key in self.db:
+                metadata.interlace_map = self.db[key]
+            else:
+                metadata.interlace_map = find_interlace_map(metadata.file, metadata)
+                if self.db is not None:
+                    self.db[key] = metadata.interlace_map
+        return metadata
+
+    def add_crop(self, metadata: Metadata, cache=None):
+        """
+        Adds the crop that removes any black bars
+        :param cache: an AnalysisCache to store the crop in, keyed by the file's fingerprint
+        """
+        if metadata.crop is None and metadata.video_streams:
+            metadata.crop = find_crop(metadata.file, metadata, cache=cache)
+        return metadata
+
+    def add_keyframes(self, metadata: Metadata):
+        """
+        Adds the keyframe index of the first video stream, which is stored alongside the ffprobe output as a compact
+        blob if there is a database
+        """
+        if metadata.keyframes is None and metadata.video_streams:
+            key = "keyframes:{}".format(metadata.file)
+            if self.db is not None and key in self.db:
+                metadata.keyframes = KeyframeIndex.from_bytes(self.db[key])
+            else:
+                metadata.keyframes = scan_keyframes(metadata.file)
+                if self.db is not None:
+                    self.db[key] = metadata.keyframes.to_bytes()
+        return metadata
+
+    def add_scenes(self, metadata: Metadata, cache=None, detect=True):
+        """
+        Adds the scene cuts of the first video stream
+        :param cache: an AnalysisCache to store the scenes in, keyed by the file's fingerprint
+        :param detect: detect the scenes if they are not cached, otherwise only use an index made earlier by the
+            scenes command
+        """
+        if metadata.scenes is None and metadata.video_streams:
+            if detect:
+                metadata.scenes = detect_scenes(metadata.file, metadata, cache=cache)
+            elif cache is not None:
+                metadata.scenes = cache.get(metadata.file, cache_key())
+        return metadata
@@ -0,0 +1,199 @@
+import logging
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
+from media_management_scripts.support.executables import execute_with_output, ffmpeg
+from media_management_scripts.support.frames import SHOWINFO_PTS_PATTERN
+
+logger = logging.getLogger(__name__)
+
+# ffmpeg's scene change score (0-1) above which a frame starts a new scene
+SCENE_THRESHOLD = 0.3
+# Width the video is scaled to before scoring frames
+ANALYSIS_WIDTH = 320
+# Seconds between generated chapters, each is moved to the nearest scene cut within half of this
+CHAPTER_INTERVAL = 300
+# Seconds to keep representative frames away from a cut, so they are not mid-transition
+CUT_MARGIN = 1.0
+
+
+class SceneIndex:
+    """
+    The sorted times of the scene cuts in a video. A cut is the first frame of a new scene.
+    """
+
+    def __init__(self, cuts: Iterable[float], duration: float):
+        self.cuts = array("d", sorted(cuts))
+        self.duration = duration
+
+    def __len__(self):
+        return len(self.cuts)
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, SceneIndex)
+            and self.cuts == other.cuts
+            and self.duration == other.duration
+        )
+
+    def __repr__(self):
+        return "<SceneIndex: cuts={}, duration={}>".format(len(self), self.duration)
+
+    def nearest(self, time: float, max_distance: float = None) -> Optional[float]:
+        """
+        The cut closest to the time
+        :param max_distance: only consider cuts at most this far from the time
+        """
+        i = bisect_left(self.cuts, time)
+        candidates = [self.cuts[j] for j in (i - 1, i) if 0 <= j < len(self)]
+        if max_distance is not None:
+            candidates = [c for c in candidates if abs(c - time) <= max_distance]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda c: abs(c - time))
+
+    def scene_at(self, time: float) -> Tuple[float, float]:
+        """
+        The (start, end) of the scene containing the time
+        """
+        i = bisect_right(self.cuts, time)
+        start = self.cuts[i - 1] if i > 0 else 0.0
+        end = self.cuts[i] if i < len(self) else self.duration
+        return start, end
+
+    def representative_time(self, time: float, max_shift: float) -> float:
+        """
+        A time near the given one which is a good frame of its scene: the middle of the scene if it is close enough,
+        otherwise the time moved at least CUT_MARGIN away from the scene's cuts
+        """
+        start, end = self.scene_at(time)
+        middle = (start + end) / 2
+        if abs(middle - time) <= max_shift:
+            return middle
+        if end - start <= 2 * CUT_MARGIN:
+            return time
+        return min(max(time, start + CUT_MARGIN), end - CUT_MARGIN)
+
+    def align(self, start: float, length: float, end: float = None) -> float:
+        """
+        Moves a sample of the given length to begin on the nearest cut within its length, so it covers whole shots
+        rather than straddling a transition
+        :param end: the sample must finish before this, defaults to the duration
+        :return: the new start, or the original if there is no suitable cut
+        """
+        end = self.duration if end is None else end
+        cut = self.nearest(start, max_distance=length)
+        if cut is None or cut + length > end:
+            return start
+        return cut
+
+    def chapters(
+        self,
+        interval: float = CHAPTER_INTERVAL,
+        offset: float = 0,
+        end: float = None,
+    ) -> List[Tuple[float, float, str]]:
+        """
+        Chapters about every interval seconds, each starting on the nearest scene cut
+        :param offset: the start time of the output in the input, chapters are shifted and clipped to it
+        :param end: the end time of the output in the input, defaults to the duration
+        :return: (start, end, title) of each chapter
+        """
+        end = self.duration if end is None else end
+        starts = [offset]
+        target = offset + interval
+        while target < end - interval / 2:
+            start = self.nearest(target, max_distance=interval / 2) or target
+            if start > starts[-1] and start < end:
+                starts.append(start)
+            target = start + interval
+        bounds = starts + [end]
+        return [
+            (s - offset, e - offset, "Chapter {}".format(i + 1))
+            for i, (s, e) in enumerate(zip(bounds, bounds[1:]))
+        ]
+
+
+def cache_key(threshold: float = SCENE_THRESHOLD, width: int = ANALYSIS_WIDTH):
+    return "scenes:{}:{}".format(threshold, width)
+
+
+def detect_scenes(
+    input_file,
+    metadata=None,
+    threshold: float = SCENE_THRESHOLD,
+    width: int = ANALYSIS_WIDTH,
+    cache=None,
+) -> SceneIndex:
+    """
+    Finds the scene cuts with ffmpeg's scene change score on a downscaled copy of the video.
+
+    Only the frames which start a scene pass the select filter, so showinfo prints one line per cut.
+    :param input_file:
+    :param metadata: the Metadata of the input, for its duration
+    :param threshold: the scene change score, from 0 to 1, above which a frame is a cut
+    :param width: the width the video is scaled to
+    :param cache: an AnalysisCache to store the index in, keyed by the file's fingerprint
+    :return:
+    """
+    key = cache_key(threshold, width)
+    if cache is not None and cache.contains(input_file, key):
+        return cache.get(input_file, key)
+
+    if metadata is None:
+        from media_management_scripts.utils import extract_metadata
+
+        metadata = extract_metadata(input_file)
+    filters = [
+        "scale={}:-2".format(width),
+        "select='gt(scene,{})'".format(threshold),
+        "showinfo",
+    ]
+    args = [ffmpeg(), "-hide_banner", "-nostats", "-i", input_file]
+    args.extend(["-map", "0:v:0", "-vf", ",".join(filters), "-vsync", "0"])
+    args.extend(["-f", "null", "-"])
+    ret, output = execute_with_output(args)
+    if ret != 0:
+        raise Exception("Error detecting scenes in {}: {}".format(input_file, output))
+    cuts = [float(m.group(1)) for m in SHOWINFO_PTS_PATTERN.finditer(output)]
+    index = SceneIndex(cuts, metadata.estimated_duration)
+    logger.debug("Scenes of {}: {}".format(input_file, index))
+    if cache is not None:
+        cache.put(input_file, key, index)
+    return index
+
+
+def index_scenes(
+    files: List[str],
+    cache,
+    threshold: float = SCENE_THRESHOLD,
+    width: int = ANALYSIS_WIDTH,
+    max_workers: int = 1,
+    print_output=True,
+) -> int:
+    """
+    Detects the scenes of the files which are not already in the cache. ffmpeg runs under nice and by default one
+    file at a time, so this can run in the background of other work.
+    :param cache: the AnalysisCache the indexes are stored in
+    :return: the number of files indexed
+    """
+    key = cache_key(threshold, width)
+
+    def run(file):
+        if cache.contains(file, key):
+            return False
+        try:
+            index = detect_scenes(file, threshold=threshold, width=width, cache=cache)
+        except Exception as e:
+            logger.exception("Error detecting scenes in {}".format(file))
+            if print_output:
+                print("Failed: {}: {}".format(file, e))
+            return False
+        if print_output:
+            print("{} scenes: {}".format(len(index) + 1, file))
+        return True
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return sum(executor.map(run, files))
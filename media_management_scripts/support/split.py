@@ -1,30 +1,125 @@
+import logging
 import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from media_management_scripts.support.executables import (
+    ERROR_OUTPUT_LINES,
+    execute_with_output,
+    ffmpeg,
+)
+from media_management_scripts.support.files import check_exists
 from media_management_scripts.utils import create_metadata_extractor
-from media_management_scripts.convert import cut
 
+logger = logging.getLogger(__name__)
+
+OUTPUT_PATTERN = "title{0:02d}.mkv"
+SEGMENT_PATTERN = "title%02d.mkv"
+# Inputs split by chapter at once by default. Splitting only copies streams, so it is limited by reading the inputs
+SPLIT_WORKERS = 2
 
-def split_by_chapter(input, output_dir, chapters=4, initial_count=0):
-    extractor = create_metadata_extractor()
-    metadata = extractor.extract(input)
 
+def chapter_split_times(metadata, chapters: int) -> List[float]:
+    """
+    The times to split at so each output has the given number of chapters
+    """
     num_chapters = len(metadata.chapters)
     if num_chapters % chapters != 0:
         raise Exception(
             "Cannot evenly split {} by {} - {} chapters".format(
-                input, chapters, num_chapters
+                metadata.file, chapters, num_chapters
             )
         )
-    count = initial_count
-    for i in range(0, num_chapters, chapters):
-        if i != 0:
-            start = metadata.chapters[i].start_time
-        else:
-            start = None
-        if i + chapters < num_chapters:
-            end = metadata.chapters[i + chapters - 1].end_time
-        else:
-            end = None
-        output_file = os.path.join(output_dir, "title{0:02d}.mkv".format(count))
-        count += 1
-        cut(input, output_file, start, end)
-    return num_chapters // chapters
+    return [
+        metadata.chapters[i].start_time for i in range(chapters, num_chapters, chapters)
+    ]
+
+
+def split_by_chapter(
+    input, output_dir, chapters=4, initial_count=0, metadata=None, print_output=True
+):
+    """
+    Splits the input into files of the given number of chapters in a single pass using ffmpeg's segment muxer
+    :param input:
+    :param output_dir:
+    :param chapters: the number of chapters per output
+    :param initial_count: the number of the first output file
+    :param metadata: the Metadata of the input
+    :return: the number of output files, which were already written if all of them exist
+    """
+    if metadata is None:
+        metadata = create_metadata_extractor().extract(input)
+    times = chapter_split_times(metadata, chapters)
+    count = len(metadata.chapters) // chapters
+    if not count:
+        return 0
+    outputs = [
+        os.path.join(output_dir, OUTPUT_PATTERN.format(i))
+        for i in range(initial_count, initial_count + count)
+    ]
+    existing = [o for o in outputs if check_exists(o, log=False)]
+    if len(existing) == len(outputs):
+        logger.info("Already split {}".format(input))
+        return count
+    elif existing:
+        # Splitting again would overwrite the existing files, so a partial earlier split must be cleaned up first
+        raise Exception(
+            "Some outputs of {} already exist: {}".format(input, ", ".join(existing))
+        )
+    os.makedirs(output_dir, exist_ok=True)
+
+    args = [ffmpeg(), "-i", input, "-map", "0", "-c", "copy"]
+    if times:
+        args.extend(["-f", "segment", "-segment_format", "matroska"])
+        args.extend(["-segment_times", ",".join("{:.6f}".format(t) for t in times)])
+        args.extend(["-segment_start_number", str(initial_count)])
+        args.extend(["-reset_timestamps", "1"])
+        args.append(os.path.join(output_dir, SEGMENT_PATTERN))
+    else:
+        args.append(outputs[0])
+    ret, output = execute_with_output(args, print_output, max_lines=ERROR_OUTPUT_LINES)
+    if ret != 0:
+        raise Exception("Error splitting {}: {}".format(input, output))
+    return count
+
+
+def split_all_by_chapter(
+    inputs: List[str],
+    output_dir,
+    chapters=4,
+    initial_count=0,
+    max_workers: Optional[int] = None,
+    print_output=True,
+):
+    """
+    Splits each input by chapter concurrently. Outputs are numbered consecutively in the order of the inputs.
+    :param max_workers: the maximum number of inputs to split at once, defaults to SPLIT_WORKERS
+    :param print_output: print ffmpeg's output when splitting one input at a time, otherwise each input once it is done
+    :return: the total number of output files
+    """
+    if not inputs:
+        return 0
+    extractor = create_metadata_extractor()
+    metadata = [extractor.extract(i) for i in inputs]
+    # Number the outputs up front so the splits can run in any order
+    for m in metadata:
+        chapter_split_times(m, chapters)
+    counts = [len(m.chapters) // chapters for m in metadata]
+    starts = [initial_count + sum(counts[:i]) for i in range(len(counts))]
+    workers = min(max_workers or SPLIT_WORKERS, len(inputs))
+    # The output of concurrent ffmpeg processes would be interleaved
+    ffmpeg_output = print_output and workers == 1
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                split_by_chapter, i, output_dir, chapters, s, m, ffmpeg_output
+            )
+            for i, s, m in zip(inputs, starts, metadata)
+        ]
+        total = 0
+        for i, f in zip(inputs, futures):
+            count = f.result()
+            if print_output and not ffmpeg_output:
+                print("Split {} into {} files".format(i, count))
+            total += count
+        return total
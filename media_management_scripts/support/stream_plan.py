@@ -0,0 +1,253 @@
+import os
+import re
+from enum import Enum
+from typing import List, NamedTuple, Optional
+
+from media_management_scripts.support.encoding import (
+    AudioCodec,
+    SubtitleCodec,
+    VideoFileContainer,
+)
+from media_management_scripts.support.metadata import Metadata, Stream
+
+COMMENTARY_PATTERN = re.compile(r"commentary", re.IGNORECASE)
+
+TEXT_SUBTITLE_CODECS = {"subrip", "srt", "ass", "ssa", "webvtt", "mov_text", "text"}
+BITMAP_SUBTITLE_CODECS = {"hdmv_pgs_subtitle", "dvd_subtitle", "dvb_subtitle"}
+
+# The subtitle codecs each container can hold and which codec text subtitles are converted to otherwise
+CONTAINER_SUBTITLES = {
+    VideoFileContainer.MP4: ({"mov_text"}, "mov_text"),
+    VideoFileContainer.MKV: (
+        (TEXT_SUBTITLE_CODECS | BITMAP_SUBTITLE_CODECS) - {"mov_text", "text"},
+        "srt",
+    ),
+}
+
+
+class StreamAction(Enum):
+    COPY = "copy"
+    TRANSCODE = "transcode"
+    DROP = "drop"
+
+
+class PlannedStream(NamedTuple):
+    stream: Stream
+    action: StreamAction
+    codec: Optional[str] = None
+    channels: Optional[int] = None
+    reason: Optional[str] = None
+
+    def __repr__(self):
+        return "<PlannedStream: index={}, type={}, codec={}, action={}, target={}, reason={}>".format(
+            self.stream.index,
+            self.stream.type,
+            self.stream.codec,
+            self.action.value,
+            self.codec,
+            self.reason,
+        )
+
+
+def container_from_file(file: str) -> Optional[VideoFileContainer]:
+    ext = os.path.splitext(file)[1][1::].lower()
+    if ext in ("mp4", "m4v", "mov"):
+        return VideoFileContainer.MP4
+    for c in VideoFileContainer:
+        if c.extension == ext:
+            return c
+    return None
+
+
+def is_commentary(stream: Stream) -> bool:
+    if stream.disposition.get("comment", 0) == 1:
+        return True
+    return stream.title is not None and bool(COMMENTARY_PATTERN.search(stream.title))
+
+
+def _plan_audio(
+    streams: List[Stream],
+    audio_codec: str,
+    drop_duplicate_commentary: bool,
+    copy_matching: bool,
+) -> List[PlannedStream]:
+    plan = []
+    seen_commentary = set()
+    # Prefer keeping the commentary track with the most channels
+    ordered = sorted(streams, key=lambda s: -(s.channels or 0))
+    dropped = set()
+    if drop_duplicate_commentary:
+        for s in ordered:
+            if is_commentary(s):
+                key = (s.language, (s.title or "").strip().lower())
+                if key in seen_commentary:
+                    dropped.add(s.index)
+                else:
+                    seen_commentary.add(key)
+    for s in streams:
+        if s.index in dropped:
+            plan.append(
+                PlannedStream(s, StreamAction.DROP, reason="duplicate commentary")
+            )
+        elif AudioCodec.COPY.equals(audio_codec):
+            plan.append(PlannedStream(s, StreamAction.COPY, "copy"))
+        elif copy_matching and s.codec == audio_codec:
+            plan.append(
+                PlannedStream(s, StreamAction.COPY, "copy", reason="already matches")
+            )
+        elif s.channels == 7:
+            # 6.1 sound, so mix it up to 7.1
+            plan.append(PlannedStream(s, StreamAction.TRANSCODE, audio_codec, 8))
+        else:
+            plan.append(PlannedStream(s, StreamAction.TRANSCODE, audio_codec))
+    return plan
+
+
+def _plan_subtitles(
+    streams: List[Stream], subtitle_codec: str, container: Optional[VideoFileContainer]
+) -> List[PlannedStream]:
+    supported, text_target = CONTAINER_SUBTITLES.get(container, (None, None))
+    plan = []
+    for s in streams:
+        is_text = s.codec in TEXT_SUBTITLE_CODECS
+        if SubtitleCodec.COPY.ffmpeg_codec_name == subtitle_codec:
+            if supported is None or s.codec in supported:
+                plan.append(PlannedStream(s, StreamAction.COPY, "copy"))
+            elif is_text:
+                plan.append(
+                    PlannedStream(
+                        s,
+                        StreamAction.TRANSCODE,
+                        text_target,
+                        reason="not supported by container",
+                    )
+                )
+            else:
+                plan.append(
+                    PlannedStream(
+                        s, StreamAction.DROP, reason="not supported by container"
+                    )
+                )
+        elif is_text:
+            if s.codec == subtitle_codec:
+                plan.append(PlannedStream(s, StreamAction.COPY, "copy"))
+            else:
+                plan.append(PlannedStream(s, StreamAction.TRANSCODE, subtitle_codec))
+        else:
+            plan.append(
+                PlannedStream(s, StreamAction.DROP, reason="cannot convert to text")
+            )
+    return plan
+
+
+class StreamPlan:
+    """
+    Decides, per stream, whether it is copied, transcoded or dropped
+    """
+
+    def __init__(
+        self,
+        video: List[Stream],
+        audio: List[PlannedStream],
+        subtitles: List[PlannedStream],
+    ):
+        self.video = video
+        self.audio = audio
+        self.subtitles = subtitles
+
+    def to_args(self, include_video: bool = True) -> List[str]:
+        """
+        :param include_video: whether to map the video streams, False if they come from a filtergraph instead
+        """
+        args = []
+        if include_video:
+            for s in self.video:
+                args.extend(["-map", "0:{}".format(s.index)])
+        for type_char, planned in (("a", self.audio), ("s", self.subtitles)):
+            out_index = 0
+            for p in planned:
+                if p.action == StreamAction.DROP:
+                    continue
+                args.extend(["-map", "0:{}".format(p.stream.index)])
+                args.extend(["-c:{}:{}".format(type_char, out_index), p.codec])
+                if p.channels:
+                    args.extend(
+                        ["-ac:{}:{}".format(type_char, out_index), str(p.channels)]
+                    )
+                out_index += 1
+        return args
+
+    def __iter__(self):
+        yield from self.audio
+        yield from self.subtitles
+
+    def __repr__(self):
+        return "<StreamPlan: video={}, audio={}, subtitles={}>".format(
+            [s.index for s in self.video], self.audio, self.subtitles
+        )
+
+
+def _select_streams(metadata: Metadata, mappings) -> List[Stream]:
+    """
+    Resolves ffmpeg style mappings of the first input (eg 2, '0:2', 'a:1', '0:v') to streams
+    """
+    streams = []
+    by_type = {
+        "v": metadata.video_streams,
+        "a": metadata.audio_streams,
+        "s": metadata.subtitle_streams,
+    }
+    for m in mappings:
+        m = str(m)
+        if m.startswith("0:"):
+            m = m[2::]
+        parts = m.split(":")
+        if m.isdigit():
+            streams.extend(s for s in metadata.streams if s.index == int(m))
+        elif parts[0] in by_type and len(parts) == 1:
+            streams.extend(by_type[parts[0]])
+        elif parts[0] in by_type and len(parts) == 2 and parts[1].isdigit():
+            typed = by_type[parts[0]]
+            if int(parts[1]) < len(typed):
+                streams.append(typed[int(parts[1])])
+        else:
+            raise Exception("Unsupported mapping: {}".format(m))
+    return streams
+
+
+def create_stream_plan(
+    metadata: Metadata,
+    audio_codec: str,
+    subtitle_codec: Optional[str],
+    output: Optional[str] = None,
+    mappings=None,
+    drop_duplicate_commentary: bool = True,
+    copy_matching: bool = True,
+) -> StreamPlan:
+    """
+    Creates a stream plan
+    :param metadata: the metadata of the input
+    :param audio_codec: the target audio codec
+    :param subtitle_codec: the target subtitle codec or None to exclude subtitles
+    :param output: the output file, used to determine which subtitles the container supports
+    :param mappings: optionally limit to these streams (for example [2, '0:3', 'a:1'])
+    :param drop_duplicate_commentary: drop commentary tracks with the same language and title as another
+    :param copy_matching: copy audio streams already in the target codec instead of transcoding them
+    :return:
+    """
+    streams = _select_streams(metadata, mappings) if mappings else metadata.streams
+    video = [s for s in streams if s.is_video()]
+    audio = _plan_audio(
+        [s for s in streams if s.is_audio()],
+        audio_codec,
+        drop_duplicate_commentary,
+        copy_matching,
+    )
+    if subtitle_codec and subtitle_codec != SubtitleCodec.NONE.ffmpeg_codec_name:
+        container = container_from_file(output) if output else None
+        subtitles = _plan_subtitles(
+            [s for s in streams if s.is_subtitle()], subtitle_codec, container
+        )
+    else:
+        subtitles = []
+    return StreamPlan(video, audio, subtitles)
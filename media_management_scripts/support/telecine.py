@@ -0,0 +1,75 @@
+from enum import Enum
+
+from media_management_scripts.support.interlace import InterlaceReport, find_interlace
+
+# 3:2 pulldown repeats a field in 2 of every 5 frames (40%). idet misses some of the repeats, especially after
+# lossy encoding, so accept a wide band around it. Truly interlaced video either never repeats fields or, when
+# field doubled, repeats nearly every one.
+TELECINE_MIN_REPEATED = 0.1
+TELECINE_MAX_REPEATED = 0.6
+
+# Pulldown alternates repeating the top and bottom fields, so neither should be much rarer than the other
+TELECINE_MIN_FIELD_BALANCE = 0.25
+
+# Frames fieldmatch could not match are deinterlaced, then decimate drops the 1 duplicate in 5 frames
+INVERSE_TELECINE_FILTER = "fieldmatch,yadif=deint=interlaced,decimate"
+
+
+class ScanType(Enum):
+    PROGRESSIVE = "progressive"
+    INTERLACED = "interlaced"
+    TELECINED = "telecined"
+
+
+def is_telecined(
+    report: InterlaceReport,
+    min_repeated: float = TELECINE_MIN_REPEATED,
+    max_repeated: float = TELECINE_MAX_REPEATED,
+) -> bool:
+    """
+    Whether the repeated field statistics of the report match a 3:2 pulldown cadence
+    """
+    repeated = report.repeated
+    if not repeated or not repeated.repeated:
+        return False
+    if not min_repeated <= repeated.ratio <= max_repeated:
+        return False
+    balance = min(repeated.top, repeated.bottom) / max(repeated.top, repeated.bottom)
+    return balance >= TELECINE_MIN_FIELD_BALANCE
+
+
+def classify(
+    report: InterlaceReport,
+    interlace_threshold: float = 0.5,
+    min_repeated: float = TELECINE_MIN_REPEATED,
+    max_repeated: float = TELECINE_MAX_REPEATED,
+) -> ScanType:
+    """
+    Classifies a source from its interlace report. Reports without repeated field counts are never telecined.
+    :param report: the InterlaceReport of the source
+    :param interlace_threshold: the ratio of interlaced frames to consider it interlaced
+    :param min_repeated: the minimum ratio of frames with a repeated field to consider it telecined
+    :param max_repeated: the maximum ratio of frames with a repeated field to consider it telecined
+    :return:
+    """
+    if is_telecined(report, min_repeated, max_repeated):
+        return ScanType.TELECINED
+    elif report.is_interlaced(interlace_threshold):
+        return ScanType.INTERLACED
+    else:
+        return ScanType.PROGRESSIVE
+
+
+def detect_scan_type(
+    input_file: str, metadata=None, interlace_threshold: float = 0.5, **kwargs
+) -> ScanType:
+    """
+    Samples the file with idet and classifies it as progressive, interlaced or telecined
+    :param input_file:
+    :param metadata: the Metadata of the file, used to pick the sample windows
+    :param interlace_threshold: the ratio of interlaced frames to consider it interlaced
+    :param kwargs: passed to find_interlace
+    :return:
+    """
+    report = find_interlace(input_file, metadata=metadata, **kwargs)
+    return classify(report, interlace_threshold)
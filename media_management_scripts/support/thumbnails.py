@@ -0,0 +1,193 @@
+import math
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from tempfile import TemporaryDirectory
+from typing import List, NamedTuple, Optional
+
+from media_management_scripts.support.executables import execute_with_output, ffmpeg
+from media_management_scripts.support.keyframes import KeyframeIndex
+from media_management_scripts.utils import extract_metadata
+
+# Average luma (on an 8-bit scale) below which a frame is considered black
+BLACK_THRESHOLD = 32
+# The number of keyframes from each target to choose between when selecting a frame
+CANDIDATES = 5
+
+
+class ThumbnailSelection(Enum):
+    # The keyframe at the target
+    KEYFRAME = "keyframe"
+    # The least blurry of the candidate keyframes that is not black
+    SHARPEST = "sharpest"
+    # The brightest of the candidate keyframes
+    LEAST_BLACK = "least-black"
+
+
+class FrameScore(NamedTuple):
+    # From ffmpeg's blurdetect filter, lower is sharper
+    blur: float
+    # Average luma
+    brightness: float
+
+    def is_black(self):
+        return self.brightness < BLACK_THRESHOLD
+
+
+def thumbnail_times(start: float, end: float, count: int) -> List[float]:
+    """
+    Evenly spaced target times, each in the middle of its share of the duration so the first and last thumbnails
+    are not the opening or closing frame
+    """
+    step = (end - start) / count
+    return [start + step * (i + 0.5) for i in range(count)]
+
+
+def thumbnail_outputs(output: str, count: int) -> List[str]:
+    """
+    Numbers the output file name, eg thumb.png => thumb01.png, thumb02.png, ...
+    """
+    basename, ext = os.path.splitext(output)
+    digits = math.floor(math.log10(count)) + 1
+    return ["{}{:0{}d}{}".format(basename, i, digits, ext) for i in range(1, count + 1)]
+
+
+def _parse_scores(output: str) -> List[FrameScore]:
+    """
+    Parses the output of ffmpeg's metadata=print filter after blurdetect & signalstats
+    """
+    scores = []
+    blur = None
+    for line in output.splitlines():
+        if line.startswith("lavfi.blur="):
+            blur = float(line.split("=")[1])
+        elif line.startswith("lavfi.signalstats.YAVG="):
+            scores.append(FrameScore(blur, float(line.split("=")[1])))
+            blur = None
+    return scores
+
+
+def select_frame(scores: List[FrameScore], selection: ThumbnailSelection) -> int:
+    """
+    :return: the index of the best scoring frame
+    """
+    if not scores or selection == ThumbnailSelection.KEYFRAME:
+        return 0
+    indexes = range(len(scores))
+    if selection == ThumbnailSelection.LEAST_BLACK:
+        return max(indexes, key=lambda i: scores[i].brightness)
+    if selection == ThumbnailSelection.SHARPEST:
+        candidates = [i for i in indexes if not scores[i].is_black()] or indexes
+        return min(candidates, key=lambda i: scores[i].blur)
+    raise Exception("Unknown selection: {}".format(selection))
+
+
+def _seek_args(input_file, time: float, keyframes: Optional[KeyframeIndex]):
+    if keyframes:
+        keyframe = keyframes.nearest(time)
+        if keyframe:
+            seek, _ = keyframes.seek_position(keyframe.time)
+            time = seek or 0
+    # Only keyframes are decoded, and the output starts at the keyframe the seek lands on
+    return [
+        "-skip_frame",
+        "nokey",
+        "-ss",
+        str(time),
+        "-noaccurate_seek",
+        "-i",
+        input_file,
+        "-map",
+        "0:v:0",
+        "-vsync",
+        "0",
+    ]
+
+
+def extract_thumbnail(
+    input_file,
+    time: float,
+    output,
+    selection=ThumbnailSelection.KEYFRAME,
+    keyframes: KeyframeIndex = None,
+    candidates=CANDIDATES,
+):
+    """
+    Extracts a single keyframe near the time by input seeking, so only the keyframes used are decoded
+    :param input_file:
+    :param time: the target time
+    :param output: the image file
+    :param selection: how to choose between the keyframes from the target
+    :param keyframes: if provided, the keyframe nearest the time is used rather than the one before it
+    :param candidates: the number of keyframes from the target to choose between
+    """
+    args = [ffmpeg(), "-y"] + _seek_args(input_file, time, keyframes)
+    if selection == ThumbnailSelection.KEYFRAME:
+        args.extend(["-frames:v", "1", output])
+        ret, r = execute_with_output(args)
+        if ret != 0:
+            raise Exception("Error extracting thumbnail: {}".format(r))
+        return
+    ext = os.path.splitext(output)[1]
+    with TemporaryDirectory() as tmp:
+        stats_file = os.path.join(tmp, "stats.txt")
+        args.extend(["-frames:v", str(candidates)])
+        args.extend(
+            [
+                "-vf",
+                "blurdetect,signalstats,metadata=print:file={}".format(stats_file),
+                os.path.join(tmp, "%03d" + ext),
+            ]
+        )
+        ret, r = execute_with_output(args)
+        if ret != 0:
+            raise Exception("Error extracting thumbnail: {}".format(r))
+        with open(stats_file) as f:
+            scores = _parse_scores(f.read())
+        frame = select_frame(scores, selection)
+        shutil.move(os.path.join(tmp, "{:03d}{}".format(frame + 1, ext)), output)
+
+
+def create_thumbnails(
+    input_file,
+    output,
+    count=10,
+    start: float = None,
+    end: float = None,
+    selection=ThumbnailSelection.KEYFRAME,
+    metadata=None,
+    max_workers: Optional[int] = None,
+) -> List[str]:
+    """
+    Extracts thumbnails evenly spaced through the input, seeking to each one concurrently
+    :param input_file:
+    :param output: the image file name, numbered for each thumbnail
+    :param count: the number of thumbnails
+    :param start: the time to start from, defaults to the beginning
+    :param end: the time to end at, defaults to the end
+    :param selection: how to choose the frame near each target time
+    :param metadata: the Metadata of the input, if it has a keyframe index the nearest keyframes are used and if it
+        has scenes each target is moved to a representative frame of its scene
+    :param max_workers: the maximum number of thumbnails to extract at once
+    :return: the output files
+    """
+    if metadata is None:
+        metadata = extract_metadata(input_file)
+    if end is None:
+        end = metadata.estimated_duration
+    times = thumbnail_times(start or 0, end, count)
+    if metadata.scenes is not None:
+        # Stay within each thumbnail's share of the duration
+        max_shift = (end - (start or 0)) / count / 2
+        times = [metadata.scenes.representative_time(t, max_shift) for t in times]
+    outputs = thumbnail_outputs(output, count)
+    keyframes = metadata.keyframes
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [
+            executor.submit(extract_thumbnail, input_file, t, o, selection, keyframes)
+            for t, o in zip(times, outputs)
+        ]
+        for f in futures:
+            f.result()
+    return outputs
@@ -0,0 +1,179 @@
+import json
+import logging
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, NamedTuple, Optional
+
+from media_management_scripts.support.cache import file_fingerprint
+from media_management_scripts.support.executables import execute_with_output, ffmpeg
+from media_management_scripts.support.frames import scaled_height
+from media_management_scripts.utils import extract_metadata
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "index.json"
+SHEET_PATTERN = "sheet%03d.jpg"
+SHEET_NAME = "sheet{:03d}.jpg"
+
+SHOWINFO_FRAME_PATTERN = re.compile(r"Parsed_showinfo_\d+ @ \w+\] n:\s*\d+")
+
+
+class TrickplaySettings(NamedTuple):
+    # Seconds between thumbnails
+    interval: float = 10
+    # Width of each thumbnail
+    width: int = 320
+    # Thumbnails per row & column of a sprite sheet
+    columns: int = 10
+    rows: int = 10
+    # JPEG quality, 2 (best) to 31 (worst)
+    quality: int = 5
+
+
+class TrickplayIndex(NamedTuple):
+    fingerprint: str
+    interval: float
+    width: int
+    height: int
+    columns: int
+    rows: int
+    # The total number of thumbnails across the sheets
+    count: int
+    sheets: List[str]
+
+    def settings_match(self, settings: TrickplaySettings) -> bool:
+        return (self.interval, self.width, self.columns, self.rows) == (
+            settings.interval,
+            settings.width,
+            settings.columns,
+            settings.rows,
+        )
+
+    def to_dict(self):
+        return self._asdict()
+
+    @staticmethod
+    def from_dict(d) -> "TrickplayIndex":
+        return TrickplayIndex(**{k: d[k] for k in TrickplayIndex._fields})
+
+
+def trickplay_dir(input_file) -> str:
+    """
+    The directory next to the video its trickplay sheets are written to, eg Movie.mkv => Movie.trickplay
+    """
+    return os.path.splitext(input_file)[0] + ".trickplay"
+
+
+def read_index(output_dir) -> Optional[TrickplayIndex]:
+    index_file = os.path.join(output_dir, INDEX_FILE)
+    if not os.path.exists(index_file):
+        return None
+    try:
+        with open(index_file) as f:
+            return TrickplayIndex.from_dict(json.load(f))
+    except (ValueError, KeyError, TypeError):
+        logger.warning("Ignoring invalid trickplay index: {}".format(index_file))
+        return None
+
+
+def create_trickplay(
+    input_file,
+    output_dir: str = None,
+    settings: TrickplaySettings = TrickplaySettings(),
+    overwrite=False,
+) -> Optional[TrickplayIndex]:
+    """
+    Creates scrub preview sprite sheets of thumbnails at a fixed interval and an index describing them.
+
+    Only keyframes are decoded and the thumbnails are tiled by the same ffmpeg process, so a file is read once.
+    :param input_file:
+    :param output_dir: defaults to the trickplay_dir of the input
+    :param settings:
+    :param overwrite: regenerate even if the input's fingerprint & settings match the existing index
+    :return: the new index or None if the existing one is up to date
+    """
+    if output_dir is None:
+        output_dir = trickplay_dir(input_file)
+    fingerprint = file_fingerprint(input_file)
+    existing = read_index(output_dir)
+    if (
+        not overwrite
+        and existing
+        and existing.fingerprint == fingerprint
+        and existing.settings_match(settings)
+    ):
+        return None
+
+    metadata = extract_metadata(input_file)
+    if not metadata.video_streams:
+        raise Exception("No video stream in {}".format(input_file))
+    height = scaled_height(metadata, settings.width)
+
+    os.makedirs(output_dir, exist_ok=True)
+    if existing:
+        for sheet in existing.sheets:
+            path = os.path.join(output_dir, sheet)
+            if os.path.exists(path):
+                os.remove(path)
+
+    filters = [
+        "fps=1/{}".format(settings.interval),
+        "scale={}:{}".format(settings.width, height),
+        "showinfo",
+        "tile={}x{}".format(settings.columns, settings.rows),
+    ]
+    args = [ffmpeg(), "-y", "-skip_frame", "nokey", "-i", input_file]
+    args.extend(["-map", "0:v:0", "-vf", ",".join(filters), "-vsync", "0"])
+    args.extend(["-q:v", str(settings.quality)])
+    args.append(os.path.join(output_dir, SHEET_PATTERN))
+    ret, output = execute_with_output(args)
+    if ret != 0:
+        raise Exception(
+            "Error creating trickplay for {}: {}".format(input_file, output)
+        )
+
+    count = len(SHOWINFO_FRAME_PATTERN.findall(output))
+    per_sheet = settings.columns * settings.rows
+    sheets = [SHEET_NAME.format(i) for i in range(1, (count - 1) // per_sheet + 2)]
+    index = TrickplayIndex(
+        fingerprint,
+        settings.interval,
+        settings.width,
+        height,
+        settings.columns,
+        settings.rows,
+        count,
+        sheets,
+    )
+    with open(os.path.join(output_dir, INDEX_FILE), "w") as f:
+        json.dump(index.to_dict(), f, indent=2)
+    return index
+
+
+def create_all_trickplay(
+    files: Iterable[str],
+    settings: TrickplaySettings = TrickplaySettings(),
+    overwrite=False,
+    max_workers: Optional[int] = None,
+    print_output=True,
+) -> int:
+    """
+    Creates the trickplay for each file concurrently. A file that fails is reported and skipped.
+    :return: the number of files which were created or updated
+    """
+
+    def run(file):
+        try:
+            index = create_trickplay(file, settings=settings, overwrite=overwrite)
+        except Exception as e:
+            logger.exception("Error creating trickplay for {}".format(file))
+            if print_output:
+                print("Failed: {}: {}".format(file, e))
+            return False
+        if print_output:
+            print("{}: {}".format("Created" if index else "Up to date", file))
+        return index is not None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return sum(executor.map(run, files))
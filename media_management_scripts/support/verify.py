@@ -0,0 +1,315 @@
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional
+
+from media_management_scripts.support.encode_stats import encode_duration
+from media_management_scripts.support.executables import (
+    ERROR_OUTPUT_LINES,
+    execute_with_output,
+    ffmpeg,
+)
+from media_management_scripts.support.stream_plan import (
+    StreamAction,
+    create_stream_plan,
+)
+from media_management_scripts.utils import ConvertConfig, create_metadata_extractor
+
+logger = logging.getLogger(__name__)
+
+TIME_PATTERN = re.compile(r"time=\s*(\d+):(\d+):(\d+(\.\d+)?)")
+# The maximum difference in duration between an output and what was expected
+DURATION_TOLERANCE = 0.01
+MIN_DURATION_TOLERANCE = 1.0
+# Decoding keyframes only stops at the last keyframe, which may be a GOP before the end
+END_TOLERANCE = 10.0
+# The number & length in seconds of the windows decoded in samples mode
+DEFAULT_SAMPLES = 5
+SAMPLE_LENGTH = 10
+# The maximum number of error lines kept for a file
+MAX_ERRORS = 20
+# Files read at once from each device when scanning a library
+IO_WORKERS = 2
+
+
+class VerifyMode(Enum):
+    # Decode every frame
+    FULL = "full"
+    # Decode only the video keyframes, but demux the whole file
+    KEYFRAMES = "keyframes"
+    # Decode every frame of a few windows spread through the file
+    SAMPLES = "samples"
+
+
+class VerifyResult(NamedTuple):
+    file: str
+    mode: VerifyMode
+    errors: List[str]
+    # Seconds since the epoch
+    verified_at: float
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def to_dict(self):
+        return {
+            "file": self.file,
+            "mode": self.mode.value,
+            "ok": self.ok,
+            "errors": self.errors,
+            "verified_at": self.verified_at,
+        }
+
+
+def _decoded_time(output: str) -> Optional[float]:
+    """
+    The last time reported in ffmpeg's progress output
+    """
+    matches = TIME_PATTERN.findall(output)
+    if not matches:
+        return None
+    h, m, s, _ = matches[-1]
+    return int(h) * 3600 + int(m) * 60 + float(s)
+
+
+def _error_lines(output: str) -> List[str]:
+    """
+    With -v error, everything but the progress lines is an error
+    """
+    lines = []
+    for line in output.replace("\r", "\n").splitlines():
+        line = line.strip()
+        if line and not TIME_PATTERN.search(line):
+            lines.append(line)
+    return lines
+
+
+def _decode(
+    input_file,
+    keyframes_only=False,
+    start: float = None,
+    length: float = None,
+    duration: float = None,
+) -> List[str]:
+    """
+    :param duration: if given, the whole file is expected to decode up to this time
+    """
+    args = [ffmpeg(), "-hide_banner", "-nostdin", "-v", "error", "-stats"]
+    if keyframes_only:
+        args.extend(["-skip_frame", "nokey"])
+    if start:
+        args.extend(["-ss", str(start)])
+    args.extend(["-i", input_file])
+    if length is not None:
+        args.extend(["-t", str(length)])
+    args.extend(["-map", "0:v?", "-map", "0:a?", "-f", "null", "-"])
+    # Only the last progress line is kept, which is all _decoded_time needs
+    ret, output = execute_with_output(args, max_lines=ERROR_OUTPUT_LINES)
+    errors = _error_lines(output)
+    if ret != 0:
+        errors.append("ffmpeg exited with code {}".format(ret))
+    elif duration:
+        decoded = _decoded_time(output) or 0
+        if decoded < duration - END_TOLERANCE:
+            errors.append(
+                "Decoding stopped at {:.1f}s of {:.1f}s".format(decoded, duration)
+            )
+    return errors
+
+
+def sample_windows(duration: float, samples: int, length: float) -> List[float]:
+    """
+    The start of each window, evenly spaced through the file
+    """
+    if duration <= samples * length:
+        return [0.0]
+    step = duration / samples
+    return [step * i + (step - length) / 2 for i in range(samples)]
+
+
+def decode_check(
+    input_file,
+    mode: VerifyMode = VerifyMode.KEYFRAMES,
+    metadata=None,
+    samples: int = DEFAULT_SAMPLES,
+    sample_length: float = SAMPLE_LENGTH,
+) -> List[str]:
+    """
+    Decodes the file to catch corrupt or truncated data
+    :param mode: how much of the file to decode
+    :param metadata: the Metadata of the file, for its duration
+    :return: the errors found, empty if the file is ok
+    """
+    if metadata is None:
+        metadata = create_metadata_extractor().extract(input_file)
+    if mode == VerifyMode.SAMPLES:
+        if not metadata.estimated_duration:
+            return ["Unknown duration"]
+        errors = []
+        for start in sample_windows(
+            metadata.estimated_duration, samples, sample_length
+        ):
+            errors.extend(_decode(input_file, start=start, length=sample_length))
+    else:
+        errors = _decode(
+            input_file,
+            keyframes_only=mode == VerifyMode.KEYFRAMES,
+            duration=metadata.estimated_duration,
+        )
+    return errors[:MAX_ERRORS]
+
+
+def compare_to_source(source_metadata, output_metadata, config: ConvertConfig):
+    """
+    Checks the output of converting the source has the expected duration and streams
+    :return: the differences found, empty if the output matches
+    """
+    problems = []
+    expected = encode_duration(source_metadata, config)
+    actual = output_metadata.estimated_duration
+    if expected and actual is None:
+        problems.append("Unknown output duration")
+    elif expected:
+        tolerance = max(MIN_DURATION_TOLERANCE, expected * DURATION_TOLERANCE)
+        if abs(expected - actual) > tolerance:
+            problems.append(
+                "Duration {:.1f}s does not match the expected {:.1f}s".format(
+                    actual, expected
+                )
+            )
+    if source_metadata.video_streams and not output_metadata.video_streams:
+        problems.append("No video stream")
+    plan = create_stream_plan(
+        source_metadata,
+        config.audio_codec,
+        None,
+        drop_duplicate_commentary=config.drop_duplicate_commentary,
+    )
+    audio = len([p for p in plan.audio if p.action != StreamAction.DROP])
+    if len(output_metadata.audio_streams) != audio:
+        problems.append(
+            "{} audio streams, expected {}".format(
+                len(output_metadata.audio_streams), audio
+            )
+        )
+    if len(output_metadata.subtitle_streams) > len(source_metadata.subtitle_streams):
+        problems.append(
+            "{} subtitle streams, but the source has {}".format(
+                len(output_metadata.subtitle_streams),
+                len(source_metadata.subtitle_streams),
+            )
+        )
+    return problems
+
+
+def verify_output(
+    input_file,
+    output_file,
+    config: ConvertConfig,
+    mode: VerifyMode = VerifyMode.KEYFRAMES,
+    source_metadata=None,
+) -> VerifyResult:
+    """
+    Verifies the output of a conversion against its source, then decode checks it
+    :param input_file: the source
+    :param output_file: the converted file
+    :param config: the config the output was converted with
+    :param mode: how much of the output to decode
+    :param source_metadata: the Metadata of the source
+    """
+    extractor = create_metadata_extractor()
+    try:
+        if source_metadata is None:
+            source_metadata = extractor.extract(input_file)
+        output_metadata = extractor.extract(output_file)
+    except Exception as e:
+        return VerifyResult(output_file, mode, [str(e)], time.time())
+    errors = compare_to_source(source_metadata, output_metadata, config)
+    # A truncated or corrupt file usually fails both, so there is no need to decode if the layout is already wrong
+    if not errors:
+        errors = decode_check(output_file, mode, output_metadata)
+    result = VerifyResult(output_file, mode, errors, time.time())
+    if errors:
+        logger.warning("Verification failed for {}: {}".format(output_file, errors))
+    return result
+
+
+def cache_key(mode: VerifyMode) -> str:
+    return "verify:{}".format(mode.value)
+
+
+class _DeviceLimiter:
+    """
+    Limits the number of files read at once from each device, so a scan of several disks reads all of them without
+    thrashing any one
+    """
+
+    def __init__(self, per_device: int):
+        self.per_device = per_device
+        self._semaphores: Dict[int, threading.Semaphore] = {}
+        self._lock = threading.Lock()
+
+    def get(self, file) -> threading.Semaphore:
+        device = os.stat(file).st_dev
+        with self._lock:
+            if device not in self._semaphores:
+                self._semaphores[device] = threading.Semaphore(self.per_device)
+            return self._semaphores[device]
+
+
+def verify_files(
+    files: Iterable[str],
+    cache,
+    mode: VerifyMode = VerifyMode.FULL,
+    max_workers: Optional[int] = None,
+    io_workers: int = IO_WORKERS,
+    force=False,
+    callback: Optional[Callable[[VerifyResult, bool], None]] = None,
+) -> List[VerifyResult]:
+    """
+    Decode checks files concurrently. Each result is stored by the file's fingerprint as soon as it is known, so
+    unchanged files are skipped when scanning again and an interrupted scan resumes where it stopped.
+    :param cache: the AnalysisCache for the results
+    :param mode: how much of each file to decode
+    :param max_workers: the maximum number of files decoded at once, defaults to the number of CPUs
+    :param io_workers: the maximum number of files read at once from each device
+    :param force: check files again even if there is a result for them
+    :param callback: called with each result and whether it came from the cache
+    :return: the result of each file in order
+    """
+    key = cache_key(mode)
+    limiter = _DeviceLimiter(io_workers)
+
+    def run(file):
+        if not force:
+            result = cache.get(file, key)
+            if result is not None:
+                # The file may have been renamed since
+                result = result._replace(file=file)
+                if callback:
+                    callback(result, True)
+                return result
+        with limiter.get(file):
+            try:
+                errors = decode_check(file, mode)
+            except Exception as e:
+                logger.exception("Error verifying {}".format(file))
+                errors = [str(e)]
+        result = VerifyResult(file, mode, errors, time.time())
+        cache.put(file, key, result)
+        if callback:
+            callback(result, False)
+        return result
+
+    executor = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count())
+    try:
+        futures = [executor.submit(run, f) for f in files]
+        return [f.result() for f in futures]
+    finally:
+        # On an interrupt, stop without starting the remaining files
+        executor.shutdown(cancel_futures=True)
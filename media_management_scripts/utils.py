@@ -2,12 +2,13 @@ from media_management_scripts.support.encoding import (
     DEFAULT_CRF,
     DEFAULT_PRESET,
     Resolution,
+    SizeFallback,
     SubtitleCodec,
     VideoCodec,
     AudioCodec,
 )
 from media_management_scripts.support.metadata import MetadataExtractor, Metadata
-from typing import Iterable, NamedTuple, Optional
+from typing import Iterable, NamedTuple, Optional, Tuple
 from configparser import ConfigParser
 from media_management_scripts.support.executables import ffprobe
 
@@ -110,12 +111,35 @@ class ConvertConfig(NamedTuple):
     subtitle_codec: str = SubtitleCodec.COPY.ffmpeg_codec_name
     hardware_nvidia: bool = False
     hardware_apple: bool = False
+    filter_threads: Optional[int] = None
+    drop_duplicate_commentary: bool = True
+    max_size_ratio: Optional[float] = None
+    size_fallback: str = SizeFallback.REMUX.value
+    renditions: Optional[Tuple[int, ...]] = None
+    deinterlace_segments: bool = False
+    inverse_telecine: bool = True
+    auto_crop: bool = False
+    segments: Optional[str] = None
+    scene_chapters: Optional[float] = None
 
     @property
     def hardware_accelerated(self):
         return self.hardware_nvidia or self.hardware_apple
 
 
+def parse_renditions(value: str) -> Tuple[int, ...]:
+    """
+    Parses a comma separated list of heights, for example 1080,720,480
+    """
+    try:
+        renditions = tuple(int(v.strip()) for v in value.split(","))
+    except ValueError:
+        raise ValueError("Invalid renditions: {}".format(value))
+    if not renditions or any(r <= 0 for r in renditions):
+        raise ValueError("Invalid renditions: {}".format(value))
+    return renditions
+
+
 def convert_config_from_config_section(
     config: ConfigParser, section: str
 ) -> ConvertConfig:
@@ -129,11 +153,20 @@ def convert_config_from_config_section(
       bitrate = disabled # (disabled|auto|int)
       deinterlace = False
       deinterlace_threshold = .5
+      deinterlace_segments = False # only deinterlace the interlaced segments of mixed content
+      inverse_telecine = True # use fieldmatch/decimate instead of deinterlacing telecined content
+      auto_crop = False # detect and crop black bars
+      segments = chapter # (chapter|drop) the intro & credits found by the intros command
+      scene_chapters = 300 # add chapters about every N seconds, starting on scene cuts, to inputs without chapters
       auto_bitrate_240 = 500
       auto_bitrate_480 = 1600
       auto_bitrate_720 = 4500
       auto_bitrate_1080 = 8000
       include_subtitles = True
+      drop_duplicate_commentary = True
+      max_size_ratio = 1.0 # abort if the output is projected to be larger than this ratio of the input
+      size_fallback = remux # (remux|crf|none)
+      renditions = 1080,720,480 # encode multiple heights from a single decode
       ripped = False
 
     :param config:
@@ -160,6 +193,16 @@ def convert_config_from_config_section(
         config.get(section, "deinterlace_threshold", fallback=".5")
     )
 
+    deinterlace_segments = config.getboolean(
+        section, "deinterlace_segments", fallback=False
+    )
+    inverse_telecine = config.getboolean(section, "inverse_telecine", fallback=True)
+    auto_crop = config.getboolean(section, "auto_crop", fallback=False)
+    segments = config.get(section, "segments", fallback=None)
+    if segments and segments not in ("chapter", "drop"):
+        raise Exception("Segments in [{}] must be 'chapter' or 'drop'".format(section))
+    scene_chapters = config.getfloat(section, "scene_chapters", fallback=None)
+
     auto_bitrate_240 = config.getint(
         section, "auto_bitrate_240", fallback=Resolution.LOW_DEF.auto_bitrate
     )
@@ -174,6 +217,27 @@ def convert_config_from_config_section(
     )
 
     include_subtitles = config.getboolean(section, "include_subtitles", fallback=True)
+    drop_duplicate_commentary = config.getboolean(
+        section, "drop_duplicate_commentary", fallback=True
+    )
+    max_size_ratio = config.getfloat(section, "max_size_ratio", fallback=None)
+    size_fallback = config.get(
+        section, "size_fallback", fallback=SizeFallback.REMUX.value
+    )
+    try:
+        SizeFallback(size_fallback)
+    except ValueError:
+        raise Exception(
+            "Size fallback in [{}] must be 'remux', 'crf' or 'none'".format(section)
+        )
+    renditions = config.get(section, "renditions", fallback=None)
+    if renditions:
+        try:
+            renditions = parse_renditions(renditions)
+        except ValueError as e:
+            raise Exception("{} in [{}]".format(e, section))
+    else:
+        renditions = None
     ripped = config.getboolean(section, "ripped", fallback=False)
 
     return ConvertConfig(
@@ -186,6 +250,15 @@ def convert_config_from_config_section(
         auto_bitrate_1080=auto_bitrate_1080,
         deinterlace=deinterlace,
         deinterlace_threshold=deinterlace_threshold,
+        deinterlace_segments=deinterlace_segments,
+        inverse_telecine=inverse_telecine,
+        auto_crop=auto_crop,
+        segments=segments,
+        scene_chapters=scene_chapters,
         include_subtitles=include_subtitles,
+        drop_duplicate_commentary=drop_duplicate_commentary,
+        max_size_ratio=max_size_ratio,
+        size_fallback=size_fallback,
+        renditions=renditions,
         include_meta=ripped,
     )
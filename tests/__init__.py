@@ -1,6 +1,8 @@
 import os
 from typing import Optional
 
+from media_management_scripts.support.executables import execute_with_output, ffmpeg
+
 LOG_FILE = os.path.join(os.path.dirname(__file__), "test_logging.yaml")
 
 
@@ -17,3 +19,30 @@ def assertAudioLength(expected: float, actual: Optional[float]):
     max = expected * 1.02
     if not (min <= actual <= max):
         raise AssertionError("{} != {} ({}-{})".format(expected, actual, min, max))
+
+
+def create_keyframe_video(file, length=10, gop=50):
+    """
+    Creates a 25fps video with a keyframe every gop frames
+    """
+    ret, output = execute_with_output(
+        [
+            ffmpeg(),
+            "-y",
+            "-f",
+            "lavfi",
+            "-i",
+            "testsrc=rate=25",
+            "-t",
+            str(length),
+            "-g",
+            str(gop),
+            "-c:v",
+            "libx264",
+            "-preset",
+            "ultrafast",
+            file,
+        ]
+    )
+    if ret != 0:
+        raise Exception("Failed to create test video: {}".format(output))
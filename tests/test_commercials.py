@@ -0,0 +1,108 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from media_management_scripts.convert import remove_ranges
+from media_management_scripts.support.cache import AnalysisCache
+from media_management_scripts.support.commercials import (
+    Break,
+    _parse_silence,
+    boundaries,
+    detect_commercials,
+    find_breaks,
+)
+from media_management_scripts.support.executables import execute_with_output, ffmpeg
+from media_management_scripts.utils import extract_metadata
+
+VIDEO = "{},scale=320:240,fps=25,format=yuv420p,setsar=1"
+
+
+def _create_recording(file):
+    """
+    Creates a 83 second recording: 30s show, a break of two 10s commercials between 1s of black & silence, 30s show
+    """
+    black = ("color=black:size=320x240", "anullsrc=r=48000:cl=mono", 1)
+    sources = [
+        ("testsrc2=size=320x240", "sine=frequency=440:sample_rate=48000", 30),
+        black,
+        ("mandelbrot=size=320x240", "sine=frequency=880:sample_rate=48000", 10),
+        black,
+        ("smptebars=size=320x240", "sine=frequency=660:sample_rate=48000", 10),
+        black,
+        ("testsrc=size=320x240", "sine=frequency=440:sample_rate=48000", 30),
+    ]
+    args = [ffmpeg(), "-y"]
+    for video, audio, length in sources:
+        args.extend(["-f", "lavfi", "-t", str(length), "-i", VIDEO.format(video)])
+        args.extend(["-f", "lavfi", "-t", str(length), "-i", audio])
+    args.extend(
+        ["-filter_complex", "concat=n={}:v=1:a=1".format(len(sources)), "-ac", "1"]
+    )
+    args.extend(["-c:v", "libx264", "-preset", "ultrafast", "-g", "25"])
+    args.extend(["-c:a", "aac", file])
+    ret, output = execute_with_output(args)
+    if ret != 0:
+        raise Exception("Failed to create test video: {}".format(output))
+
+
+class CommercialsTestCase(unittest.TestCase):
+    def test_parse_silence(self):
+        output = "\n".join(
+            [
+                "[silencedetect @ 0x1] silence_start: -0.01",
+                "[silencedetect @ 0x1] silence_end: 1.5 | silence_duration: 1.51",
+                "[silencedetect @ 0x1] silence_start: 10",
+            ]
+        )
+        self.assertEqual([(0.0, 1.5), (10.0, 12.0)], _parse_silence(output, 12.0))
+        self.assertEqual([(0.0, 1.5)], _parse_silence(output, None))
+
+    def test_boundaries(self):
+        black = [(1, 2), (5, 6), (9, 10)]
+        silence = [(1.5, 2.5), (9, 9.5)]
+        self.assertEqual([(1.5, 2), (9, 9.5)], boundaries(black, silence))
+        self.assertEqual(black, boundaries(black, None))
+
+    def test_find_breaks(self):
+        found = [(100, 101), (130, 131), (160, 161), (1000, 1001), (2000, 2001)]
+        self.assertEqual(
+            [Break(100, 161)], find_breaks(found, max_commercial=60, min_break=30)
+        )
+        self.assertEqual([], find_breaks(found, max_commercial=20, min_break=30))
+        self.assertEqual([], find_breaks([], max_commercial=60, min_break=30))
+
+    def test_find_breaks_max_break(self):
+        # Fades every 90s through 20 minutes of programme chain together
+        fades = [(t, t + 1) for t in range(0, 1200, 90)]
+        self.assertEqual([], find_breaks(fades))
+        # A real break after the programme is still found
+        found = fades + [(1500, 1501), (1530, 1531), (1560, 1561)]
+        self.assertEqual([Break(1500, 1561)], find_breaks(found))
+        self.assertEqual(
+            [Break(0, 1171), Break(1500, 1561)], find_breaks(found, max_break=1200)
+        )
+
+    def test_detect_and_remove(self):
+        with TemporaryDirectory() as tmp:
+            file = os.path.join(tmp, "recording.mkv")
+            _create_recording(file)
+            with AnalysisCache(os.path.join(tmp, "cache")) as cache:
+                breaks = detect_commercials(
+                    file, max_commercial=15, min_break=15, cache=cache
+                )
+                self.assertEqual(1, len(breaks))
+                self.assertAlmostEqual(30, breaks[0].start, delta=1)
+                self.assertAlmostEqual(53, breaks[0].end, delta=1)
+                # Regrouping the cached boundaries
+                self.assertEqual(
+                    [], detect_commercials(file, min_break=60, cache=cache)
+                )
+
+            output = os.path.join(tmp, "output.mkv")
+            self.assertEqual(0, remove_ranges(file, output, breaks, print_output=False))
+            duration = extract_metadata(output).estimated_duration
+            self.assertAlmostEqual(60, duration, delta=1.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
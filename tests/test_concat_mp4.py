@@ -9,17 +9,52 @@ from media_management_scripts.support.test_video import (
     VideoDefinition,
     AudioDefinition,
 )
-from media_management_scripts.support.concat_mp4 import concat_mp4
+from media_management_scripts.support.concat_mp4 import (
+    PIPE_LOOKAHEAD,
+    concat_mp4,
+    _concat_list_entry,
+    _concat_pipe,
+)
 from media_management_scripts.utils import create_metadata_extractor
 from tests import assertAudioLength
+import io
 import unittest
 from tempfile import NamedTemporaryFile
+from unittest import mock
 
 MP4_VIDEO_DEF = VideoDefinition(
     Resolution.LOW_DEF, VideoCodec.H264, VideoFileContainer.MP4
 )
 
 
+class FakeProcess:
+    """
+    Stands in for the ffmpeg processes of _concat_pipe, tracking how many converters are running at once
+    """
+
+    running = 0
+    max_running = 0
+
+    def __init__(self, args, stdin=None, stdout=None, stderr=None):
+        self.returncode = None
+        self.converter = stdin is None
+        self.stdin = io.BytesIO()
+        self.stdout = io.BytesIO(args[4].encode("utf-8"))
+        if self.converter:
+            FakeProcess.running += 1
+            FakeProcess.max_running = max(FakeProcess.max_running, self.running)
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self):
+        if self.returncode is None:
+            self.returncode = 0
+            if self.converter:
+                FakeProcess.running -= 1
+        return self.returncode
+
+
 class ConcatMp4TestCase(unittest.TestCase):
     def test_2_files(self):
         with create_test_video(
@@ -83,3 +118,18 @@ class ConcatMp4TestCase(unittest.TestCase):
                     concat_mp4(
                         output.name, files=[first.name, second.name], overwrite=True
                     )
+
+    def test_concat_list_entry(self):
+        self.assertEqual(
+            "file '/videos/it'\\''s.mp4'\n", _concat_list_entry("/videos/it's.mp4")
+        )
+
+    def test_pipe_lookahead(self):
+        files = ["{}.mp4".format(i) for i in range(6)]
+        FakeProcess.running = FakeProcess.max_running = 0
+        with mock.patch("subprocess.Popen", FakeProcess), NamedTemporaryFile(
+            suffix=".mp4"
+        ) as output:
+            _concat_pipe(files, output.name)
+        self.assertEqual(PIPE_LOOKAHEAD + 1, FakeProcess.max_running)
+        self.assertEqual(0, FakeProcess.running)
@@ -1,7 +1,15 @@
+import os
+import re
 import unittest
 
-from media_management_scripts.convert import convert_config_from_ns, convert_with_config
+from media_management_scripts.convert import (
+    convert_config_from_ns,
+    convert_with_config,
+    cut,
+    rendition_outputs,
+)
 from media_management_scripts.utils import ConvertConfig, extract_metadata
+from media_management_scripts.support.executables import execute_with_output, ffmpeg
 from media_management_scripts.support.test_video import (
     create_test_video,
     VideoDefinition,
@@ -9,8 +17,13 @@ from media_management_scripts.support.test_video import (
     AudioCodec,
     AudioChannelName,
 )
-from tempfile import NamedTemporaryFile
-from media_management_scripts.support.encoding import VideoCodec, Resolution
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from media_management_scripts.support.encoding import (
+    VideoCodec,
+    Resolution,
+    SizeFallback,
+)
+from tests import create_keyframe_video
 
 
 class ConfigTestCase(unittest.TestCase):
@@ -87,6 +100,40 @@ class ConvertTestCase(unittest.TestCase):
             metadata = extract_metadata(output.name)
             self.assertEqual(metadata.resolution, Resolution.STANDARD_DEF)
 
+    def test_renditions_convert(self):
+        config = ConvertConfig(renditions=(1080, 240), bitrate="auto")
+        with create_test_video(
+            length=3, video_def=VideoDefinition(resolution=Resolution.STANDARD_DEF)
+        ) as file, TemporaryDirectory() as tmp:
+            output = os.path.join(tmp, "Movie (2000) - 480p.mkv")
+            ret = convert_with_config(file.name, output, config, overwrite=True)
+            self.assertEqual(0, ret)
+            # Not upscaled
+            metadata = extract_metadata(output)
+            self.assertEqual(Resolution.STANDARD_DEF, metadata.resolution)
+            metadata = extract_metadata(os.path.join(tmp, "Movie (2000) - 240p.mkv"))
+            self.assertEqual(Resolution.LOW_DEF, metadata.resolution)
+            self.assertEqual(1, len(metadata.audio_streams))
+
+    def test_rendition_outputs(self):
+        self.assertEqual(["out.mkv"], rendition_outputs("out.mkv", None))
+        self.assertEqual(
+            ["/a/M (2000) - 1080p.mkv", "/a/M (2000) - 720p.mkv"],
+            rendition_outputs("/a/M (2000) - 1080p.mkv", (1080, 720)),
+        )
+
+    def test_scale_deinterlace_convert(self):
+        config = ConvertConfig(scale=480, deinterlace=True, filter_threads=2)
+        with create_test_video(
+            length=4,
+            video_def=VideoDefinition(
+                resolution=Resolution.HIGH_DEF, codec=VideoCodec.MPEG2, interlaced=True
+            ),
+        ) as file, NamedTemporaryFile(suffix=".mkv") as output:
+            convert_with_config(file.name, output.name, config, overwrite=True)
+            metadata = extract_metadata(output.name)
+            self.assertEqual(metadata.resolution, Resolution.STANDARD_DEF)
+
     def test_hevc_convert(self):
         config = convert_config_from_ns(
             {"video_codec": VideoCodec.H265.ffmpeg_encoder_name}
@@ -115,6 +162,52 @@ class ConvertTestCase(unittest.TestCase):
                 VideoCodec.MPEG2.ffmpeg_codec_name,
             )
 
+    def test_size_limit_remux(self):
+        config = ConvertConfig(
+            video_codec=VideoCodec.H265.ffmpeg_encoder_name,
+            crf=0,
+            max_size_ratio=0.01,
+        )
+        decisions = []
+        with create_test_video(length=3) as file, NamedTemporaryFile(
+            suffix=".mkv"
+        ) as output:
+            ret = convert_with_config(
+                file.name,
+                output.name,
+                config,
+                overwrite=True,
+                on_size_limit=decisions.append,
+            )
+            self.assertEqual(0, ret)
+            self.assertEqual(1, len(decisions))
+            self.assertEqual(SizeFallback.REMUX, decisions[0].fallback)
+            metadata = extract_metadata(output.name)
+            # Remuxed, so still the original codec
+            self.assertEqual(
+                metadata.video_streams[0].codec, VideoCodec.H264.ffmpeg_codec_name
+            )
+            self.assertAlmostEqual(3, metadata.estimated_duration, delta=0.1)
+
+    def test_size_limit_crf(self):
+        config = ConvertConfig(
+            crf=0, max_size_ratio=0.9, size_fallback=SizeFallback.CRF.value
+        )
+        decisions = []
+        with create_test_video(length=3) as file, NamedTemporaryFile(
+            suffix=".mkv"
+        ) as output:
+            ret = convert_with_config(
+                file.name,
+                output.name,
+                config,
+                overwrite=True,
+                on_size_limit=decisions.append,
+            )
+            self.assertEqual(0, ret)
+            self.assertEqual(SizeFallback.CRF, decisions[0].fallback)
+            self.assertGreater(decisions[0].crf, 0)
+
     def test_audio_convert(self):
         config = convert_config_from_ns(
             {"audio_codec": AudioCodec.AC3.ffmpeg_codec_name}
@@ -213,3 +306,62 @@ class ConvertTestCase(unittest.TestCase):
             convert_with_config(file.name, output.name, config, overwrite=True)
             metadata = extract_metadata(output.name)
             self.assertAlmostEqual(3.0, metadata.estimated_duration, delta=0.03)
+
+
+class CutTestCase(unittest.TestCase):
+    def test_keyframe_cut(self):
+        with TemporaryDirectory() as tmp:
+            input = os.path.join(tmp, "input.mkv")
+            output = os.path.join(tmp, "output.mkv")
+            create_keyframe_video(input)
+            self.assertEqual(0, cut(input, output, 4.2, 6.0, print_output=False))
+            # Starts at the keyframe at 4 seconds
+            metadata = extract_metadata(output)
+            self.assertAlmostEqual(2.0, metadata.estimated_duration, delta=0.3)
+
+    def test_accurate_cut(self):
+        config = ConvertConfig(preset="ultrafast")
+        with TemporaryDirectory() as tmp:
+            input = os.path.join(tmp, "input.mkv")
+            output = os.path.join(tmp, "output.mkv")
+            create_keyframe_video(input)
+            ret = cut(
+                input,
+                output,
+                4.2,
+                6.0,
+                accurate=True,
+                config=config,
+                print_output=False,
+            )
+            self.assertEqual(0, ret)
+            metadata = extract_metadata(output)
+            self.assertAlmostEqual(1.8, metadata.estimated_duration, delta=0.05)
+
+    def test_smart_cut(self):
+        config = ConvertConfig(preset="ultrafast")
+        with TemporaryDirectory() as tmp:
+            input = os.path.join(tmp, "input.mkv")
+            output = os.path.join(tmp, "output.mkv")
+            create_keyframe_video(input)
+            ret = cut(
+                input, output, 3.2, 8.6, config=config, print_output=False, smart=True
+            )
+            self.assertEqual(0, ret)
+
+            def frame_hashes(*args):
+                ret, output = execute_with_output(
+                    [ffmpeg(), *args, "-map", "0:v", "-f", "framemd5", "-"]
+                )
+                self.assertEqual(0, ret, output)
+                return [
+                    l.split(",")[-1].strip()
+                    for l in output.splitlines()
+                    if re.match(r"^\d+,", l)
+                ]
+
+            actual = frame_hashes("-i", output)
+            expected = frame_hashes("-ss", "3.2", "-i", input, "-frames:v", "135")
+            self.assertEqual(135, len(actual))
+            # 3.2-4 & 8-8.6 are re-encoded, the GOPs in between are copied
+            self.assertEqual(expected[20:120], actual[20:120])
@@ -13,6 +13,19 @@ from media_management_scripts.support.encoding import (
     Resolution,
 )
 from media_management_scripts.convert_daemon import ConvertDvds
+from media_management_scripts.support.cache import AnalysisCache
+from media_management_scripts.support.crop import (
+    DEFAULT_CROP_FRAMES,
+    DEFAULT_CROP_LIMIT,
+    DEFAULT_CROP_WINDOWS,
+)
+from media_management_scripts.support.intro import (
+    SEGMENTS_CACHE_KEY,
+    Segment,
+    SegmentKind,
+)
+from media_management_scripts.support.scenes import cache_key as scenes_cache_key
+from media_management_scripts.utils import extract_metadata
 
 
 # [directories]
@@ -130,19 +143,30 @@ class ConvertDvdTestCase(unittest.TestCase):
         self.dirs.extend(
             [self.movie_in, self.tv_in, self.working_dir, self.movie_out, self.tv_out]
         )
+        self.config = config
         with self.config_file:
             config.write(self.config_file)
-        self.convert_dvds = ConvertDvds(self.config_file.name)
-
         self.backup_count = 0
+        self.convert_dvds = self._create_convert_dvds()
+
+    def _create_convert_dvds(self):
+        convert_dvds = ConvertDvds(self.config_file.name)
 
         def backup_mock(file, target_dir):
             self.backup_count += 1
             return BackupMock()
 
-        self.convert_dvds.backup_file = backup_mock
+        convert_dvds.backup_file = backup_mock
+        return convert_dvds
+
+    def _update_config(self, section, values):
+        self.config[section].update(values)
+        with open(self.config_file.name, "w") as f:
+            self.config.write(f)
+        self.convert_dvds = self._create_convert_dvds()
 
     def tearDown(self):
+        self.convert_dvds.close()
         for f in self.files:
             f.close()
             if os.path.exists(f.name):
@@ -271,3 +295,106 @@ class ConvertDvdTestCase(unittest.TestCase):
         self.assertEqual(0, result.tv_error_count)
         self.assertEqual(tv_count, result.tv_processed_count)
         self.assertEqual(tv_count, result.tv_total_count)
+
+    def test_verify_requeue(self):
+        movie_name = "Move Name (2000) - 1080p.mkv"
+        input_file = os.path.join(self.movie_in.name, movie_name)
+        create_test_video(length=10, output_file=input_file)
+        os.utime(input_file, (0, 0))
+        expected_output_file = os.path.join(self.movie_out.name, movie_name)
+
+        verify = self.convert_dvds._verify
+        verified = []
+
+        def corrupt_first(input_file, output_file, temp_file, convert_config):
+            if not verified:
+                # Truncate the first conversion
+                size = os.path.getsize(temp_file)
+                with open(temp_file, "r+b") as f:
+                    f.truncate(size // 4)
+            results = verify(input_file, output_file, temp_file, convert_config)
+            verified.append(results)
+            return results
+
+        self.convert_dvds._verify = corrupt_first
+        result = self.convert_dvds.run()
+
+        self.assertEqual(2, len(verified))
+        self.assertFalse(verified[0][0].ok)
+        self.assertTrue(verified[1][0].ok)
+        self.assertTrue(os.path.isfile(expected_output_file))
+        self.assertEqual(1, result.movie_processed_count)
+        self.assertEqual(0, result.movie_error_count)
+        verdict = self.convert_dvds.db.get_verification(expected_output_file)
+        self.assertTrue(verdict.ok)
+        self.assertTrue(
+            self.convert_dvds.db.get(input_file, expected_output_file).convert
+        )
+
+    def test_verify_failed_backup(self):
+        movie_name = "Move Name (2000) - 1080p.mkv"
+        input_file = os.path.join(self.movie_in.name, movie_name)
+        create_test_video(length=10, output_file=input_file)
+        os.utime(input_file, (0, 0))
+        self.convert_dvds.backup_file = lambda file, target_dir: BackupMock(1)
+
+        verify = self.convert_dvds._verify
+        verified = []
+
+        def corrupt_first(input_file, output_file, temp_file, convert_config):
+            if not verified:
+                size = os.path.getsize(temp_file)
+                with open(temp_file, "r+b") as f:
+                    f.truncate(size // 4)
+            results = verify(input_file, output_file, temp_file, convert_config)
+            verified.append(results)
+            return results
+
+        self.convert_dvds._verify = corrupt_first
+        result = self.convert_dvds.run()
+
+        # The file was never counted, because its backup failed
+        self.assertEqual(2, len(verified))
+        self.assertEqual(0, result.movie_processed_count)
+
+    def test_segments(self):
+        movie_name = "Move Name (2000) - 1080p.mkv"
+        input_file = os.path.join(self.movie_in.name, movie_name)
+        create_test_video(length=10, output_file=input_file)
+        os.utime(input_file, (0, 0))
+        cache_file = os.path.join(self.working_dir.name, "analysis.shelve")
+        with AnalysisCache(cache_file) as cache:
+            cache.put(
+                input_file, SEGMENTS_CACHE_KEY, [Segment(SegmentKind.INTRO, 0, 2)]
+            )
+        self._update_config("logging", {"analysis.cache": cache_file})
+        self._update_config("movie.transcode", {"segments": "chapter"})
+
+        result = self.convert_dvds.run()
+
+        self.assertEqual(1, result.movie_processed_count)
+        output_file = os.path.join(self.movie_out.name, movie_name)
+        chapters = extract_metadata(output_file).chapters
+        self.assertEqual(["Intro", "Chapter"], [c.title for c in chapters])
+
+    def test_analysis_cached(self):
+        movie_name = "Move Name (2000) - 1080p.mkv"
+        input_file = os.path.join(self.movie_in.name, movie_name)
+        create_test_video(length=10, output_file=input_file)
+        os.utime(input_file, (0, 0))
+        cache_file = os.path.join(self.working_dir.name, "analysis.shelve")
+        self._update_config("logging", {"analysis.cache": cache_file})
+        self._update_config(
+            "movie.transcode", {"auto_crop": "true", "scene_chapters": "5"}
+        )
+
+        result = self.convert_dvds.run()
+        self.convert_dvds.close()
+
+        self.assertEqual(1, result.movie_processed_count)
+        crop_key = "crop:{}:{}:{}".format(
+            DEFAULT_CROP_WINDOWS, DEFAULT_CROP_FRAMES, DEFAULT_CROP_LIMIT
+        )
+        with AnalysisCache(cache_file) as cache:
+            self.assertTrue(cache.contains(input_file, crop_key))
+            self.assertTrue(cache.contains(input_file, scenes_cache_key()))
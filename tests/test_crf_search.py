@@ -0,0 +1,91 @@
+import os
+import unittest
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+
+from media_management_scripts.support.cache import AnalysisCache
+from media_management_scripts.support.crf_search import (
+    CrfSearch,
+    convert_with_target,
+    sample_positions,
+)
+from media_management_scripts.support.interlace import (
+    InterlaceGroup,
+    InterlaceMap,
+    InterlaceReport,
+    InterlaceSegment,
+)
+from media_management_scripts.support.test_video import create_test_video
+from media_management_scripts.utils import ConvertConfig, extract_metadata
+
+
+class SamplePositionsTestCase(unittest.TestCase):
+    def test_even(self):
+        samples = sample_positions(0, 100, 4, 10)
+        self.assertEqual([(15, 10), (35, 10), (55, 10), (75, 10)], samples)
+
+    def test_short(self):
+        self.assertEqual([(5, 20)], sample_positions(5, 25, 4, 10))
+
+
+class CrfSearchTestCase(unittest.TestCase):
+    def test_search(self):
+        config = ConvertConfig(preset="ultrafast")
+        with create_test_video(length=6) as file, TemporaryDirectory() as tmp:
+            metadata = extract_metadata(file.name)
+            with AnalysisCache(os.path.join(tmp, "cache")) as cache:
+                search = CrfSearch(
+                    file.name,
+                    config,
+                    metadata,
+                    sample_count=2,
+                    sample_length=1,
+                    cache=cache,
+                )
+                low = search.evaluate(10)
+                high = search.evaluate(40)
+                self.assertGreater(low.ssim, high.ssim)
+                self.assertGreater(low.estimated_size, high.estimated_size)
+                # Cached
+                self.assertEqual(low, search.evaluate(10))
+
+                result = search.search(target_ssim=high.ssim, min_crf=30, max_crf=40)
+                self.assertTrue(result.met_target)
+                self.assertGreaterEqual(result.ssim, high.ssim)
+
+    def test_deinterlace_segments(self):
+        interlaced = InterlaceGroup(100, 0, 0, 0)
+        progressive = InterlaceGroup(0, 0, 100, 0)
+        config = ConvertConfig(
+            preset="ultrafast", deinterlace=True, deinterlace_segments=True
+        )
+        with create_test_video(length=6) as file:
+            metadata = extract_metadata(file.name)
+            metadata.interlace_map = InterlaceMap(
+                [
+                    InterlaceSegment(0, 2, InterlaceReport(interlaced, interlaced)),
+                    InterlaceSegment(2, 4, InterlaceReport(progressive, progressive)),
+                    InterlaceSegment(4, 6, InterlaceReport(interlaced, interlaced)),
+                ]
+            )
+            search = CrfSearch(file.name, config, metadata, sample_count=2)
+            # Each sample's filter timestamps start at zero from its own start
+            self.assertIn(
+                "between(t,0.000,1.500)+between(t,3.500,5.500)",
+                search._filter_chain(0.5).build(),
+            )
+            self.assertIn("between(t,1.000,3.000)'", search._filter_chain(3).build())
+
+    def test_convert_with_target(self):
+        config = ConvertConfig(preset="ultrafast")
+        with (
+            create_test_video(length=4) as file,
+            NamedTemporaryFile(suffix=".mkv") as output,
+        ):
+            ret = convert_with_target(
+                file.name,
+                output.name,
+                config,
+                target_size=10 * 1024**2,
+                overwrite=True,
+            )
+            self.assertEqual(0, ret)
@@ -0,0 +1,133 @@
+import os
+import unittest
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+
+from media_management_scripts.convert import convert_with_config
+from media_management_scripts.main import COMMANDS, build_argparse
+from media_management_scripts.support.cache import AnalysisCache
+from media_management_scripts.support.crop import (
+    CropRect,
+    _parse_output,
+    find_crop,
+    reduce_crops,
+)
+from media_management_scripts.support.executables import execute_with_output, ffmpeg
+from media_management_scripts.support.filters import create_filter_chain
+from media_management_scripts.utils import ConvertConfig, extract_metadata
+
+CROPDETECT_OUTPUT = """[Parsed_cropdetect_0 @ 0x111317c0] x1:0 x2:639 y1:45 y2:313 w:640 h:268 x:0 y:46 pts:720 t:0.720000 limit:24.000000 crop=640:268:0:46
+[Parsed_cropdetect_0 @ 0x111317c0] x1:0 x2:639 y1:45 y2:314 w:640 h:268 x:0 y:46 pts:760 t:0.760000 limit:24.000000 crop=640:268:0:46
+"""
+
+BLACK_OUTPUT = """[Parsed_cropdetect_0 @ 0x111317c0] x1:639 x2:0 y1:359 y2:0 w:-638 h:-358 x:0 y:0 pts:0 t:0.000000 limit:24.000000 crop=-638:-358:0:0
+"""
+
+
+def _create_letterboxed_video(file, length=4, audio=False):
+    args = [
+        ffmpeg(),
+        "-y",
+        "-f",
+        "lavfi",
+        "-i",
+        "testsrc=size=640x270:rate=25,pad=640:360:0:45:black",
+    ]
+    if audio:
+        args.extend(["-f", "lavfi", "-i", "anullsrc"])
+    args.extend(["-t", str(length), "-c:v", "libx264", "-preset", "ultrafast", file])
+    ret, output = execute_with_output(args)
+    if ret != 0:
+        raise Exception("Failed to create test video: {}".format(output))
+
+
+class FakeVideoStream:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+
+
+class FakeMetadata:
+    def __init__(self, crop, width=640, height=360):
+        self.crop = crop
+        self.video_streams = [FakeVideoStream(width, height)]
+
+
+class CropTestCase(unittest.TestCase):
+    def test_parse_output(self):
+        self.assertEqual(CropRect(640, 270, 0, 45), _parse_output(CROPDETECT_OUTPUT))
+        self.assertIsNone(_parse_output(BLACK_OUTPUT))
+        self.assertIsNone(_parse_output(""))
+
+    def test_reduce_crops(self):
+        crops = [CropRect(640, 270, 0, 45), None, CropRect(600, 280, 20, 40)]
+        # Grown to even offsets & dimensions
+        self.assertEqual(CropRect(640, 280, 0, 40), reduce_crops(crops, 640, 360))
+        self.assertEqual(
+            CropRect(640, 272, 0, 44),
+            reduce_crops([CropRect(640, 270, 0, 45)], 640, 360),
+        )
+        # Too small to be worth cropping
+        self.assertIsNone(reduce_crops([CropRect(636, 356, 2, 2)], 640, 360))
+        self.assertIsNone(reduce_crops([None], 640, 360))
+
+    def test_filter_chain(self):
+        metadata = FakeMetadata(CropRect(640, 272, 0, 44))
+        config = ConvertConfig(auto_crop=True, scale=240)
+        chain = create_filter_chain(config, metadata)
+        # The scale factor is the same as without cropping
+        self.assertEqual("crop=640:272:0:44,scale=-2:180", chain.build())
+        chain = create_filter_chain(config._replace(auto_crop=False), metadata)
+        self.assertEqual("scale=-2:240", chain.build())
+
+    def test_filter_chain_without_metadata(self):
+        chain = create_filter_chain(ConvertConfig(auto_crop=True), None)
+        self.assertIsNone(chain.build())
+
+    def test_find_crop(self):
+        with TemporaryDirectory() as tmp:
+            input = os.path.join(tmp, "input.mkv")
+            _create_letterboxed_video(input)
+            metadata = extract_metadata(input)
+            with AnalysisCache(os.path.join(tmp, "cache.shelve")) as cache:
+                crop = find_crop(input, metadata, windows=3, frames=10, cache=cache)
+                self.assertEqual(CropRect(640, 272, 0, 44), crop)
+                self.assertAlmostEqual(0.24, crop.removed_ratio(640, 360), delta=0.01)
+                self.assertEqual(crop, cache.get(input, "crop:3:10:24"))
+
+    def test_convert(self):
+        with TemporaryDirectory() as tmp, NamedTemporaryFile(suffix=".mkv") as output:
+            input = os.path.join(tmp, "input.mkv")
+            _create_letterboxed_video(input)
+            config = ConvertConfig(auto_crop=True, preset="ultrafast")
+            ret = convert_with_config(input, output.name, config, overwrite=True)
+            self.assertEqual(0, ret)
+            video = extract_metadata(output.name).video_streams[0]
+            self.assertEqual(640, video.width)
+            self.assertEqual(272, video.height)
+
+    def test_combine_subtitles(self):
+        with TemporaryDirectory() as tmp:
+            input = os.path.join(tmp, "input.mkv")
+            _create_letterboxed_video(input, audio=True)
+            srt = os.path.join(tmp, "input.srt")
+            with open(srt, "w") as f:
+                f.write("1\n00:00:01,000 --> 00:00:02,000\nText\n")
+            output = os.path.join(tmp, "output.mkv")
+            ns = vars(
+                build_argparse().parse_args(
+                    [
+                        "combine-subtitles",
+                        "--convert",
+                        "--auto-crop",
+                        "-l",
+                        "eng",
+                        input,
+                        srt,
+                        output,
+                    ]
+                )
+            )
+            COMMANDS["combine-subtitles"].execute(ns)
+            metadata = extract_metadata(output)
+            self.assertEqual(272, metadata.video_streams[0].height)
+            self.assertEqual(1, len(metadata.subtitle_streams))
@@ -0,0 +1,73 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from media_management_scripts.support.cache import AnalysisCache
+from media_management_scripts.support.dupes import (
+    BKTree,
+    Signature,
+    compute_signatures,
+    difference_hash,
+    find_duplicates,
+    hamming,
+    rank_duplicates,
+)
+from media_management_scripts.support.executables import execute_with_output, ffmpeg
+from media_management_scripts.utils import extract_metadata
+
+
+def _create_video(file, source, size, crf, length=10):
+    ret, output = execute_with_output(
+        [ffmpeg(), "-y", "-f", "lavfi", "-i", "{}=size={}:rate=25".format(source, size)]
+        + ["-t", str(length), "-c:v", "libx264", "-preset", "ultrafast"]
+        + ["-crf", str(crf), file]
+    )
+    if ret != 0:
+        raise Exception("Failed to create test video: {}".format(output))
+
+
+class DupesTestCase(unittest.TestCase):
+    def test_difference_hash(self):
+        # Each row decreases then increases
+        row = bytes([9, 8, 7, 6, 5, 6, 7, 8, 9])
+        self.assertEqual(0xF0F0, difference_hash(row * 2, height=2))
+
+    def test_bk_tree(self):
+        tree = BKTree(hamming)
+        for i in range(64):
+            tree.add(i, str(i))
+        self.assertEqual(64, len(tree))
+        found = sorted(item for _, _, item in tree.search(0b101, 1))
+        self.assertEqual(
+            sorted(str(i) for i in range(64) if hamming(i, 0b101) <= 1), found
+        )
+
+    def test_find_duplicates(self):
+        signatures = {
+            "a": Signature(100, (0, 0xFF)),
+            "b": Signature(101, (1, 0xFF)),
+            # Different duration
+            "c": Signature(200, (0, 0xFF)),
+            "d": Signature(199, (0xFFFF, 0)),
+            "e": Signature(201, (0, 0xFE)),
+        }
+        self.assertEqual([["a", "b"], ["c", "e"]], find_duplicates(signatures, 1))
+        self.assertEqual([], find_duplicates(signatures, 0))
+
+    def test_library(self):
+        with TemporaryDirectory() as tmp:
+            original = os.path.join(tmp, "original.mkv")
+            copy = os.path.join(tmp, "copy.mkv")
+            other = os.path.join(tmp, "other.mkv")
+            _create_video(original, "testsrc2", "640x360", 18)
+            _create_video(copy, "testsrc2", "320x180", 35)
+            _create_video(other, "mandelbrot", "640x360", 18)
+            files = [original, copy, other]
+            with AnalysisCache(os.path.join(tmp, "cache.shelve")) as cache:
+                signatures = compute_signatures(files, frames=8, cache=cache)
+                self.assertEqual(signatures[copy], cache.get(copy, "dupes:8"))
+            self.assertEqual(3, len(signatures))
+            self.assertEqual([[copy, original]], find_duplicates(signatures))
+
+            ranked = rank_duplicates([extract_metadata(f) for f in [copy, original]])
+            self.assertEqual([original, copy], [m.file for m in ranked])
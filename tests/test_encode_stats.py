@@ -0,0 +1,75 @@
+import os
+import unittest
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+
+from media_management_scripts.convert import convert_with_config
+from media_management_scripts.support.encode_stats import (
+    EncodePredictor,
+    EncodeRecord,
+    EncodeStatsDatabase,
+)
+from media_management_scripts.support.test_video import create_test_video
+from media_management_scripts.utils import ConvertConfig, extract_metadata
+
+
+def _record(crf=18, elapsed=10.0, output_size=1000 * 1000):
+    return EncodeRecord(
+        input="input.mkv",
+        source_codec="h264",
+        width=1000,
+        height=100,
+        duration=10.0,
+        video_codec="libx264",
+        preset="veryfast",
+        crf=crf,
+        hardware=False,
+        fps=None,
+        elapsed=elapsed,
+        input_size=2 * output_size,
+        output_size=output_size,
+    )
+
+
+class EncodePredictorTestCase(unittest.TestCase):
+    def test_estimate(self):
+        config = ConvertConfig(crf=18, preset="veryfast")
+        with (
+            create_test_video(length=4) as file,
+            TemporaryDirectory() as tmp,
+            EncodeStatsDatabase(os.path.join(tmp, "stats.db")) as db,
+        ):
+            metadata = extract_metadata(file.name)
+            predictor = EncodePredictor(db)
+            self.assertIsNone(predictor.estimate(metadata, config).seconds)
+
+            for _ in range(3):
+                db.record(_record())
+            video = metadata.video_streams[0]
+            pixel_seconds = video.width * video.height * metadata.estimated_duration
+
+            estimate = predictor.estimate(metadata, config)
+            self.assertEqual(3, estimate.records)
+            # 1000x100 at 1 second of media per wall second
+            self.assertAlmostEqual(pixel_seconds / (1000 * 100), estimate.seconds)
+            self.assertAlmostEqual(pixel_seconds, estimate.size, delta=1)
+
+            # +6 CRF is half the size
+            estimate = predictor.estimate(metadata, config._replace(crf=24))
+            self.assertAlmostEqual(pixel_seconds / 2, estimate.size, delta=1)
+
+    def test_convert_records(self):
+        config = ConvertConfig(preset="ultrafast")
+        with (
+            create_test_video(length=3) as file,
+            NamedTemporaryFile(suffix=".mkv") as output,
+            TemporaryDirectory() as tmp,
+            EncodeStatsDatabase(os.path.join(tmp, "stats.db")) as db,
+        ):
+            ret = convert_with_config(
+                file.name, output.name, config, overwrite=True, stats_db=db
+            )
+            self.assertEqual(0, ret)
+            records = db.find(config.video_codec, False)
+            self.assertEqual(1, len(records))
+            self.assertEqual(os.path.getsize(output.name), records[0].output_size)
+            self.assertAlmostEqual(3, records[0].duration, delta=0.1)
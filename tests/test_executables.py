@@ -0,0 +1,68 @@
+import os
+import sys
+import unittest
+from tempfile import TemporaryDirectory
+
+from media_management_scripts.support.executables import (
+    OutputCapture,
+    execute_with_output,
+)
+
+
+def _progress(i):
+    return "frame={:5d} fps= 30 q=28.0 size=    {}kB time=00:00:{:02d}.00 bitrate=1.0kbits/s speed=1x".format(
+        i, i, i % 60
+    )
+
+
+class OutputCaptureTestCase(unittest.TestCase):
+    def test_unbounded(self):
+        capture = OutputCapture()
+        capture.write("a\r")
+        capture.write("b\n")
+        self.assertEqual("a\rb\n", capture.getvalue())
+
+    def test_bounded(self):
+        capture = OutputCapture(max_lines=3)
+        for i in range(10):
+            capture.write("line {}\n".format(i))
+        self.assertEqual("line 7\nline 8\nline 9", capture.getvalue())
+
+    def test_progress_dropped(self):
+        capture = OutputCapture(max_lines=3)
+        capture.write("Input #0\n")
+        for i in range(100):
+            capture.write(_progress(i) + "\r")
+        capture.write("error\n")
+        # One character at a time, like execute_with_output
+        for c in "other\r\nend":
+            capture.write(c)
+        self.assertEqual(
+            "\n".join(["Input #0", "error", "other", "end", _progress(99)]),
+            capture.getvalue(),
+        )
+
+    def test_log_file(self):
+        with TemporaryDirectory() as tmp:
+            log_file = os.path.join(tmp, "out.log")
+            capture = OutputCapture(max_lines=1, log_file=log_file)
+            text = "".join(_progress(i) + "\r" for i in range(10)) + "a\nb\n"
+            capture.write(text)
+            capture.close()
+            self.assertEqual("b\n" + _progress(9), capture.getvalue())
+            with open(log_file, newline="") as f:
+                self.assertEqual(text, f.read())
+
+
+class ExecuteWithOutputTestCase(unittest.TestCase):
+    def test_max_lines(self):
+        with TemporaryDirectory() as tmp:
+            log_file = os.path.join(tmp, "out.log")
+            args = [sys.executable, "-c", "for i in range(1000): print(i)"]
+            ret, output = execute_with_output(
+                args, use_nice=False, max_lines=2, log_file=log_file
+            )
+            self.assertEqual(0, ret)
+            self.assertEqual("998\n999", output)
+            with open(log_file) as f:
+                self.assertEqual(1000, len(f.read().splitlines()))
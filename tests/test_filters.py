@@ -0,0 +1,45 @@
+import unittest
+
+from media_management_scripts.support.filters import VideoFilterChain
+
+
+class VideoFilterChainTestCase(unittest.TestCase):
+    def test_empty(self):
+        chain = VideoFilterChain()
+        self.assertFalse(chain)
+        self.assertIsNone(chain.build())
+        self.assertEqual([], chain.to_args())
+        self.assertEqual([], chain.thread_args())
+
+    def test_order(self):
+        chain = VideoFilterChain().format("yuv420p").scale(480).deinterlace()
+        chain.crop(1920, 800, 0, 140)
+        self.assertEqual(
+            "crop=1920:800:0:140,yadif,scale=-2:480,format=yuv420p", chain.build()
+        )
+        self.assertEqual(["-vf", chain.build()], chain.to_args())
+
+    def test_replace(self):
+        chain = VideoFilterChain().scale(720).scale(480)
+        self.assertEqual("scale=-2:480", chain.build())
+
+    def test_nvidia(self):
+        chain = VideoFilterChain(hardware_nvidia=True).scale(480).deinterlace()
+        self.assertEqual("yadif_cuda,scale_cuda=-2:480", chain.build())
+        with self.assertRaises(Exception):
+            chain.crop(100, 100)
+
+    def test_threads(self):
+        chain = VideoFilterChain(filter_threads=4)
+        self.assertEqual(["-filter_threads", "4"], chain.thread_args())
+        self.assertEqual(
+            ["-filter_complex_threads", "4"], chain.thread_args(complex_graph=True)
+        )
+
+    def test_split(self):
+        chain = VideoFilterChain().deinterlace().scale(480)
+        graph, labels = chain.build_split([None, 480])
+        self.assertEqual(
+            "[0:v]yadif,split=2[s0][s1];[s0]null[v0];[s1]scale=-2:480[v1]", graph
+        )
+        self.assertEqual(["v0", "v1"], labels)
@@ -12,3 +12,9 @@ class FormattingTestCase(unittest.TestCase):
         self.assertAlmostEqual(3601, formatting.duration_from_str("1h00m1s"))
         self.assertAlmostEqual(3790, formatting.duration_from_str("1h3m10s"))
         self.assertAlmostEqual(3790.01, formatting.duration_from_str("1h3m10.01s"))
+
+    def test_size_from_str(self):
+        self.assertEqual(100, formatting.size_from_str("100"))
+        self.assertEqual(700 * 1024**2, formatting.size_from_str("700M"))
+        self.assertEqual(2 * 1024**3, formatting.size_from_str("2G"))
+        self.assertEqual(int(1.5 * 1024**3), formatting.size_from_str("1.5GB"))
@@ -0,0 +1,61 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from media_management_scripts.support import frames
+from media_management_scripts.support.frames import (
+    map_windows,
+    sample_frames,
+    scaled_height,
+)
+from media_management_scripts.utils import extract_metadata
+from tests import create_keyframe_video
+
+
+class FramesTestCase(unittest.TestCase):
+    def test_sample_frames(self):
+        with TemporaryDirectory() as tmp:
+            input = os.path.join(tmp, "input.mkv")
+            create_keyframe_video(input, length=10)
+            metadata = extract_metadata(input)
+            height = scaled_height(metadata, 32)
+            self.assertEqual(24, height)
+
+            batches = []
+            for batch in sample_frames(
+                input, 32, height, fps=2, start=3, end=5, batch_size=3
+            ):
+                self.assertEqual(32 * 24, batch.frame_size)
+                self.assertEqual(32 * 24, len(bytes(batch.frame(0))))
+                batches.append(batch.times)
+            self.assertEqual([[3, 3.5, 4], [4.5]], batches)
+
+            times = [
+                t
+                for batch in sample_frames(input, 32, height, keyframes_only=True)
+                for t in batch.times
+            ]
+            self.assertEqual([0, 2, 4, 6, 8], times)
+
+    def test_map_windows(self):
+        with TemporaryDirectory() as tmp:
+            input = os.path.join(tmp, "input.mkv")
+            create_keyframe_video(input, length=10)
+            counts = map_windows(
+                input,
+                [(0, 2), (5, None)],
+                lambda batches: sum(b.count for b in batches),
+                width=16,
+                height=12,
+                pix_fmt="rgb24",
+            )
+            self.assertEqual([50, 125], counts)
+
+    @unittest.skipIf(frames.numpy is None, "numpy is not installed")
+    def test_numpy(self):
+        with TemporaryDirectory() as tmp:
+            input = os.path.join(tmp, "input.mkv")
+            create_keyframe_video(input, length=2)
+            batch = next(sample_frames(input, 16, 12, pix_fmt="rgb24", batch_size=4))
+            self.assertEqual((4, 12, 16, 3), batch.frames.shape)
+            self.assertEqual((12, 16, 3), batch.frame(0).shape)
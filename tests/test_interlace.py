@@ -0,0 +1,167 @@
+import unittest
+from tempfile import NamedTemporaryFile
+
+from media_management_scripts.support.encoding import VideoCodec
+from media_management_scripts.support.executables import execute_with_output, ffmpeg
+from media_management_scripts.support.filters import create_filter_chain
+from media_management_scripts.support.interlace import (
+    InterlaceGroup,
+    InterlaceMap,
+    InterlaceReport,
+    InterlaceSegment,
+    RepeatedFields,
+    _parse_output,
+    _window_bounds,
+    find_interlace_map,
+    is_confident,
+)
+from media_management_scripts.support.telecine import (
+    INVERSE_TELECINE_FILTER,
+    ScanType,
+    classify,
+    detect_scan_type,
+)
+from media_management_scripts.support.test_video import (
+    VideoDefinition,
+    create_test_video,
+)
+from media_management_scripts.utils import ConvertConfig, extract_metadata
+
+
+def _report(interlaced, progressive, undetermined=0):
+    group = InterlaceGroup(interlaced, 0, progressive, undetermined)
+    return InterlaceReport(group, group)
+
+
+class FakeMetadata:
+    def __init__(self, interlace_map, interlace_report=None):
+        self.interlace_map = interlace_map
+        self.interlace_report = interlace_report
+
+
+def _map(*interlaced):
+    return InterlaceMap(
+        [
+            InterlaceSegment(
+                i * 10, (i + 1) * 10, _report(100 if x else 0, 0 if x else 100)
+            )
+            for i, x in enumerate(interlaced)
+        ]
+    )
+
+
+class InterlaceTestCase(unittest.TestCase):
+    def test_window_bounds(self):
+        self.assertEqual([(0, None)], _window_bounds(None, 4))
+        self.assertEqual([(0, 50), (50, 100)], _window_bounds(100, 2))
+        # Skips the start of long files
+        self.assertEqual([(180, 590), (590, 1000)], _window_bounds(1000, 2))
+
+    def test_confident(self):
+        self.assertTrue(is_confident(_report(0, 200)))
+        self.assertTrue(is_confident(_report(190, 10)))
+        self.assertFalse(is_confident(_report(0, 0)))
+        self.assertFalse(is_confident(_report(0, 2)))
+        # Close to the threshold
+        self.assertFalse(is_confident(_report(52, 48)))
+        self.assertFalse(is_confident(_report(0, 100, 100)))
+
+    def test_interlaced_ranges(self):
+        interlace_map = _map(True, True, False, True)
+        self.assertEqual([(0, 20), (30, 40)], interlace_map.interlaced_ranges())
+        self.assertTrue(interlace_map.is_mixed())
+        self.assertEqual(600, interlace_map.report.interlaced)
+
+    def test_filter_chain(self):
+        config = ConvertConfig(deinterlace=True, deinterlace_segments=True, start=5)
+        chain = create_filter_chain(config, FakeMetadata(_map(True, False, True)))
+        self.assertEqual(
+            "yadif=enable='between(t,0.000,5.000)+between(t,15.000,25.000)'",
+            chain.build(),
+        )
+        # Not mixed, so deinterlace everything
+        chain = create_filter_chain(config, FakeMetadata(_map(True, True)))
+        self.assertEqual("yadif", chain.build())
+        chain = create_filter_chain(config, FakeMetadata(_map(False, False)))
+        self.assertIsNone(chain.build())
+
+    def test_find_interlace_map(self):
+        with create_test_video(
+            length=4,
+            video_def=VideoDefinition(codec=VideoCodec.MPEG2, interlaced=True),
+        ) as file:
+            metadata = extract_metadata(file.name)
+            interlace_map = find_interlace_map(
+                file.name, metadata, segment_length=2, frames=30
+            )
+            self.assertEqual(2, len(interlace_map.segments))
+            self.assertTrue(interlace_map.report.is_interlaced(0.4))
+
+
+IDET_OUTPUT = """frame=  100 fps=0.0 q=-0.0 Lsize=N/A time=00:00:04.17 bitrate=N/A speed=20.1x
+[Parsed_idet_0 @ 0x55d0c8a3c740] Repeated Fields: Neither:    68 Top:    16 Bottom:    17
+[Parsed_idet_0 @ 0x55d0c8a3c740] Single frame detection: TFF:    80 BFF:     0 Progressive:     8 Undetermined:    13
+[Parsed_idet_0 @ 0x55d0c8a3c740] Multi frame detection: TFF:   100 BFF:     0 Progressive:     0 Undetermined:     1
+"""
+
+
+class TelecineTestCase(unittest.TestCase):
+    def test_parse_output(self):
+        report = _parse_output(IDET_OUTPUT)
+        self.assertEqual(RepeatedFields(68, 16, 17), report.repeated)
+        self.assertEqual(InterlaceGroup(100, 0, 0, 1), report.multi)
+        self.assertAlmostEqual(33 / 101, report.repeated.ratio)
+
+    def test_classify(self):
+        telecined = _parse_output(IDET_OUTPUT)
+        self.assertEqual(ScanType.TELECINED, classify(telecined))
+        # Field doubled interlacing repeats nearly every field
+        interlaced = telecined._replace(repeated=RepeatedFields(10, 45, 45))
+        self.assertEqual(ScanType.INTERLACED, classify(interlaced))
+        # Only ever repeating one field is not a pulldown cadence
+        interlaced = telecined._replace(repeated=RepeatedFields(68, 33, 0))
+        self.assertEqual(ScanType.INTERLACED, classify(interlaced))
+        # Reports from before repeated fields were parsed
+        self.assertEqual(ScanType.INTERLACED, classify(_report(100, 0)))
+        self.assertEqual(ScanType.PROGRESSIVE, classify(_report(0, 100)))
+
+    def test_filter_chain(self):
+        metadata = FakeMetadata(None, _parse_output(IDET_OUTPUT))
+        config = ConvertConfig(deinterlace=True)
+        chain = create_filter_chain(config, metadata)
+        self.assertEqual(INVERSE_TELECINE_FILTER, chain.build())
+
+        config = config._replace(inverse_telecine=False)
+        chain = create_filter_chain(config, metadata)
+        self.assertEqual("yadif", chain.build())
+
+    def test_detect_scan_type(self):
+        with NamedTemporaryFile(suffix=".mkv") as file:
+            ret, output = execute_with_output(
+                [
+                    ffmpeg(),
+                    "-y",
+                    "-f",
+                    "lavfi",
+                    "-i",
+                    "testsrc=size=720x480:rate=24000/1001",
+                    "-t",
+                    "4",
+                    "-vf",
+                    "telecine=pattern=23",
+                    "-c:v",
+                    "mpeg2video",
+                    "-flags",
+                    "+ilme+ildct",
+                    file.name,
+                ]
+            )
+            self.assertEqual(0, ret, output)
+            metadata = extract_metadata(file.name)
+            self.assertEqual(ScanType.TELECINED, detect_scan_type(file.name, metadata))
+
+        with create_test_video(length=4) as file:
+            metadata = extract_metadata(file.name)
+            self.assertEqual(
+                ScanType.PROGRESSIVE, detect_scan_type(file.name, metadata)
+            )
@@ -0,0 +1,164 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from media_management_scripts.convert import convert_with_config
+from media_management_scripts.support.cache import AnalysisCache
+from media_management_scripts.support.executables import execute_with_output, ffmpeg
+from media_management_scripts.support.intro import (
+    SEGMENTS_CACHE_KEY,
+    Segment,
+    SegmentKind,
+    detect_segments,
+    longest_match,
+    season_files,
+    segment_chapters,
+    trim_segments,
+)
+from media_management_scripts.support.metadata import Chapter
+from media_management_scripts.utils import ConvertConfig, extract_metadata
+from tests import create_keyframe_video
+
+SOURCE = "{},scale=320:240,fps=25,format=yuv420p,setsar=1"
+
+
+def _create_episode(file, seed):
+    """
+    Creates an 85 second episode: 20s cold open, 20s intro, 30s episode, 15s credits
+    """
+    sources = [
+        ("life=size=320x240:seed={}:ratio=0.5".format(seed), 20),
+        ("testsrc2=size=320x240", 20),
+        ("life=size=320x240:seed={}:ratio=0.5".format(seed + 100), 30),
+        ("mandelbrot=size=320x240", 15),
+    ]
+    args = [ffmpeg(), "-y"]
+    for source, length in sources:
+        args.extend(["-f", "lavfi", "-t", str(length), "-i", SOURCE.format(source)])
+    args.extend(["-filter_complex", "concat=n={}".format(len(sources))])
+    args.extend(["-c:v", "libx264", "-preset", "ultrafast", file])
+    ret, output = execute_with_output(args)
+    if ret != 0:
+        raise Exception("Failed to create test video: {}".format(output))
+
+
+class IntroTestCase(unittest.TestCase):
+    def test_longest_match(self):
+        a = (1, 2, 3, 4, 5, 6, 7, 8)
+        b = (99, 98, 3, 4, 5, 97, 7, 8, 96)
+        # b[2:9] matches a[2:8] with a one second gap
+        self.assertEqual((6, 2, 2), longest_match(a, b, threshold=0, max_gap=1))
+        self.assertEqual((3, 2, 2), longest_match(a, b, threshold=0, max_gap=0))
+        # Shifted
+        self.assertEqual(
+            (3, 0, 4), longest_match((7, 8, 9), (0, 0, 0, 0, 7, 8, 9), threshold=0)
+        )
+        self.assertIsNone(longest_match((), (1,)))
+
+    def test_trim_segments(self):
+        intro = Segment(SegmentKind.INTRO, 0, 30)
+        middle = Segment(SegmentKind.INTRO, 60, 90)
+        credits = Segment(SegmentKind.CREDITS, 1270, 1300)
+        self.assertEqual(
+            (30, 1270, [middle]), trim_segments([intro, middle, credits], 1300)
+        )
+        self.assertEqual((None, None, []), trim_segments([], 1300))
+
+    def test_segment_chapters(self):
+        segments = [
+            Segment(SegmentKind.INTRO, 60, 90),
+            Segment(SegmentKind.CREDITS, 1270, 1300),
+        ]
+        self.assertEqual(
+            [
+                (0, 60, "Chapter"),
+                (60, 90, "Intro"),
+                (90, 1270, "Chapter"),
+                (1270, 1300, "Credits"),
+            ],
+            segment_chapters(segments, 1300),
+        )
+        chapters = [
+            Chapter({"id": 0, "start_time": "0", "end_time": "600", "tags": {}}),
+            Chapter(
+                {
+                    "id": 1,
+                    "start_time": "600",
+                    "end_time": "1300",
+                    "tags": {"title": "Two"},
+                }
+            ),
+        ]
+        self.assertEqual(
+            [
+                (0, 30, "Intro"),
+                (30, 540, "Chapter"),
+                (540, 1210, "Two"),
+                (1210, 1240, "Credits"),
+            ],
+            segment_chapters(segments, 1300, chapters, offset=60),
+        )
+
+    def test_detect_segments(self):
+        with TemporaryDirectory() as tmp:
+            for i in range(3):
+                _create_episode(os.path.join(tmp, "S01E0{}.mkv".format(i + 1)), i)
+            files = season_files(tmp)
+            self.assertEqual(
+                [os.path.join(tmp, "S01E0{}.mkv".format(i + 1)) for i in range(3)],
+                files,
+            )
+            with AnalysisCache(os.path.join(tmp, "cache.shelve")) as cache:
+                results = detect_segments(files, head=60, tail=40, cache=cache)
+                for file in files:
+                    intro, credits = results[file]
+                    self.assertEqual(SegmentKind.INTRO, intro.kind)
+                    self.assertAlmostEqual(20, intro.start, delta=1)
+                    self.assertAlmostEqual(40, intro.end, delta=1)
+                    self.assertEqual(SegmentKind.CREDITS, credits.kind)
+                    self.assertAlmostEqual(70, credits.start, delta=1)
+                    self.assertAlmostEqual(85, credits.end, delta=1)
+                    self.assertEqual(results[file], cache.get(file, SEGMENTS_CACHE_KEY))
+
+    def test_convert(self):
+        with TemporaryDirectory() as tmp:
+            input = os.path.join(tmp, "input.mkv")
+            create_keyframe_video(input, length=10)
+            segments = [
+                Segment(SegmentKind.INTRO, 0, 2),
+                Segment(SegmentKind.INTRO, 4, 6),
+                Segment(SegmentKind.CREDITS, 8, 10),
+            ]
+            with AnalysisCache(os.path.join(tmp, "cache.shelve")) as cache:
+                cache.put(input, SEGMENTS_CACHE_KEY, segments)
+                config = ConvertConfig(preset="ultrafast", segments="chapter")
+                output = os.path.join(tmp, "chapter.mkv")
+                ret = convert_with_config(
+                    input, output, config, print_output=False, cache=cache
+                )
+                self.assertEqual(0, ret)
+                chapters = extract_metadata(output).chapters
+                self.assertEqual(
+                    ["Intro", "Chapter", "Intro", "Chapter", "Credits"],
+                    [c.title for c in chapters],
+                )
+
+                # The middle intro cannot be dropped
+                output = os.path.join(tmp, "drop.mkv")
+                ret = convert_with_config(
+                    input,
+                    output,
+                    config._replace(segments="drop"),
+                    print_output=False,
+                    cache=cache,
+                )
+                self.assertEqual(0, ret)
+                metadata = extract_metadata(output)
+                self.assertAlmostEqual(6, metadata.estimated_duration, delta=0.1)
+                self.assertEqual(
+                    [("Chapter", 0, 2), ("Intro", 2, 4), ("Chapter", 4, 6)],
+                    [
+                        (c.title, round(c.start_time), round(c.end_time))
+                        for c in metadata.chapters
+                    ],
+                )
@@ -0,0 +1,63 @@
+import os
+import unittest
+from array import array
+from tempfile import TemporaryDirectory
+
+from media_management_scripts.support.keyframes import (
+    Keyframe,
+    KeyframeIndex,
+    _parse_packet,
+    scan_keyframes,
+)
+from media_management_scripts.utils import create_metadata_extractor
+from tests import create_keyframe_video
+
+
+def _index(*times):
+    return KeyframeIndex(array("d", times), array("q", range(len(times))))
+
+
+class KeyframeIndexTestCase(unittest.TestCase):
+    def test_parse_packet(self):
+        self.assertEqual((2.0, 31365), _parse_packet("2.000000,1.920000,31365,K__\n"))
+        self.assertEqual((2.0, -1), _parse_packet("N/A,2.000000,N/A,K_\n"))
+        self.assertIsNone(_parse_packet("2.040000,1.960000,31999,___\n"))
+
+    def test_lookup(self):
+        index = _index(0, 2, 4, 6)
+        self.assertEqual(Keyframe(2, 1), index.before(3.9))
+        self.assertEqual(Keyframe(4, 2), index.before(4))
+        self.assertEqual(Keyframe(4, 2), index.after(2.1))
+        self.assertEqual(Keyframe(4, 2), index.nearest(3.5))
+        self.assertEqual(Keyframe(2, 1), index.nearest(2.5))
+        self.assertIsNone(index.before(-1))
+        self.assertIsNone(index.after(6.1))
+        self.assertIsNone(_index().nearest(1))
+
+    def test_seek_position(self):
+        index = _index(0, 2, 4, 6)
+        self.assertEqual((None, 0), index.seek_position(1.5))
+        self.assertEqual((4.5, 4), index.seek_position(5.9))
+        self.assertEqual((6.5, 6), index.seek_position(100))
+        # Short GOPs seek halfway to the next keyframe
+        self.assertEqual((2.25, 2), _index(0, 2, 2.5).seek_position(2.4))
+
+    def test_bytes(self):
+        index = _index(0, 2.5, 4.25)
+        blob = index.to_bytes()
+        self.assertEqual(8 + 3 * 16, len(blob))
+        self.assertEqual(index, KeyframeIndex.from_bytes(blob))
+
+    def test_scan(self):
+        with TemporaryDirectory() as tmp:
+            file = os.path.join(tmp, "input.mkv")
+            create_keyframe_video(file)
+            index = scan_keyframes(file)
+            self.assertEqual([0, 2, 4, 6, 8], [k.time for k in index])
+            offsets = [k.offset for k in index]
+            self.assertEqual(sorted(offsets), offsets)
+
+            with create_metadata_extractor(os.path.join(tmp, "metadata.db")) as e:
+                metadata = e.add_keyframes(e.extract(file))
+                self.assertEqual(index, metadata.keyframes)
+                self.assertEqual(index.to_bytes(), e.db["keyframes:{}".format(file)])
@@ -0,0 +1,116 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from media_management_scripts.convert import convert_with_config
+from media_management_scripts.support.cache import AnalysisCache
+from media_management_scripts.support.crf_search import align_samples
+from media_management_scripts.support.executables import execute_with_output, ffmpeg
+from media_management_scripts.support.scenes import (
+    SceneIndex,
+    cache_key,
+    detect_scenes,
+    index_scenes,
+)
+from media_management_scripts.utils import ConvertConfig, extract_metadata
+
+SOURCE = "{}=size=320x240:rate=25,format=yuv420p"
+
+
+def _create_scenes_video(file):
+    """
+    Creates a 15 second video with cuts at 5 and 10 seconds
+    """
+    sources = ["testsrc2", "mandelbrot", "smptebars"]
+    args = [ffmpeg(), "-y"]
+    for source in sources:
+        args.extend(["-f", "lavfi", "-t", "5", "-i", SOURCE.format(source)])
+    args.extend(["-filter_complex", "concat=n={}".format(len(sources))])
+    args.extend(["-c:v", "libx264", "-preset", "ultrafast", file])
+    ret, output = execute_with_output(args)
+    if ret != 0:
+        raise Exception("Failed to create test video: {}".format(output))
+
+
+class SceneIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.scenes = SceneIndex([250, 100, 130], 400)
+
+    def test_nearest(self):
+        self.assertEqual(100, self.scenes.nearest(90))
+        self.assertEqual(130, self.scenes.nearest(120))
+        self.assertEqual(250, self.scenes.nearest(390))
+        self.assertIsNone(self.scenes.nearest(390, max_distance=100))
+        self.assertIsNone(SceneIndex([], 10).nearest(5))
+
+    def test_scene_at(self):
+        self.assertEqual((0, 100), self.scenes.scene_at(50))
+        self.assertEqual((100, 130), self.scenes.scene_at(100))
+        self.assertEqual((250, 400), self.scenes.scene_at(300))
+
+    def test_representative_time(self):
+        self.assertEqual(115, self.scenes.representative_time(101, 20))
+        # The middle is too far, but stay away from the cut
+        self.assertEqual(101, self.scenes.representative_time(100.2, 5))
+        self.assertEqual(190, self.scenes.representative_time(190, 5))
+
+    def test_align(self):
+        self.assertEqual(100, self.scenes.align(95, 10))
+        self.assertEqual(80, self.scenes.align(80, 10))
+        # No room before the end
+        self.assertEqual(240, self.scenes.align(240, 20, end=260))
+
+    def test_chapters(self):
+        self.assertEqual(
+            [(0, 130, "Chapter 1"), (130, 250, "Chapter 2"), (250, 400, "Chapter 3")],
+            self.scenes.chapters(120),
+        )
+        # Without a nearby cut the chapter starts on time
+        self.assertEqual(
+            [(0, 100, "Chapter 1"), (100, 200, "Chapter 2"), (200, 350, "Chapter 3")],
+            SceneIndex([], 350).chapters(100),
+        )
+        self.assertEqual(
+            [(0, 30, "Chapter 1"), (30, 90, "Chapter 2"), (90, 150, "Chapter 3")],
+            self.scenes.chapters(60, offset=100, end=250),
+        )
+
+    def test_align_samples(self):
+        samples = [(95, 10), (105, 10), (300, 10)]
+        self.assertEqual(
+            [(100, 10), (105, 10), (300, 10)],
+            align_samples(samples, self.scenes, 400),
+        )
+        self.assertEqual([(0, 400)], align_samples([(0, 400)], self.scenes, 400))
+
+
+class DetectScenesTestCase(unittest.TestCase):
+    def test_detect_scenes(self):
+        with TemporaryDirectory() as tmp:
+            file = os.path.join(tmp, "scenes.mkv")
+            _create_scenes_video(file)
+            scenes = detect_scenes(file)
+            self.assertEqual([5, 10], list(scenes.cuts))
+            self.assertAlmostEqual(15, scenes.duration, delta=0.1)
+
+            with AnalysisCache(os.path.join(tmp, "cache.shelve")) as cache:
+                self.assertEqual(1, index_scenes([file], cache, print_output=False))
+                self.assertEqual(scenes, cache.get(file, cache_key()))
+                # Already indexed
+                self.assertEqual(0, index_scenes([file], cache, print_output=False))
+
+                config = ConvertConfig(preset="ultrafast", scene_chapters=4)
+                output = os.path.join(tmp, "output.mkv")
+                ret = convert_with_config(
+                    file, output, config, print_output=False, cache=cache
+                )
+                self.assertEqual(0, ret)
+                chapters = extract_metadata(output).chapters
+                self.assertEqual(
+                    [(0, 5), (5, 10), (10, 15)],
+                    [(round(c.start_time), round(c.end_time)) for c in chapters],
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
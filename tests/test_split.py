@@ -0,0 +1,75 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from media_management_scripts.support.executables import execute_with_output, ffmpeg
+from media_management_scripts.support.split import (
+    split_all_by_chapter,
+    split_by_chapter,
+)
+from media_management_scripts.utils import extract_metadata
+from tests import create_keyframe_video
+
+
+def _create_chapters_video(tmp, name, chapters=4, chapter_length=2):
+    """
+    Creates a video with chapters of chapter_length seconds each
+    """
+    video = os.path.join(tmp, "{}_video.mkv".format(name))
+    create_keyframe_video(video, length=chapters * chapter_length)
+    metadata_file = os.path.join(tmp, "{}_chapters.txt".format(name))
+    with open(metadata_file, "w") as f:
+        f.write(";FFMETADATA1\n")
+        for i in range(chapters):
+            f.write("[CHAPTER]\nTIMEBASE=1/1000\n")
+            f.write("START={}\n".format(i * chapter_length * 1000))
+            f.write("END={}\n".format((i + 1) * chapter_length * 1000))
+    output = os.path.join(tmp, "{}.mkv".format(name))
+    ret, out = execute_with_output(
+        [ffmpeg(), "-i", video, "-i", metadata_file, "-map", "0"]
+        + ["-map_metadata", "1", "-c", "copy", output]
+    )
+    if ret != 0:
+        raise Exception("Failed to create test video: {}".format(out))
+    return output
+
+
+class SplitTestCase(unittest.TestCase):
+    def test_split_by_chapter(self):
+        with TemporaryDirectory() as tmp:
+            input = _create_chapters_video(tmp, "input")
+            output_dir = os.path.join(tmp, "output")
+            self.assertEqual(2, split_by_chapter(input, output_dir, 2))
+            self.assertEqual(
+                ["title00.mkv", "title01.mkv"], sorted(os.listdir(output_dir))
+            )
+            for f in os.listdir(output_dir):
+                metadata = extract_metadata(os.path.join(output_dir, f))
+                self.assertAlmostEqual(4, metadata.estimated_duration, delta=0.1)
+
+            with self.assertRaises(Exception):
+                split_by_chapter(input, output_dir, 3)
+
+            # Already split
+            self.assertEqual(2, split_by_chapter(input, output_dir, 2))
+            # Partly split by an earlier run
+            os.remove(os.path.join(output_dir, "title01.mkv"))
+            with self.assertRaises(Exception):
+                split_by_chapter(input, output_dir, 2)
+            self.assertEqual(["title00.mkv"], os.listdir(output_dir))
+
+    def test_split_all_by_chapter(self):
+        with TemporaryDirectory() as tmp:
+            inputs = [
+                _create_chapters_video(tmp, "disc1", chapters=4),
+                _create_chapters_video(tmp, "disc2", chapters=2),
+            ]
+            output_dir = os.path.join(tmp, "output")
+            count = split_all_by_chapter(
+                inputs, output_dir, 2, initial_count=1, print_output=False
+            )
+            self.assertEqual(3, count)
+            self.assertEqual(
+                ["title01.mkv", "title02.mkv", "title03.mkv"],
+                sorted(os.listdir(output_dir)),
+            )
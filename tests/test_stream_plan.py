@@ -0,0 +1,117 @@
+import unittest
+
+from media_management_scripts.support.metadata import Stream
+from media_management_scripts.support.stream_plan import (
+    StreamAction,
+    create_stream_plan,
+)
+
+
+class FakeMetadata:
+    def __init__(self, streams):
+        self.streams = [Stream(s) for s in streams]
+        self.video_streams = [s for s in self.streams if s.is_video()]
+        self.audio_streams = [s for s in self.streams if s.is_audio()]
+        self.subtitle_streams = [s for s in self.streams if s.is_subtitle()]
+
+
+def _video(index):
+    return {"index": index, "codec_type": "video", "codec_name": "h264"}
+
+
+def _audio(index, codec, channels=2, title=None, comment=0):
+    s = {
+        "index": index,
+        "codec_type": "audio",
+        "codec_name": codec,
+        "channels": channels,
+        "disposition": {"comment": comment},
+        "tags": {"language": "eng"},
+    }
+    if title:
+        s["tags"]["title"] = title
+    return s
+
+
+def _subtitle(index, codec):
+    return {"index": index, "codec_type": "subtitle", "codec_name": codec}
+
+
+class StreamPlanTestCase(unittest.TestCase):
+    def test_copy_matching_audio(self):
+        metadata = FakeMetadata([_video(0), _audio(1, "aac"), _audio(2, "ac3", 6)])
+        plan = create_stream_plan(metadata, "aac", None, "out.mkv")
+        self.assertEqual(StreamAction.COPY, plan.audio[0].action)
+        self.assertEqual(StreamAction.TRANSCODE, plan.audio[1].action)
+        self.assertEqual(
+            [
+                "-map",
+                "0:0",
+                "-map",
+                "0:1",
+                "-c:a:0",
+                "copy",
+                "-map",
+                "0:2",
+                "-c:a:1",
+                "aac",
+            ],
+            plan.to_args(),
+        )
+
+    def test_6_1_audio(self):
+        metadata = FakeMetadata([_video(0), _audio(1, "dts", 7)])
+        plan = create_stream_plan(metadata, "aac", None, "out.mkv")
+        self.assertEqual(8, plan.audio[0].channels)
+        self.assertIn("-ac:a:0", plan.to_args())
+
+    def test_duplicate_commentary(self):
+        metadata = FakeMetadata(
+            [
+                _video(0),
+                _audio(1, "ac3", 6),
+                _audio(2, "ac3", 2, title="Director Commentary"),
+                _audio(3, "aac", 2, title="Director Commentary"),
+                _audio(4, "aac", 2, comment=1),
+            ]
+        )
+        plan = create_stream_plan(metadata, "aac", None, "out.mkv")
+        actions = [p.action for p in plan.audio]
+        self.assertEqual(
+            [
+                StreamAction.TRANSCODE,
+                StreamAction.TRANSCODE,
+                StreamAction.DROP,
+                StreamAction.COPY,
+            ],
+            actions,
+        )
+        plan = create_stream_plan(
+            metadata, "aac", None, "out.mkv", drop_duplicate_commentary=False
+        )
+        self.assertNotIn(StreamAction.DROP, [p.action for p in plan.audio])
+
+    def test_subtitles_mp4(self):
+        metadata = FakeMetadata(
+            [_video(0), _subtitle(1, "subrip"), _subtitle(2, "hdmv_pgs_subtitle")]
+        )
+        plan = create_stream_plan(metadata, "copy", "copy", "out.mp4")
+        self.assertEqual(StreamAction.TRANSCODE, plan.subtitles[0].action)
+        self.assertEqual("mov_text", plan.subtitles[0].codec)
+        self.assertEqual(StreamAction.DROP, plan.subtitles[1].action)
+
+        plan = create_stream_plan(metadata, "copy", "copy", "out.mkv")
+        self.assertEqual(StreamAction.COPY, plan.subtitles[0].action)
+        self.assertEqual(StreamAction.COPY, plan.subtitles[1].action)
+
+        plan = create_stream_plan(metadata, "copy", None, "out.mkv")
+        self.assertEqual([], plan.subtitles)
+
+    def test_mappings(self):
+        metadata = FakeMetadata([_video(0), _audio(1, "aac"), _audio(2, "ac3")])
+        plan = create_stream_plan(metadata, "copy", None, mappings=["a:1"])
+        self.assertEqual([], plan.video)
+        self.assertEqual(2, plan.audio[0].stream.index)
+        plan = create_stream_plan(metadata, "copy", None, mappings=[0, "0:2"])
+        self.assertEqual(0, plan.video[0].index)
+        self.assertEqual(2, plan.audio[0].stream.index)
@@ -0,0 +1,95 @@
+import filecmp
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from media_management_scripts.support.executables import execute_with_output, ffmpeg
+from media_management_scripts.support.thumbnails import (
+    FrameScore,
+    ThumbnailSelection,
+    _parse_scores,
+    create_thumbnails,
+    select_frame,
+    thumbnail_outputs,
+    thumbnail_times,
+)
+from media_management_scripts.utils import create_metadata_extractor
+from tests import create_keyframe_video
+
+METADATA_OUTPUT = """frame:0    pts:0       pts_time:0
+lavfi.blur=4.414987
+lavfi.signalstats.YMIN=12
+lavfi.signalstats.YAVG=126.03
+frame:1    pts:2000    pts_time:2
+lavfi.blur=1.5
+lavfi.signalstats.YAVG=16
+"""
+
+
+def _extract_frame(input, time, output):
+    ret, r = execute_with_output(
+        [ffmpeg(), "-y", "-ss", str(time), "-i", input, "-frames:v", "1", output]
+    )
+    if ret != 0:
+        raise Exception("Failed to extract frame: {}".format(r))
+
+
+class ThumbnailsTestCase(unittest.TestCase):
+    def test_times(self):
+        self.assertEqual([1.25, 3.75, 6.25, 8.75], thumbnail_times(0, 10, 4))
+        self.assertEqual([3, 5], thumbnail_times(2, 6, 2))
+
+    def test_outputs(self):
+        self.assertEqual(
+            ["/tmp/t1.png", "/tmp/t2.png"], thumbnail_outputs("/tmp/t.png", 2)
+        )
+        self.assertEqual("t01.jpg", thumbnail_outputs("t.jpg", 10)[0])
+
+    def test_select_frame(self):
+        scores = _parse_scores(METADATA_OUTPUT)
+        self.assertEqual([FrameScore(4.414987, 126.03), FrameScore(1.5, 16)], scores)
+        self.assertEqual(0, select_frame(scores, ThumbnailSelection.KEYFRAME))
+        self.assertEqual(0, select_frame(scores, ThumbnailSelection.LEAST_BLACK))
+        # The second frame is sharper, but black
+        self.assertEqual(0, select_frame(scores, ThumbnailSelection.SHARPEST))
+        scores.append(FrameScore(2.0, 100))
+        self.assertEqual(2, select_frame(scores, ThumbnailSelection.SHARPEST))
+        self.assertEqual(0, select_frame([], ThumbnailSelection.SHARPEST))
+
+    def test_create_thumbnails(self):
+        with TemporaryDirectory() as tmp:
+            input = os.path.join(tmp, "input.mkv")
+            create_keyframe_video(input, length=10)
+            outputs = create_thumbnails(input, os.path.join(tmp, "thumb.png"), count=4)
+            self.assertEqual(4, len(outputs))
+            # Each target is snapped back to the previous keyframe
+            for output, keyframe in zip(outputs, [0, 2, 6, 8]):
+                expected = os.path.join(tmp, "expected.png")
+                _extract_frame(input, keyframe, expected)
+                self.assertTrue(filecmp.cmp(expected, output, shallow=False))
+
+            # With a keyframe index, the nearest keyframe is used
+            with create_metadata_extractor(os.path.join(tmp, "metadata.db")) as e:
+                metadata = e.add_keyframes(e.extract(input))
+            outputs = create_thumbnails(
+                input, os.path.join(tmp, "nearest.png"), count=4, metadata=metadata
+            )
+            for output, keyframe in zip(outputs, [2, 4, 6, 8]):
+                expected = os.path.join(tmp, "expected.png")
+                _extract_frame(input, keyframe, expected)
+                self.assertTrue(filecmp.cmp(expected, output, shallow=False))
+
+    def test_create_thumbnails_sharpest(self):
+        with TemporaryDirectory() as tmp:
+            input = os.path.join(tmp, "input.mkv")
+            create_keyframe_video(input, length=10)
+            outputs = create_thumbnails(
+                input,
+                os.path.join(tmp, "thumb.jpg"),
+                count=2,
+                start=2,
+                selection=ThumbnailSelection.SHARPEST,
+            )
+            self.assertEqual(2, len(outputs))
+            for output in outputs:
+                self.assertTrue(os.path.getsize(output) > 0)
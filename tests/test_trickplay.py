@@ -0,0 +1,61 @@
+import json
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from media_management_scripts.support.trickplay import (
+    INDEX_FILE,
+    TrickplaySettings,
+    create_all_trickplay,
+    create_trickplay,
+    read_index,
+    trickplay_dir,
+)
+from media_management_scripts.utils import extract_metadata
+from tests import create_keyframe_video
+
+
+class TrickplayTestCase(unittest.TestCase):
+    def test_create_trickplay(self):
+        with TemporaryDirectory() as tmp:
+            input = os.path.join(tmp, "input.mkv")
+            create_keyframe_video(input, length=10, gop=25)
+            settings = TrickplaySettings(interval=1, width=160, columns=2, rows=2)
+            index = create_trickplay(input, settings=settings)
+            output_dir = trickplay_dir(input)
+            self.assertEqual(os.path.join(tmp, "input.trickplay"), output_dir)
+            self.assertEqual(120, index.height)
+            self.assertTrue(9 <= index.count <= 10)
+            self.assertEqual(3, len(index.sheets))
+            for sheet in index.sheets:
+                metadata = extract_metadata(os.path.join(output_dir, sheet))
+                self.assertEqual(320, metadata.video_streams[0].width)
+                self.assertEqual(240, metadata.video_streams[0].height)
+            with open(os.path.join(output_dir, INDEX_FILE)) as f:
+                self.assertEqual(index.to_dict(), json.load(f))
+            self.assertEqual(index, read_index(output_dir))
+
+            # Unchanged, so skipped
+            self.assertIsNone(create_trickplay(input, settings=settings))
+            # Different settings replace the sheets
+            index = create_trickplay(input, settings=settings._replace(columns=5))
+            self.assertEqual(["sheet001.jpg"], index.sheets)
+            self.assertEqual(
+                ["index.json", "sheet001.jpg"], sorted(os.listdir(output_dir))
+            )
+
+    def test_create_all_trickplay(self):
+        with TemporaryDirectory() as tmp:
+            files = [os.path.join(tmp, "{}.mkv".format(i)) for i in range(3)]
+            for f in files:
+                create_keyframe_video(f, length=4)
+            invalid = os.path.join(tmp, "invalid.mkv")
+            with open(invalid, "w") as f:
+                f.write("not a video")
+            settings = TrickplaySettings(interval=2)
+            self.assertEqual(
+                3, create_all_trickplay(files + [invalid], settings, print_output=False)
+            )
+            self.assertEqual(
+                0, create_all_trickplay(files, settings, print_output=False)
+            )
@@ -0,0 +1,110 @@
+import os
+import unittest
+from tempfile import TemporaryDirectory
+
+from media_management_scripts.convert import convert_with_config
+from media_management_scripts.support.cache import AnalysisCache
+from media_management_scripts.support.test_video import create_test_video
+from media_management_scripts.support.verify import (
+    VerifyMode,
+    compare_to_source,
+    decode_check,
+    sample_windows,
+    verify_files,
+    verify_output,
+)
+from media_management_scripts.utils import ConvertConfig, extract_metadata
+from tests import create_keyframe_video
+
+
+def _truncate(file, ratio=0.25):
+    size = os.path.getsize(file)
+    with open(file, "r+b") as f:
+        f.truncate(int(size * ratio))
+
+
+class VerifyTestCase(unittest.TestCase):
+    def test_sample_windows(self):
+        self.assertEqual([0.0], sample_windows(30, 5, 10))
+        self.assertEqual([5, 25, 45], sample_windows(60, 3, 10))
+
+    def test_decode_check(self):
+        with TemporaryDirectory() as tmp:
+            file = os.path.join(tmp, "video.mkv")
+            create_keyframe_video(file, length=30, gop=25)
+            for mode in VerifyMode:
+                self.assertEqual([], decode_check(file, mode), mode)
+            _truncate(file)
+            for mode in (VerifyMode.FULL, VerifyMode.KEYFRAMES):
+                errors = decode_check(file, mode)
+                self.assertTrue(errors, mode)
+                self.assertIn("Decoding stopped", errors[-1])
+
+    def test_verify_output(self):
+        with TemporaryDirectory() as tmp:
+            input = os.path.join(tmp, "input.mkv")
+            create_test_video(length=5, output_file=input)
+            config = ConvertConfig(preset="ultrafast")
+            output = os.path.join(tmp, "output.mkv")
+            self.assertEqual(
+                0, convert_with_config(input, output, config, print_output=False)
+            )
+            result = verify_output(input, output, config)
+            self.assertTrue(result.ok, result.errors)
+            self.assertEqual(VerifyMode.KEYFRAMES, result.mode)
+
+            source = extract_metadata(input)
+            converted = extract_metadata(output)
+            self.assertEqual(
+                ["Duration 5.0s does not match the expected 3.0s"],
+                compare_to_source(source, converted, config._replace(end=3)),
+            )
+
+            no_audio = os.path.join(tmp, "no_audio.mkv")
+            create_test_video(length=5, audio_defs=[], output_file=no_audio)
+            self.assertEqual(
+                ["0 audio streams, expected 1"],
+                compare_to_source(source, extract_metadata(no_audio), config),
+            )
+
+    def test_verify_files(self):
+        with TemporaryDirectory() as tmp:
+            good = os.path.join(tmp, "good.mkv")
+            bad = os.path.join(tmp, "bad.mkv")
+            create_keyframe_video(good, length=30, gop=25)
+            create_keyframe_video(bad, length=30, gop=25)
+            _truncate(bad)
+            with AnalysisCache(os.path.join(tmp, "cache.shelve")) as cache:
+                reported = []
+
+                def callback(result, cached):
+                    reported.append((result.file, result.ok, cached))
+
+                results = verify_files([good, bad], cache, VerifyMode.KEYFRAMES)
+                self.assertEqual([True, False], [r.ok for r in results])
+
+                # Unchanged files are not checked again, even after a rename
+                renamed = os.path.join(tmp, "renamed.mkv")
+                os.rename(good, renamed)
+                results = verify_files(
+                    [renamed, bad], cache, VerifyMode.KEYFRAMES, callback=callback
+                )
+                self.assertEqual(renamed, results[0].file)
+                self.assertEqual(
+                    [(bad, False, True), (renamed, True, True)], sorted(reported)
+                )
+
+                # A changed file is
+                create_keyframe_video(bad, length=20, gop=25)
+                reported.clear()
+                verify_files([bad], cache, VerifyMode.KEYFRAMES, callback=callback)
+                self.assertEqual([(bad, True, False)], reported)
+
+                # Another mode is a separate result
+                reported.clear()
+                verify_files([bad], cache, VerifyMode.SAMPLES, callback=callback)
+                self.assertEqual([(bad, True, False)], reported)
+
+
+if __name__ == "__main__":
+    unittest.main()